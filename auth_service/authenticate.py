@@ -1 +1,124 @@
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
 
+from auth_service.blacklist import blacklist_index
+from common.metrics import sync_to_async
+
+# Account fields copied into tokens, enough for permission checks and the current-user endpoints.
+ACCOUNT_CLAIMS = ('id', 'role', 'username', 'first_name', 'last_name')
+# Access token claim naming the refresh token it came from, which is what logout blacklists.
+REFRESH_JTI_CLAIM = 'rjti'
+
+
+def add_account_claims(token, account):
+    for claim in ACCOUNT_CLAIMS:
+        token[claim] = getattr(account, claim)
+    return token
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """
+    Refresh token carrying ``ACCOUNT_CLAIMS``; its access tokens inherit them
+    and carry its ``jti`` as ``REFRESH_JTI_CLAIM``.
+
+    The blacklist is checked against the in-process ``blacklist_index`` rather than queried.
+    """
+
+    def check_blacklist(self):
+        if self.payload[api_settings.JTI_CLAIM] in blacklist_index:
+            raise TokenError(_('Token is blacklisted'))
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        access[REFRESH_JTI_CLAIM] = self.payload[api_settings.JTI_CLAIM]
+        return access
+
+    @classmethod
+    def for_user(cls, user):
+        return add_account_claims(super().for_user(user), user)
+
+
+class ClaimsUser:
+    """
+    Request user built from access token claims without a query.
+
+    Anything beyond the claims, such as ``is_staff`` or ``date_joined``, loads
+    the full ``Account`` once and is read from it.
+    """
+
+    __slots__ = ('email', 'token', '_account') + ACCOUNT_CLAIMS
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, token):
+        self.token = token
+        self.email = token[api_settings.USER_ID_CLAIM]
+        for claim in ACCOUNT_CLAIMS:
+            setattr(self, claim, token[claim])
+        self._account = None
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def account(self):
+        if self._account is None:
+            self._account = get_user_model().objects.get(pk=self.id)
+        return self._account
+
+    def __getattr__(self, name):
+        # Only reached for attributes that are not claims.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.account, name)
+
+    def __eq__(self, other):
+        return getattr(other, 'pk', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.username
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    ``JWTAuthentication`` that trusts the account claims instead of loading the account.
+
+    The claims are as fresh as the access token, which lives for
+    ``settings.ACCESS_TOKEN_LIFETIME_MINUTES``. Until it expires a
+    deactivated account keeps working, a demoted admin keeps passing
+    ``IsAdminUser``, and the current-user endpoints return the names the
+    token was issued with, even right after the user's own update. A token
+    refresh re-reads the account. Tokens issued without the claims still get
+    the database lookup.
+    """
+
+    def get_user(self, validated_token):
+        if any(claim not in validated_token for claim in ACCOUNT_CLAIMS):
+            return super().get_user(validated_token)
+        return ClaimsUser(validated_token)
+
+    async def aauthenticate(self, request):
+        """
+        ``authenticate`` for async views; validating the token needs no I/O, so it runs on the event loop.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        if any(claim not in validated_token for claim in ACCOUNT_CLAIMS):
+            # Only tokens issued before the claims were added, none of which outlive ACCESS_TOKEN_LIFETIME.
+            return await sync_to_async(super().get_user)(validated_token), validated_token
+        return ClaimsUser(validated_token), validated_token
@@ -0,0 +1,81 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from common.cache import get_cache
+
+BLACKLIST_VERSION_KEY = 'auth_service:blacklist:version'
+# Rows this recent are read again on the next catch-up, in case a transaction that got a lower id commits late.
+SETTLE_TIME = timedelta(seconds=60)
+
+
+def get_blacklist_version():
+    return get_cache().get(BLACKLIST_VERSION_KEY)
+
+
+def bump_blacklist_version():
+    cache = get_cache()
+    try:
+        cache.incr(BLACKLIST_VERSION_KEY)
+    except ValueError:
+        cache.add(BLACKLIST_VERSION_KEY, 1, timeout=None)
+        cache.incr(BLACKLIST_VERSION_KEY)
+
+
+class BlacklistIndex:
+    """
+    Per-process copy of the blacklisted token ids, so token checks skip the blacklist table.
+
+    It catches up with rows above the highest settled id it has read,
+    whenever the shared blacklist version moves and at least every
+    ``refresh_interval`` seconds. With a shared cache a logout in any worker
+    is seen by the next check everywhere; with a per-process cache other
+    workers may accept the token for up to ``refresh_interval`` seconds.
+    Entries are dropped once their token expires, as simplejwt rejects those anyway.
+    A row deleted by hand before then keeps its token rejected until it expires.
+    """
+
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = (refresh_interval if refresh_interval is not None
+                                 else settings.TOKEN_BLACKLIST_REFRESH_INTERVAL)
+        self.expires = {}
+        self.watermark = 0
+        self.version = None
+        self.synced_at = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, jti):
+        self.sync()
+        return jti in self.expires
+
+    def is_stale(self, version):
+        return (self.synced_at is None or version != self.version
+                or time.monotonic() - self.synced_at >= self.refresh_interval)
+
+    def sync(self):
+        version = get_blacklist_version()
+        if not self.is_stale(version):
+            return
+        with self._lock:
+            if not self.is_stale(version):
+                return
+            synced_at = time.monotonic()
+            settled = timezone.now() - SETTLE_TIME
+            rows = (BlacklistedToken.objects.filter(id__gt=self.watermark).order_by('id')
+                    .values_list('id', 'blacklisted_at', 'token__jti', 'token__expires_at'))
+            watermark = self.watermark
+            for pk, blacklisted_at, jti, expires_at in rows:
+                self.expires[jti] = expires_at
+                if pk == watermark + 1 or blacklisted_at < settled:
+                    watermark = max(watermark, pk)
+            self.watermark = watermark
+            now = timezone.now()
+            self.expires = {jti: expires_at for jti, expires_at in self.expires.items() if expires_at > now}
+            self.version, self.synced_at = version, synced_at
+
+
+blacklist_index = BlacklistIndex()
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+class Command(BaseCommand):
+    help = ('Delete expired outstanding tokens and their blacklist entries in chunks. '
+            'Meant to run periodically, e.g. hourly from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1_000)
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between chunks to leave room for other writers.')
+
+    def handle(self, *args, **options):
+        # Unlike simplejwt's flushexpiredtokens, which deletes everything in one statement and one
+        # transaction, each chunk here is its own short transaction.
+        now = aware_utcnow()
+        outstanding = blacklisted = 0
+        while True:
+            ids = list(OutstandingToken.objects.filter(expires_at__lte=now)
+                       .order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            with transaction.atomic():
+                _, deleted = OutstandingToken.objects.filter(id__in=ids).delete()
+            outstanding += deleted.get('token_blacklist.OutstandingToken', 0)
+            blacklisted += deleted.get('token_blacklist.BlacklistedToken', 0)
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(f'Deleted {outstanding} expired outstanding tokens and {blacklisted} blacklist entries.')
@@ -1,3 +1,181 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from auth_service.authenticate import ClaimsRefreshToken, ClaimsUser
+from auth_service.blacklist import BlacklistIndex
+from common.constants import UserRole
+from user_accounts.models import Account
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret',
+            first_name='Ana', role=UserRole.PARENT.value)
+        self.admin = Account.objects.create_user(
+            username='admin@example.com', email='admin@example.com', password='secret', role=UserRole.ADMIN.value)
+
+    def authenticate(self, account):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {ClaimsRefreshToken.for_user(account).access_token}')
+
+    def test_login_issues_account_claims(self):
+        response = self.client.post('/user_accounts/login/', {'email': 'parent@example.com', 'password': 'secret'})
+
+        access = AccessToken(response.json()['access'])
+        self.assertEqual((access['id'], access['role'], access['first_name']),
+                         (self.parent.id, UserRole.PARENT.value, 'Ana'))
+
+    def test_hot_read_endpoints_do_not_query(self):
+        self.authenticate(self.parent)
+        with self.assertNumQueries(0):
+            me = self.client.get(f'/user_accounts/accounts/{self.parent.id}/')
+            protected = self.client.get('/user_accounts/protected/')
+            forbidden = self.client.get('/common/messages/export/')
+        self.assertEqual(me.json(), {'id': self.parent.id, 'username': 'parent@example.com',
+                                     'email': 'parent@example.com', 'first_name': 'Ana', 'last_name': '',
+                                     'role': UserRole.PARENT.value})
+        self.assertEqual(protected.status_code, 200)
+        self.assertEqual(forbidden.status_code, 403)
+
+        self.authenticate(self.admin)
+        with self.assertNumQueries(0):
+            response = self.client.get('/common/messages/export/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_account_is_loaded_once_beyond_the_claims(self):
+        user = ClaimsUser(ClaimsRefreshToken.for_user(self.parent).access_token)
+
+        with self.assertNumQueries(1):
+            self.assertFalse(user.is_staff)
+            self.assertEqual(user.date_joined, self.parent.date_joined)
+        self.assertEqual(user, self.parent)
+
+    def test_tokens_without_claims_fall_back_to_the_database(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {AccessToken.for_user(self.parent)}')
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/user_accounts/protected/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_refresh_picks_up_account_changes(self):
+        refresh = ClaimsRefreshToken.for_user(self.parent)
+        Account.objects.filter(pk=self.parent.pk).update(role=UserRole.STAFF.value)
+
+        response = self.client.post('/auth_service/token/refresh/', {'refresh': str(refresh)})
+
+        self.assertEqual(AccessToken(response.json()['access'])['role'], UserRole.STAFF.value)
+
+    def test_access_token_lifetime_is_configurable(self):
+        # Their claims are trusted until they expire, so a role change takes at most this long to apply.
+        access = ClaimsRefreshToken.for_user(self.parent).access_token
+
+        self.assertEqual(access['exp'] - access['iat'], settings.ACCESS_TOKEN_LIFETIME_MINUTES * 60)
+
+
+class TokenBlacklistTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        # A fresh index per test: rolled-back rows give their ids out again.
+        index = BlacklistIndex()
+        patcher = mock.patch('auth_service.authenticate.blacklist_index', index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        index.sync()
+
+    def refresh(self, token):
+        return self.client.post('/auth_service/token/refresh/', {'refresh': str(token)})
+
+    def logout(self, token):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/user_accounts/logout/', {'refresh': str(token)})
+
+    def outstanding(self, expires_in, blacklisted=False):
+        token = OutstandingToken.objects.create(
+            user=self.parent, jti=f'jti-{OutstandingToken.objects.count()}', token='-',
+            expires_at=timezone.now() + expires_in)
+        if blacklisted:
+            BlacklistedToken.objects.create(token=token)
+        return token
+
+    def test_refresh_checks_the_blacklist_without_querying_it(self):
+        token = ClaimsRefreshToken.for_user(self.parent)
+
+        with self.assertNumQueries(1):  # The account, for fresh claims.
+            self.assertEqual(self.refresh(token).status_code, 200)
+        self.assertEqual(self.logout(token).status_code, 200)
+        self.assertEqual(self.refresh(token).json(), {'error': 'Token is blacklisted'})
+        self.assertEqual(self.logout(token).status_code, 400)
+
+    def test_logout_is_seen_by_other_workers(self):
+        token = ClaimsRefreshToken.for_user(self.parent)
+        jti = token['jti']
+        # Each index stands in for another worker process sharing the database and cache.
+        other_worker, polling_worker = BlacklistIndex(refresh_interval=3600), BlacklistIndex(refresh_interval=0)
+        self.assertNotIn(jti, other_worker)
+        self.assertNotIn(jti, polling_worker)
+
+        self.logout(token)
+        self.assertIn(jti, other_worker)
+        self.assertIn(jti, polling_worker)
+
+    def test_without_a_version_bump_workers_catch_up_on_their_interval(self):
+        token = ClaimsRefreshToken.for_user(self.parent)
+        other_worker, polling_worker = BlacklistIndex(refresh_interval=3600), BlacklistIndex(refresh_interval=0)
+        other_worker.sync()
+        polling_worker.sync()
+
+        token.blacklist()  # Its commit callback never runs, as with a per-process cache in another worker.
+
+        self.assertNotIn(token['jti'], other_worker)
+        self.assertIn(token['jti'], polling_worker)
+
+    def test_rows_committed_out_of_id_order_are_not_skipped(self):
+        index = BlacklistIndex(refresh_interval=0)
+        first = BlacklistedToken.objects.create(token=self.outstanding(timedelta(hours=1)))
+        # The id in between belongs to a transaction that has not committed yet.
+        BlacklistedToken.objects.create(id=first.id + 2, token=self.outstanding(timedelta(hours=1)))
+        index.sync()
+
+        late = BlacklistedToken.objects.create(id=first.id + 1, token=self.outstanding(timedelta(hours=1)))
+
+        self.assertIn(late.token.jti, index)
+
+    def test_expired_entries_are_dropped(self):
+        index = BlacklistIndex(refresh_interval=0)
+        expired = self.outstanding(timedelta(seconds=-1), blacklisted=True)
+        live = self.outstanding(timedelta(hours=1), blacklisted=True)
+
+        index.sync()
+
+        self.assertEqual(set(index.expires), {live.jti})
+        self.assertNotIn(expired.jti, index)
+
+    def test_purge_deletes_expired_tokens_in_chunks(self):
+        expired = [self.outstanding(timedelta(seconds=-1), blacklisted=index % 2 == 0) for index in range(5)]
+        live = [self.outstanding(timedelta(hours=1), blacklisted=True), self.outstanding(timedelta(hours=1))]
+
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('purge_expired_tokens', batch_size=2, stdout=out)
+
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE FROM "token_blacklist_outstanding')]
+        self.assertEqual(len(deletes), 3)
 
-# Create your tests here.
+        self.assertIn('Deleted 5 expired outstanding tokens and 3 blacklist entries', out.getvalue())
+        self.assertEqual(set(OutstandingToken.objects.values_list('jti', flat=True)), {token.jti for token in live})
+        self.assertEqual(BlacklistedToken.objects.get().token.jti, live[0].jti)
+        self.assertFalse(OutstandingToken.objects.filter(jti__in=[token.jti for token in expired]).exists())
@@ -2,7 +2,10 @@ from django.shortcuts import render
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.settings import api_settings
+
+from auth_service.authenticate import ClaimsRefreshToken, add_account_claims
+from user_accounts.models import Account
 
 
 # Create your views here.
@@ -18,8 +21,13 @@ class TokenRefreshView(APIView):
             return Response({'error': 'Refresh token is required'}, status=400)
 
         try:
-            refresh_token = RefreshToken(refresh_token)
-            access_token = str(refresh_token.access_token)
+            refresh_token = ClaimsRefreshToken(refresh_token)
+            # Re-read the claims so role and name changes reach clients at their next refresh.
+            account = Account.objects.filter(**{api_settings.USER_ID_FIELD: refresh_token[api_settings.USER_ID_CLAIM]},
+                                             is_active=True).first()
+            if account is None:
+                return Response({'error': 'User not found'}, status=400)
+            access_token = str(add_account_claims(refresh_token.access_token, account))
             return Response({'access': access_token})
         except Exception as e:
             return Response({'error': str(e)}, status=400)
@@ -0,0 +1,76 @@
+from django.db.models import (BigIntegerField, Case, Count, DateTimeField, F, IntegerField, OuterRef, Q, Subquery,
+                              Value, When)
+from django.db.models.functions import Coalesce, Greatest
+
+from common.models import Category, Message
+
+
+def _newer_than_last(message_id, timestamp):
+    return (Q(last_message_at__isnull=True) | Q(last_message_at__lt=timestamp)
+            | Q(last_message_at=timestamp, last_message_id__lt=message_id))
+
+
+def _latest_messages():
+    return Message.objects.filter(category=OuterRef('pk')).order_by('-timestamp', '-id')
+
+
+def record_messages(category_id, count, last_id, last_at):
+    """
+    Add ``count`` messages to a category's counter in one atomic UPDATE.
+
+    ``last_id``/``last_at`` only replace the stored pointer when they are newer,
+    so out-of-order writers (imports, the chat buffer) cannot move it backwards.
+    """
+    newer = _newer_than_last(last_id, last_at)
+    Category.objects.filter(pk=category_id).update(
+        message_count=F('message_count') + count,
+        last_message_id=Case(When(newer, then=Value(last_id)), default=F('last_message_id'),
+                             output_field=BigIntegerField()),
+        last_message_at=Case(When(newer, then=Value(last_at)), default=F('last_message_at'),
+                             output_field=DateTimeField()),
+    )
+
+
+def message_created(message):
+    record_messages(message.category_id, 1, message.pk, message.timestamp)
+
+
+def messages_created(messages):
+    """
+    Counter update for rows written with bulk_create: one UPDATE per category touched.
+    """
+    by_category = {}
+    for message in messages:
+        count, latest = by_category.get(message.category_id, (0, None))
+        if latest is None or (message.timestamp, message.pk) > (latest.timestamp, latest.pk):
+            latest = message
+        by_category[message.category_id] = (count + 1, latest)
+    for category_id, (count, latest) in by_category.items():
+        record_messages(category_id, count, latest.pk, latest.timestamp)
+
+
+def message_deleted(message):
+    latest = _latest_messages()
+    was_last = Q(last_message_id=message.pk)
+    Category.objects.filter(pk=message.category_id).update(
+        message_count=Greatest(F('message_count') - 1, 0),
+        last_message_id=Case(When(was_last, then=Subquery(latest.values('id')[:1])), default=F('last_message_id'),
+                             output_field=BigIntegerField()),
+        last_message_at=Case(When(was_last, then=Subquery(latest.values('timestamp')[:1])),
+                             default=F('last_message_at'), output_field=DateTimeField()),
+    )
+
+
+def reconcile(category_ids=None):
+    """
+    Recompute every category's counters, or those of ``category_ids``, from the messages table in a single statement.
+    """
+    counts = (Message.objects.filter(category=OuterRef('pk')).order_by().values('category')
+              .annotate(total=Count('id')).values('total'))
+    latest = _latest_messages()
+    categories = Category.objects.all() if category_ids is None else Category.objects.filter(pk__in=category_ids)
+    return categories.update(
+        message_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0),
+        last_message_id=Subquery(latest.values('id')[:1]),
+        last_message_at=Subquery(latest.values('timestamp')[:1]),
+    )
@@ -2,6 +2,12 @@ from django.contrib import admin
 
 from common.models import Message, Category
 
+
 # Register your models here.
-admin.site.register(Message)
-admin.site.register(Category)
\ No newline at end of file
+@admin.register(Message)
+class MessageAdmin(admin.ModelAdmin):
+    # Message.__str__ shows the sender and category: join them rather than fetch them row by row.
+    list_select_related = ['sender', 'category']
+
+
+admin.site.register(Category)
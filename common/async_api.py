@@ -0,0 +1,91 @@
+from functools import wraps
+
+from django.http import HttpResponse
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from common.metrics import sync_to_async
+from common.renderers import FastJSONRenderer
+
+
+def json_response(data, status=status.HTTP_200_OK, headers=None):
+    return HttpResponse(FastJSONRenderer().render(data), status=status, headers=headers,
+                        content_type='application/json')
+
+
+async def authenticate(request):
+    """
+    Run DRF authentication on an async view's request and return the authenticator that succeeded, if any.
+
+    Authenticators with an ``aauthenticate`` method run on the event loop,
+    any others in a thread.
+    """
+    for authenticator in request.authenticators:
+        if hasattr(authenticator, 'aauthenticate'):
+            user_auth = await authenticator.aauthenticate(request)
+        else:
+            user_auth = await sync_to_async(authenticator.authenticate)(request)
+        if user_auth is not None:
+            request.user, request.auth = user_auth
+            return authenticator
+    request.user = api_settings.UNAUTHENTICATED_USER() if api_settings.UNAUTHENTICATED_USER else None
+    request.auth = api_settings.UNAUTHENTICATED_TOKEN() if api_settings.UNAUTHENTICATED_TOKEN else None
+    return None
+
+
+def async_read_view(viewset):
+    """
+    Turn a coroutine into an async stand-in for one of ``viewset``'s read actions.
+
+    DRF only runs sync views, so under ASGI each request would hold a thread
+    from start to finish. This applies ``viewset``'s authentication and
+    permission classes the way ``APIView`` does, answering 401 or 403 in the
+    same cases, and hands the coroutine a DRF ``Request``. API errors become
+    the same JSON responses as in the viewset.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            authenticators = [authentication() for authentication in viewset.authentication_classes]
+            request = Request(request, authenticators=authenticators)
+            try:
+                authenticator = await authenticate(request)
+                for permission in [permission() for permission in viewset.permission_classes]:
+                    if not permission.has_permission(request, None):
+                        if authenticators and authenticator is None:
+                            raise exceptions.NotAuthenticated()
+                        raise exceptions.PermissionDenied(getattr(permission, 'message', None),
+                                                          getattr(permission, 'code', None))
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                    auth_header = authenticators[0].authenticate_header(request) if authenticators else None
+                    if auth_header:
+                        exc.auth_header = auth_header
+                    else:
+                        exc.status_code = status.HTTP_403_FORBIDDEN
+                response = api_settings.EXCEPTION_HANDLER(exc, {'request': request, 'view': None})
+                if response is None:
+                    raise
+                headers = {name: value for name, value in response.items() if name != 'Content-Type'}
+                return json_response(response.data, response.status_code, headers)
+        return wrapper
+    return decorator
+
+
+def split_by_method(async_view, view):
+    """
+    Serve GET from ``async_view`` and every other method from the sync ``view`` it stands in for.
+    """
+    sync_view = sync_to_async(view)
+
+    async def dispatch(request, *args, **kwargs):
+        if request.method == 'GET':
+            return await async_view(request, *args, **kwargs)
+        return await sync_view(request, *args, **kwargs)
+    # The sync views are DRF's, which handle CSRF themselves. Set by hand: Django 4.2's csrf_exempt is not async-aware.
+    dispatch.csrf_exempt = True
+    # For code looking up the viewset action behind a URL, such as query budgets.
+    dispatch.stands_in_for = view
+    return dispatch
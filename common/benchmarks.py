@@ -0,0 +1,99 @@
+import asyncio
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.test.utils import setup_databases, teardown_databases
+
+WORD_SYLLABLES = ['ba', 'ko', 'ri', 'sta', 'fen', 'lo', 'mar', 'qui', 'te', 'dun', 'sel', 'vo', 'pra', 'ni', 'gus']
+
+
+@contextmanager
+def benchmark_database(verbosity=0, keepdb=False):
+    """
+    Run the block against freshly created test databases so real data is never touched.
+
+    With ``keepdb`` existing test databases are reused and kept afterwards.
+    """
+    old_config = setup_databases(verbosity=verbosity, interactive=False, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=verbosity, keepdb=keepdb)
+
+
+def synthetic_words(count, seed=0):
+    rng = random.Random(seed)
+    return [''.join(rng.choice(WORD_SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(count)]
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(label, samples):
+    return (f'{label}: n={len(samples)} mean={statistics.mean(samples) * 1000:.2f}ms '
+            f'p50={percentile(samples, 50) * 1000:.2f}ms p95={percentile(samples, 95) * 1000:.2f}ms '
+            f'p99={percentile(samples, 99) * 1000:.2f}ms')
+
+
+async def asgi_request(application, method, path, query_string='', headers=(), body=b''):
+    """
+    Send one request through an ASGI application in-process and return ``(status, body)``.
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver'), *headers], 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    if body:
+        scope['headers'].append((b'content-length', str(len(body)).encode()))
+    request_sent = False
+    response = {'status': None, 'body': []}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # The client never disconnects.
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'].append(message.get('body', b''))
+
+    await application(scope, receive, send)
+    return response['status'], b''.join(response['body'])
+
+
+async def run_clients(request, clients, total):
+    """
+    Await ``request()`` ``total`` times from ``clients`` concurrent loops; returns the latencies and elapsed seconds.
+    """
+    samples, remaining = [], total
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            await request()
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(clients)])
+    return samples, time.perf_counter() - start
@@ -0,0 +1,154 @@
+import logging
+import re
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+BUDGET_MODES = ['off', 'log', 'raise']
+# Literals and placeholder lists, so statements differing only in their values share a fingerprint.
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+LIST_RE = re.compile(r'\((?:\s*(?:%s|\?|NULL)\s*,)+\s*(?:%s|\?|NULL)\s*\)')
+SPACE_RE = re.compile(r'\s+')
+
+# SQL of the queries the current request has made, when its view has a budget to check.
+request_statements = ContextVar('budget_request_statements', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = LIST_RE.sub('(...)', sql.replace('%s', '?'))
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+def repeated_statements(statements):
+    """
+    ``(count, fingerprint)`` of the statements run more than once, most repeated first.
+    """
+    counts = Counter(fingerprint(sql) for sql in statements)
+    return [(count, sql) for sql, count in counts.most_common() if count > 1]
+
+
+def get_query_budget(view, method):
+    """
+    ``(name, budget)`` for a request to ``view``, or None when it has no budget.
+
+    Budgets are declared on viewsets as ``query_budgets``, a dict of action
+    name to the most queries one request may make. The async views standing
+    in for viewset actions share those actions' budgets.
+    """
+    view = getattr(view, 'stands_in_for', view)
+    viewset, actions = getattr(view, 'cls', None), getattr(view, 'actions', None)
+    if viewset is None or actions is None:
+        return None
+    action = actions.get(method.lower())
+    budget = getattr(viewset, 'query_budgets', {}).get(action)
+    if budget is None:
+        return None
+    return f'{viewset.__name__}.{action}', budget
+
+
+def check_query_budget(name, budget, statements):
+    if len(statements) <= budget:
+        return
+    repeated = '; '.join(f'{count}x {sql}' for count, sql in repeated_statements(statements)[:5])
+    message = f'{name} made {len(statements)} queries, over its budget of {budget}.'
+    if repeated:
+        message += f' Repeated: {repeated}'
+    if settings.QUERY_BUDGETS == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def record_statement(execute, sql, params, many, context):
+    statements = request_statements.get()
+    if statements is not None:
+        statements.append(sql)
+    return execute(sql, params, many, context)
+
+
+def install_statement_recorder(sender, connection, **kwargs):
+    if record_statement not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_statement)
+
+
+connection_created.connect(install_statement_recorder)
+
+
+class QueryBudgetMiddleware:
+    """
+    Check requests to viewset actions against the actions' ``query_budgets``.
+
+    ``settings.QUERY_BUDGETS`` is ``log`` to log a warning for a request over
+    its budget, with the statements it repeated, or ``raise`` to fail it with
+    ``QueryBudgetExceeded``, as the tests do; ``off`` removes the middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.QUERY_BUDGETS not in BUDGET_MODES:
+            raise ValueError(f'QUERY_BUDGETS must be one of {", ".join(BUDGET_MODES)}')
+        if settings.QUERY_BUDGETS == 'off':
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = request_statements.set([])
+        try:
+            response = self.get_response(request)
+            self.check(request)
+        finally:
+            request_statements.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        token = request_statements.set([])
+        try:
+            response = await self.get_response(request)
+            self.check(request)
+        finally:
+            request_statements.reset(token)
+        return response
+
+    def check(self, request):
+        budget = get_query_budget(request.resolver_match.func, request.method) if request.resolver_match else None
+        if budget is not None:
+            check_query_budget(*budget, request_statements.get())
+
+
+def routed_actions(patterns=None, prefix=''):
+    """
+    ``{(viewset, action): (route, method)}`` for every viewset action the URLconf routes to.
+    """
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    actions = {}
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            for key, route in routed_actions(pattern.url_patterns, prefix + str(pattern.pattern)).items():
+                actions.setdefault(key, route)
+            continue
+        view = getattr(pattern.callback, 'stands_in_for', pattern.callback)
+        if getattr(view, 'cls', None) is None or getattr(view, 'actions', None) is None:
+            continue
+        for method, action in view.actions.items():
+            actions.setdefault((view.cls, action), (prefix + str(pattern.pattern), method.upper()))
+    return actions
@@ -0,0 +1,131 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+
+from common import activity, sqlite
+from common.live import publish_messages_stored
+from common.models import Category, Message
+from user_accounts.models import Account
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    """
+    Per-process write-behind buffer for chat messages.
+
+    Consumers hand over unsaved ``Message`` instances and return straight away;
+    a background thread writes them with one ``bulk_create`` once ``max_size``
+    messages are waiting or ``max_delay`` seconds after the first one arrived,
+    whichever comes first. Whatever is still pending is written at interpreter exit.
+
+    Messages whose sender or category was deleted while they waited are dropped
+    on their own. A batch that fails to write stays pending and is retried after
+    a delay doubling from ``retry_delay``; after ``max_retries`` failures in a row it
+    is dropped, so a write that keeps failing cannot hold messages forever.
+    """
+
+    def __init__(self, max_size=None, max_delay=None, max_retries=None, retry_delay=None):
+        self.max_size = max_size or settings.CHAT_BUFFER_MAX_SIZE
+        self.max_delay = max_delay if max_delay is not None else settings.CHAT_BUFFER_MAX_DELAY_MS / 1000
+        self.max_retries = max_retries if max_retries is not None else settings.CHAT_BUFFER_MAX_RETRIES
+        self.retry_delay = retry_delay if retry_delay is not None else settings.CHAT_BUFFER_RETRY_DELAY_MS / 1000
+        self._failures = 0
+        self._retry_at = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._has_messages = threading.Event()
+        self._full = threading.Event()
+        self._thread = None
+        self._loop = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, message):
+        try:
+            # Remember the consumers' loop so the flush thread can publish through it.
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        with self._lock:
+            self._pending.append(message)
+            size = len(self._pending)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-message-buffer', daemon=True)
+                self._thread.start()
+        self._has_messages.set()
+        if size >= self.max_size:
+            self._full.set()
+
+    def _run(self):
+        while True:
+            self._has_messages.wait()
+            self._full.wait(self.max_delay)
+            time.sleep(max(0, self._retry_at - time.monotonic()))
+            close_old_connections()
+            self.flush()
+
+    def flush(self):
+        """
+        Write every pending message now and return the saved instances.
+        """
+        with self._flush_lock:
+            with self._lock:
+                messages, self._pending = self._pending, []
+                self._has_messages.clear()
+                self._full.clear()
+            if not messages:
+                return []
+            try:
+                saved = sqlite.write(self.write, messages)
+            except DatabaseError:
+                self._failures += 1
+                if self._failures > self.max_retries:
+                    logger.exception('Dropped %d buffered chat messages after %d failed writes',
+                                     len(messages), self._failures)
+                    self._failures, self._retry_at = 0, 0
+                    return []
+                delay = self.retry_delay * 2 ** (self._failures - 1)
+                logger.exception('Could not write %d buffered chat messages, will retry in %.1fs',
+                                 len(messages), delay)
+                self._retry_at = time.monotonic() + delay
+                with self._lock:
+                    self._pending[:0] = messages
+                self._has_messages.set()
+                return []
+            self._failures, self._retry_at = 0, 0
+            publish_messages_stored({message.category_id for message in saved}, loop=self._loop)
+            return saved
+
+    def write(self, messages):
+        """
+        Save ``messages`` and return them, less any whose sender or category has been deleted since.
+        """
+        with transaction.atomic():
+            sender_ids = set(Account.objects.filter(
+                pk__in={message.sender_id for message in messages}).values_list('pk', flat=True))
+            category_ids = set(Category.objects.filter(
+                pk__in={message.category_id for message in messages}).values_list('pk', flat=True))
+            saved, orphans = [], []
+            for message in messages:
+                if message.sender_id in sender_ids and message.category_id in category_ids:
+                    saved.append(message)
+                else:
+                    orphans.append(f'sender {message.sender_id} in category {message.category_id}')
+            if orphans:
+                logger.warning('Dropped %d buffered chat messages whose sender or category was deleted: %s',
+                               len(orphans), ', '.join(orphans))
+            Message.objects.bulk_create(saved)
+            activity.messages_created(saved)
+        return saved
+
+
+message_buffer = MessageBuffer()
+atexit.register(message_buffer.flush)
@@ -0,0 +1,108 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.http import parse_etags
+
+from common.renderers import FastJSONRenderer
+
+TREE_VERSION_KEY = 'common:category_tree:version'
+
+
+def get_cache():
+    return caches[settings.CATEGORY_CACHE_ALIAS]
+
+
+def get_tree_version():
+    cache = get_cache()
+    version = cache.get(TREE_VERSION_KEY)
+    if version is None:
+        cache.add(TREE_VERSION_KEY, 1, timeout=None)
+        version = cache.get(TREE_VERSION_KEY, 1)
+    return version
+
+
+async def aget_tree_version():
+    cache = get_cache()
+    version = await cache.aget(TREE_VERSION_KEY)
+    if version is None:
+        await cache.aadd(TREE_VERSION_KEY, 1, timeout=None)
+        version = await cache.aget(TREE_VERSION_KEY, 1)
+    return version
+
+
+def bump_tree_version():
+    """
+    Invalidate every cached category response by moving to a new tree version.
+    """
+    cache = get_cache()
+    try:
+        cache.incr(TREE_VERSION_KEY)
+    except ValueError:
+        # Version key evicted or never set; any value differing from the old one will do.
+        cache.add(TREE_VERSION_KEY, 1, timeout=None)
+        cache.incr(TREE_VERSION_KEY)
+
+
+def cached_tree_response(request, name, build):
+    """
+    Serve a category endpoint from pre-rendered bytes keyed on the tree version.
+
+    ``build`` is only called on a cache miss and must return the data to render.
+    Requests whose If-None-Match matches the stored ETag get a 304 without
+    touching the database.
+
+    Message counters change far more often than the tree, so instead of bumping
+    the version per message the key also rolls over every
+    CATEGORY_ACTIVITY_MAX_AGE seconds. The ETag is a hash of the content, so an
+    unchanged rebuild still answers 304.
+    """
+    cache = get_cache()
+    key = tree_cache_key(get_tree_version(), name)
+    entry = cache.get(key)
+    if entry is None:
+        entry = tree_cache_entry(build())
+        cache.set(key, entry, timeout=tree_cache_timeout())
+    return tree_response(request, entry)
+
+
+async def acached_tree_response(request, name, abuild):
+    """
+    ``cached_tree_response`` for async views; ``abuild`` is a coroutine function.
+    """
+    cache = get_cache()
+    key = tree_cache_key(await aget_tree_version(), name)
+    entry = await cache.aget(key)
+    if entry is None:
+        entry = tree_cache_entry(await abuild())
+        await cache.aset(key, entry, timeout=tree_cache_timeout())
+    return tree_response(request, entry)
+
+
+def tree_cache_key(version, name):
+    max_age = settings.CATEGORY_ACTIVITY_MAX_AGE
+    bucket = int(time.time() // max_age) if max_age else 0
+    return f'common:category_tree:{version}:{bucket}:{name}'
+
+
+def tree_cache_timeout():
+    max_age = settings.CATEGORY_ACTIVITY_MAX_AGE
+    return 2 * max_age if max_age else settings.CATEGORY_CACHE_TIMEOUT
+
+
+def tree_cache_entry(data):
+    content = FastJSONRenderer().render(data)
+    return content, '"%s"' % hashlib.sha1(content).hexdigest()
+
+
+def tree_response(request, entry):
+    content, etag = entry
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if etag in etags or etags == ['*']:
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    return response
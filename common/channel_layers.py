@@ -0,0 +1,413 @@
+import asyncio
+import os
+import secrets
+import select
+import socket
+import tempfile
+import threading
+import time
+from copy import deepcopy
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.db import connection, transaction
+from django.db.models import Count
+
+from common import sqlite
+from common.metrics import current_measurement
+from common.models import ChannelLayerGroup, ChannelLayerMessage
+
+
+def channel_process(channel):
+    """
+    Instance prefix of a process-specific channel (``prefix.<process>!<id>``), or '' for a normal channel.
+    """
+    if '!' not in channel:
+        return ''
+    return channel[:channel.index('!')].rsplit('.', 1)[-1]
+
+
+class LoopState:
+    """
+    Delivery endpoint of one event loop: its channel prefix, local queues and group memberships, and pump.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.process = secrets.token_hex(8)
+        self.queues = {}
+        self.groups = {}
+        self.pump = None
+        self.wakeup_event = None
+        self.listener = None
+        self.socket = None
+        self.last_cleanup = time.time()
+
+
+class DatabaseChannelLayer(BaseChannelLayer):
+    """
+    Channel layer that stores messages and group memberships in the main database.
+
+    Every process works with the same tables, so it spans daphne workers on
+    one host and, on PostgreSQL, several hosts. Messages for channels owned
+    by the sending process never touch the database. Other messages are
+    written as msgpack rows and claimed by a per-process pump, which is woken
+    by one of these:
+
+    * ``LISTEN``/``NOTIFY`` on PostgreSQL;
+    * a Unix datagram socket per process in ``socket_dir`` (same host, SQLite);
+    * polling every ``poll_interval`` seconds, always on as a safety net.
+
+    ``capacity``/``channel_capacity`` bound the messages waiting per channel
+    and ``expiry``/``group_expiry`` age out messages and group memberships,
+    as in the Redis layer.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 wakeup='auto', socket_dir=None, poll_interval=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.group_expiry = group_expiry
+        self.wakeup = wakeup
+        self.socket_dir = socket_dir or os.path.join(tempfile.gettempdir(), 'helpdesk-channels')
+        self.poll_interval = poll_interval
+        self._states = {}
+
+    def _state(self, create=True):
+        """
+        Queues and pump of the running event loop.
+
+        ``async_to_sync`` callers get a fresh loop each time, so every loop is
+        its own delivery endpoint with its own prefix instead of one per layer.
+        Sending needs no endpoint: with ``create=False`` a loop that never
+        received gets ``None`` rather than a state of its own.
+        """
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None and create:
+            for closed in [other for other in self._states if other.is_closed()]:
+                self._close_transport(self._states.pop(closed))
+            state = self._states[loop] = LoopState(loop)
+        return state
+
+    def _wakeup_mode(self):
+        if self.wakeup != 'auto':
+            return self.wakeup
+        if connection.vendor == 'postgresql':
+            return 'notify'
+        return 'socket' if hasattr(socket, 'AF_UNIX') else 'poll'
+
+    def _poll_interval(self):
+        if self.poll_interval is not None:
+            return self.poll_interval
+        return 0.05 if self._wakeup_mode() == 'poll' else 1.0
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific'):
+        return f'{prefix}.{self._state().process}!{secrets.token_hex(8)}'
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+        state = self._state(create=False)
+
+        if state is not None and channel_process(channel) == state.process:
+            self._put_local(state, channel, message, raise_full=True)
+            return
+        sent = await sqlite.awrite(self._insert, {channel}, msgpack.packb(message, use_bin_type=True))
+        if not sent:
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        state = self._state()
+
+        if channel_process(channel) != state.process:
+            return await self._receive_shared(channel)
+
+        self._start_pump(state)
+        queue = state.queues.setdefault(channel, asyncio.Queue())
+        try:
+            while True:
+                expires, message = await queue.get()
+                if expires > time.time():
+                    return message
+        finally:
+            if queue.empty() and state.queues.get(channel) is queue:
+                del state.queues[channel]
+
+    async def flush(self):
+        await sqlite.awrite(self._delete_all)
+        await self.close()
+
+    async def close(self):
+        for state in list(self._states.values()):
+            self._close_transport(state)
+        self._states.clear()
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        state = self._state()
+        expires = time.time() + self.group_expiry
+        process = channel_process(channel)
+        if process == state.process:
+            state.groups.setdefault(group, {})[channel] = expires
+        await sqlite.awrite(
+            ChannelLayerGroup.objects.bulk_create,
+            [ChannelLayerGroup(group=group, channel=channel, process=process, expires=expires)],
+            update_conflicts=True, unique_fields=['group', 'channel'], update_fields=['expires'])
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        state = self._state(create=False)
+        members = state.groups.get(group) if state is not None else None
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del state.groups[group]
+        await sqlite.awrite(ChannelLayerGroup.objects.filter(group=group, channel=channel).delete)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_group_name(group), 'Group name not valid'
+        state = self._state(create=False)
+        if state is None:
+            await sqlite.awrite(self._group_insert, group, msgpack.packb(message, use_bin_type=True))
+            return
+
+        now = time.time()
+        for channel, expires in list(state.groups.get(group, {}).items()):
+            if expires > now:
+                # Group sends drop messages for full channels rather than failing the whole send.
+                self._put_local(state, channel, message, raise_full=False)
+        await sqlite.awrite(self._group_insert, group, msgpack.packb(message, use_bin_type=True), state.process)
+
+    # Local delivery
+
+    def _put_local(self, state, channel, message, raise_full):
+        queue = state.queues.setdefault(channel, asyncio.Queue())
+        if queue.qsize() >= self.get_capacity(channel):
+            if raise_full:
+                raise ChannelFull(channel)
+            return
+        queue.put_nowait((time.time() + self.expiry, deepcopy(message)))
+
+    def _deliver(self, state, rows):
+        now = time.time()
+        for channel, payload, expires in rows:
+            if expires > now:
+                queue = state.queues.setdefault(channel, asyncio.Queue())
+                queue.put_nowait((expires, msgpack.unpackb(payload, raw=False)))
+
+    def _clean_local(self, state):
+        now = time.time()
+        for channel, queue in list(state.queues.items()):
+            # Only receivers drain queues, so one holding nothing but expired messages has none left.
+            if not queue.empty() and all(expires <= now for expires, _ in queue._queue):
+                del state.queues[channel]
+        for group, members in list(state.groups.items()):
+            for channel, expires in list(members.items()):
+                if expires <= now:
+                    del members[channel]
+            if not members:
+                del state.groups[group]
+
+    # Database side; these run in a worker thread, or on the SQLite writer (see common.sqlite.awrite)
+
+    def _insert(self, channels, payload):
+        """
+        Queue ``payload`` on every channel with room left and wake their processes; returns the channels used.
+        """
+        if not channels:
+            return set()
+        now = time.time()
+        waiting = dict(ChannelLayerMessage.objects.filter(channel__in=channels, expires__gt=now)
+                       .values_list('channel').annotate(total=Count('id')).order_by())
+        channels = {channel for channel in channels if waiting.get(channel, 0) < self.get_capacity(channel)}
+        processes = {channel_process(channel) for channel in channels} - {''}
+        with transaction.atomic():
+            ChannelLayerMessage.objects.bulk_create([
+                ChannelLayerMessage(channel=channel, process=channel_process(channel), payload=payload,
+                                    expires=now + self.expiry)
+                for channel in channels
+            ])
+            if self._wakeup_mode() == 'notify':
+                with connection.cursor() as cursor:
+                    for process in processes:
+                        # Delivered when the transaction commits.
+                        cursor.execute('SELECT pg_notify(%s, %s)', [f'channels_{process}', ''])
+        if self._wakeup_mode() == 'socket':
+            for process in processes:
+                self._send_wakeup(process)
+        return channels
+
+    def _group_insert(self, group, payload, process=None):
+        members = ChannelLayerGroup.objects.filter(group=group, expires__gt=time.time())
+        if process is not None:
+            # Members in the sending process were served from memory already.
+            members = members.exclude(process=process)
+        return self._insert(set(members.values_list('channel', flat=True)), payload)
+
+    def _claim(self, **filters):
+        """
+        Delete and return the oldest waiting messages matching ``filters``.
+
+        Only the rows this call deleted are returned; a row another worker
+        deleted first is theirs to deliver.
+        """
+        claimable = ChannelLayerMessage.objects.filter(**filters).order_by('id')
+        if self._can_delete_returning():
+            sql, params = claimable.values('id')[:1000].query.sql_with_params()
+            quote = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {quote(ChannelLayerMessage._meta.db_table)} WHERE {quote("id")} IN '
+                               f'({sql}) RETURNING id, channel, payload, expires', params)
+                rows = sorted(cursor.fetchall())
+        else:
+            with transaction.atomic():
+                rows = [row for row in claimable.values_list('id', 'channel', 'payload', 'expires')[:1000]
+                        if ChannelLayerMessage.objects.filter(id=row[0]).delete()[0]]
+        return [(channel, bytes(payload), expires) for _, channel, payload, expires in rows]
+
+    def _can_delete_returning(self):
+        if connection.vendor == 'sqlite':
+            return connection.Database.sqlite_version_info >= (3, 35)
+        return connection.vendor == 'postgresql'
+
+    def _claim_one(self, channel):
+        now = time.time()
+        while True:
+            row = (ChannelLayerMessage.objects.filter(channel=channel, expires__gt=now).order_by('id')
+                   .values_list('id', 'payload').first())
+            if row is None:
+                return None
+            # Several workers may poll the same normal channel; only the one whose delete counts gets it.
+            if ChannelLayerMessage.objects.filter(id=row[0]).delete()[0]:
+                return msgpack.unpackb(bytes(row[1]), raw=False)
+
+    def _delete_expired(self):
+        now = time.time()
+        ChannelLayerMessage.objects.filter(expires__lte=now).delete()
+        ChannelLayerGroup.objects.filter(expires__lte=now).delete()
+
+    def _delete_all(self):
+        ChannelLayerMessage.objects.all().delete()
+        ChannelLayerGroup.objects.all().delete()
+
+    # Pump and wakeups
+
+    async def _receive_shared(self, channel):
+        while True:
+            message = await sqlite.awrite(self._claim_one, channel)
+            if message is not None:
+                return message
+            await asyncio.sleep(self._poll_interval())
+
+    def _start_pump(self, state):
+        if state.pump is not None and not state.pump.done():
+            return
+        state.wakeup_event = asyncio.Event()
+        mode = self._wakeup_mode()
+        if mode == 'socket':
+            self._open_socket(state)
+        elif mode == 'notify':
+            state.listener = threading.Thread(target=self._listen, args=(state,),
+                                              name=f'channels-listen-{state.process}', daemon=True)
+            state.listener.start()
+        state.pump = asyncio.ensure_future(self._run_pump(state))
+
+    async def _run_pump(self, state):
+        # Started from whichever consumer needed it first, whose measured events its queries are not part of.
+        current_measurement.set(None)
+        interval = self._poll_interval()
+        while True:
+            rows = await sqlite.awrite(self._claim, process=state.process)
+            self._deliver(state, rows)
+            if time.time() - state.last_cleanup > self.expiry:
+                state.last_cleanup = time.time()
+                self._clean_local(state)
+                await sqlite.awrite(self._delete_expired)
+            if len(rows) == 1000:
+                continue
+            try:
+                await asyncio.wait_for(state.wakeup_event.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            state.wakeup_event.clear()
+
+    def _socket_path(self, process):
+        return os.path.join(self.socket_dir, f'{process}.sock')
+
+    def _open_socket(self, state):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        state.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        state.socket.setblocking(False)
+        state.socket.bind(self._socket_path(state.process))
+        state.loop.add_reader(state.socket.fileno(), self._on_socket_readable, state.socket, state.wakeup_event)
+
+    def _on_socket_readable(self, sock, event):
+        try:
+            while sock.recv(64):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        event.set()
+
+    def _send_wakeup(self, process):
+        path = self._socket_path(process)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            try:
+                sock.sendto(b'1', path)
+            except ConnectionRefusedError:
+                # The process is gone; its name is random and will not come back.
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError:
+                # Missing socket or a full buffer: the receiver polls, and a full buffer already means "wake up".
+                pass
+
+    def _listen(self, state):
+        listener = connection.copy()
+        listener.ensure_connection()
+        raw = listener.connection
+        raw.autocommit = True
+        with raw.cursor() as cursor:
+            cursor.execute(f'LISTEN channels_{state.process}')
+        try:
+            while state.listener is threading.current_thread():
+                if select.select([raw], [], [], 1.0) == ([], [], []):
+                    continue
+                raw.poll()
+                if raw.notifies:
+                    raw.notifies.clear()
+                    state.loop.call_soon_threadsafe(state.wakeup_event.set)
+        finally:
+            listener.close()
+
+    def _close_transport(self, state):
+        if state.pump is not None and not state.loop.is_closed():
+            state.pump.cancel()
+        state.listener = None
+        if state.socket is not None:
+            try:
+                state.loop.remove_reader(state.socket.fileno())
+            except (RuntimeError, ValueError):
+                pass
+            state.socket.close()
+            try:
+                os.unlink(self._socket_path(state.process))
+            except OSError:
+                pass
+            state.socket = None
@@ -0,0 +1,127 @@
+from functools import lru_cache
+from operator import attrgetter
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField, RelatedField
+from rest_framework.settings import api_settings
+
+# to_representation methods that hand a column value from the database back unchanged.
+PASSTHROUGH_METHODS = {
+    serializers.BooleanField.to_representation,
+    serializers.CharField.to_representation,
+    serializers.FloatField.to_representation,
+    serializers.IntegerField.to_representation,
+}
+
+
+def bind_datetime(field):
+    """
+    DateTimeField.to_representation with the current timezone looked up once instead of for every value.
+    """
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if isinstance(value, str) or value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+def compile_field(field):
+    """
+    ``(column, bind)`` for one serializer field.
+
+    ``bind()`` returns the function converting a column value to the field's
+    output for the current request; it is None when the value is the output.
+    """
+    if isinstance(field, (serializers.BaseSerializer, ManyRelatedField)) or \
+            isinstance(field, RelatedField) and not isinstance(field, PrimaryKeyRelatedField):
+        raise ImproperlyConfigured(f'{field.field_name} is a nested or related field')
+    try:
+        column = field.parent.Meta.model._meta.get_field(field.source).attname
+    except FieldDoesNotExist:
+        raise ImproperlyConfigured(f'{field.field_name} is not a model field')
+
+    if isinstance(field, PrimaryKeyRelatedField):
+        return column, (lambda: field.pk_field.to_representation) if field.pk_field else None
+    if isinstance(field, serializers.ChoiceField):
+        if all(isinstance(key, str) for key in field.choices):
+            return column, None
+    elif type(field).to_representation in PASSTHROUGH_METHODS:
+        return column, None
+    elif isinstance(field, serializers.DateTimeField) and \
+            str(getattr(field, 'format', api_settings.DATETIME_FORMAT)).lower() == ISO_8601:
+        return column, lambda: bind_datetime(field)
+    return column, lambda: field.to_representation
+
+
+class RowSerializer:
+    """
+    Read-only form of a ModelSerializer that turns ``values_list()`` tuples into dicts.
+
+    The serializer's fields are inspected once, here, instead of on every
+    row: columns map straight to output keys and only fields that change a
+    value, such as dates, keep their ``to_representation`` call. The output
+    matches the serializer's.
+
+    Only model fields and primary key relations can be compiled. Anything
+    else, a ``SerializerMethodField`` say, has to be listed in ``deferred``;
+    it comes out as None in its usual place for the caller to fill in.
+    """
+
+    def __init__(self, serializer_class, deferred=()):
+        fields = {name: field for name, field in serializer_class().fields.items() if not field.write_only}
+        self.names, self.columns, self.binders = [], [], []
+        for name, field in fields.items():
+            if name in deferred:
+                continue
+            try:
+                column, bind = compile_field(field)
+            except ImproperlyConfigured as e:
+                raise ImproperlyConfigured(f'{serializer_class.__name__} cannot be compiled: {e}; defer it instead.')
+            self.names.append(name)
+            self.columns.append(column)
+            if bind is not None:
+                self.binders.append((name, bind))
+        # Deferred fields keep their place in the output, so the keys come in the serializer's order.
+        self.template = dict.fromkeys(fields) if deferred else None
+        get_columns = attrgetter(*self.columns)
+        self.from_instance = get_columns if len(self.columns) > 1 else lambda instance: (get_columns(instance),)
+
+    def converter(self):
+        """
+        The function turning one row into its dict, for the rows of the current request.
+        """
+        names, template = self.names, self.template
+        converters = [(name, bind()) for name, bind in self.binders]
+
+        def to_dict(row):
+            if template is not None:
+                data = template.copy()
+                data.update(zip(names, row))
+            else:
+                data = dict(zip(names, row))
+            for name, convert in converters:
+                value = data[name]
+                if value is not None:
+                    data[name] = convert(value)
+            return data
+        return to_dict
+
+    def values(self, queryset):
+        return queryset.values_list(*self.columns)
+
+    def serialize(self, rows):
+        return list(map(self.converter(), rows))
+
+
+@lru_cache(maxsize=None)
+def compile_read_serializer(serializer_class, deferred=()):
+    """
+    The RowSerializer for ``serializer_class``, built on first use.
+    """
+    return RowSerializer(serializer_class, tuple(deferred))
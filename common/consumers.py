@@ -0,0 +1,64 @@
+from functools import partial
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.utils import timezone
+
+from common.buffer import message_buffer
+from common.metrics import sync_to_async
+from common.models import Category, Message
+from common.replicas import apin_account_to_primary
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Live chat for one category.
+
+    Incoming messages are broadcast to the category group right away and queued
+    on the write-behind buffer, so a frame never waits for a database insert.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        self.category_id = self.scope['url_route']['kwargs']['category_id']
+        if not await self.category_exists():
+            await self.close(code=4404)
+            return
+        self.group_name = f'category_{self.category_id}'
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    @partial(sync_to_async, adapter=database_sync_to_async)
+    def category_exists(self):
+        return Category.objects.filter(pk=self.category_id, is_active=True).exists()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        text = content.get('content') if isinstance(content, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            await self.send_json({'error': 'content is required'})
+            return
+
+        user = self.scope['user']
+        message = Message(sender_id=user.pk, category_id=self.category_id, content=text, timestamp=timezone.now())
+        await self.channel_layer.group_send(self.group_name, {
+            'type': 'chat.message',
+            'message': {
+                'sender': user.pk,
+                'category': self.category_id,
+                'content': text,
+                'timestamp': message.timestamp.isoformat(),
+            },
+        })
+        message_buffer.add(message)
+        # Their next message list, over HTTP, must include this message even if a replica has not caught up.
+        await apin_account_to_primary(user.pk)
+
+    async def chat_message(self, event):
+        await self.send_json(event['message'])
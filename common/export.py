@@ -0,0 +1,116 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from common.metrics import sync_to_async
+from common.models import Message
+
+EXPORT_FIELDS = ['id', 'sender_id', 'category_id', 'content', 'timestamp']
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CHUNK_SIZE = 2000
+# Rows are joined into blocks of roughly this many bytes before being handed to the server.
+BLOCK_SIZE = 64 * 1024
+
+
+def parse_bound(value):
+    """
+    Parse an ISO date or datetime query bound; dates mean midnight in the current time zone.
+    """
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date: {value}')
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_queryset(category_id, since=None, until=None):
+    queryset = Message.objects.filter(category_id=category_id)
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until is not None:
+        queryset = queryset.filter(timestamp__lt=until)
+    return queryset.order_by('id').values_list(*EXPORT_FIELDS)
+
+
+def _blocks(lines):
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            yield ''.join(block).encode()
+            block, size = [], 0
+    if block:
+        yield ''.join(block).encode()
+
+
+def ndjson_lines(rows):
+    for message_id, sender_id, category_id, content, timestamp in rows:
+        yield json.dumps({
+            'id': message_id,
+            'sender_id': sender_id,
+            'category_id': category_id,
+            'content': content,
+            'timestamp': timestamp.isoformat(),
+        }) + '\n'
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for message_id, sender_id, category_id, content, timestamp in rows:
+        writer.writerow([message_id, sender_id, category_id, content, timestamp.isoformat()])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gzip_blocks(blocks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_stream(queryset, export_format='ndjson', gzip=False, chunk_size=CHUNK_SIZE):
+    """
+    Byte blocks of the exported rows; rows are fetched ``chunk_size`` at a time so memory stays flat.
+    """
+    rows = queryset.iterator(chunk_size=chunk_size)
+    lines = csv_lines(rows) if export_format == 'csv' else ndjson_lines(rows)
+    blocks = _blocks(lines)
+    return gzip_blocks(blocks) if gzip else blocks
+
+
+async def aiter_blocks(blocks):
+    """
+    Feed a synchronous export stream to an ASGI server one block at a time.
+
+    Django would otherwise read a synchronous iterator to the end before sending
+    anything. All steps run on the same thread, which the database cursor needs.
+    """
+    done = object()
+    next_block = sync_to_async(next, thread_sensitive=True)
+    while True:
+        block = await next_block(blocks, done)
+        if block is done:
+            break
+        yield block
@@ -0,0 +1,138 @@
+import json
+import time
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from common import activity
+from common.live import publish_messages_stored
+from common.models import Category, Message
+from user_accounts.models import Account
+
+
+def validate_message_row(record):
+    """
+    Check one decoded NDJSON record and return ``(row, errors)``.
+
+    Hand-written rather than a DRF serializer: at import volumes field
+    introspection and validator dispatch cost more than the insert itself.
+    """
+    if not isinstance(record, dict):
+        return None, {'non_field_errors': ['Expected a JSON object']}
+
+    errors = {}
+    for name in ['sender', 'category']:
+        value = record.get(name)
+        if type(value) is not int or value < 1:
+            errors[name] = ['A valid id is required.']
+    content = record.get('content')
+    if not isinstance(content, str) or not content.strip():
+        errors['content'] = ['This field may not be blank.']
+
+    timestamp = record.get('timestamp')
+    if timestamp is not None:
+        try:
+            timestamp = parse_datetime(timestamp) if isinstance(timestamp, str) else None
+        except ValueError:
+            timestamp = None
+        if timestamp is None:
+            errors['timestamp'] = ['Datetime has wrong format. Use ISO 8601.']
+        elif timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+
+    if errors:
+        return None, errors
+    return {'sender': record['sender'], 'category': record['category'], 'content': content,
+            'timestamp': timestamp}, None
+
+
+class MessageImporter:
+    """
+    Bulk-load messages from NDJSON lines.
+
+    Each batch is validated row by row with a lean validator, foreign keys are checked with one
+    ``IN`` query per table, and valid rows are written with ``bulk_create``
+    in a single transaction. A bad row is reported and skipped without
+    aborting its batch. The throughput target is at least 10,000 rows per
+    second on SQLite with the default batch size.
+    """
+    max_reported_errors = 1000
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.received = 0
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def report_errors(self, errors):
+        self.failed += len(errors)
+        errors.sort(key=lambda error: error['line'])
+        self.errors.extend(errors[:self.max_reported_errors - len(self.errors)])
+
+    def run(self, lines):
+        """
+        Import ``(line_number, text)`` pairs and return a report of the whole run.
+        """
+        started = time.perf_counter()
+        lines = iter(lines)
+        while True:
+            batch = list(islice(lines, self.batch_size))
+            if not batch:
+                break
+            self.import_batch(batch)
+        seconds = time.perf_counter() - started
+        return {
+            'received': self.received,
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(self.received / seconds) if seconds else 0,
+        }
+
+    def import_batch(self, batch):
+        self.received += len(batch)
+        rows, errors = [], []
+        for line_number, text in batch:
+            if isinstance(text, bytes):
+                # NDJSONParser hands over the raw bytes of a line it could not decode.
+                errors.append({'line': line_number, 'errors': {'non_field_errors': ['Invalid text encoding.']}})
+                continue
+            try:
+                row, row_errors = validate_message_row(json.loads(text))
+            except ValueError as e:
+                row, row_errors = None, {'non_field_errors': [f'Invalid JSON: {e}']}
+            if row_errors:
+                errors.append({'line': line_number, 'errors': row_errors})
+            else:
+                rows.append((line_number, row))
+
+        sender_ids = set(Account.objects.filter(
+            pk__in={row['sender'] for _, row in rows}).values_list('pk', flat=True))
+        category_ids = set(Category.objects.filter(
+            pk__in={row['category'] for _, row in rows}).values_list('pk', flat=True))
+
+        messages = []
+        for line_number, row in rows:
+            missing = {}
+            if row['sender'] not in sender_ids:
+                missing['sender'] = [f'Account {row["sender"]} does not exist']
+            if row['category'] not in category_ids:
+                missing['category'] = [f'Category {row["category"]} does not exist']
+            if missing:
+                errors.append({'line': line_number, 'errors': missing})
+                continue
+            messages.append(Message(sender_id=row['sender'], category_id=row['category'], content=row['content'],
+                                    timestamp=row['timestamp'] or timezone.now()))
+
+        with transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=self.batch_size)
+            activity.messages_created(messages)
+            category_ids = {message.category_id for message in messages}
+            transaction.on_commit(lambda: publish_messages_stored(category_ids))
+        self.created += len(messages)
+        self.report_errors(errors)
+        return messages
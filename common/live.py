@@ -0,0 +1,229 @@
+import asyncio
+import contextvars
+import logging
+from contextlib import asynccontextmanager
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Max
+
+from common.metrics import sync_to_async
+from common.models import Message
+from common.serializer import MessageSerializer
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_STORED = 'messages.stored'
+# Rows kept per category so clients that are nearly caught up are served without a query.
+WINDOW_SIZE = 500
+
+
+def stored_group(category_id):
+    return f'messages_{category_id}'
+
+
+def publish_messages_stored(category_ids, loop=None):
+    """
+    Wake SSE and long-poll clients of these categories in every process.
+
+    Pass ``loop`` to publish from a plain thread on behalf of the event loop
+    that owns the channel layer's queues. Publishing is best effort: feeds
+    also re-check their categories every ``MESSAGE_STREAM_HEARTBEAT`` seconds.
+    """
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    for category_id in set(category_ids):
+        event = {'type': MESSAGES_STORED, 'category': category_id}
+        if loop is not None and loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(layer.group_send(stored_group(category_id), event), loop)
+            future.add_done_callback(partial(_log_publish_failure, category_id))
+            continue
+        try:
+            async_to_sync(layer.group_send)(stored_group(category_id), event)
+        except Exception:
+            logger.exception('Could not publish new messages for category %s', category_id)
+
+
+def _log_publish_failure(category_id, future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error('Could not publish new messages for category %s', category_id, exc_info=future.exception())
+
+
+def fetch_messages(category_id, after_id, limit):
+    messages = Message.objects.filter(category_id=category_id, id__gt=after_id).order_by('id')[:limit]
+    return MessageSerializer(messages, many=True).data
+
+
+# For clients waiting on a request, whose measurement the thread hand-off is part of.
+afetch_messages = sync_to_async(fetch_messages, adapter=database_sync_to_async)
+
+
+def latest_message_id(category_id):
+    return Message.objects.filter(category_id=category_id).aggregate(latest=Max('id'))['latest'] or 0
+
+
+class CategoryFeed:
+    """
+    New messages of one category, read once per process and shared by every client waiting on it.
+    """
+
+    def __init__(self, category_id):
+        self.category_id = category_id
+        self.clients = 0
+        self.cursor = None
+        # ``rows`` holds every message with an id above ``floor``.
+        self.floor = None
+        self.rows = []
+        self.ready = asyncio.Event()
+        self.changed = asyncio.Event()
+        self.refreshing = asyncio.Lock()
+
+    def start(self, cursor):
+        self.cursor = self.floor = cursor
+
+    def rows_after(self, since_id, limit):
+        """
+        Rows newer than ``since_id`` from the window, or None when the window does not reach back that far.
+        """
+        if since_id < self.floor:
+            return None
+        rows = [row for row in self.rows if row['id'] > since_id]
+        return rows[:limit]
+
+    async def refresh(self):
+        if self.cursor is None:
+            return
+        async with self.refreshing:
+            found = False
+            while True:
+                rows = await database_sync_to_async(fetch_messages)(self.category_id, self.cursor, WINDOW_SIZE)
+                if not rows:
+                    break
+                found = True
+                self.cursor = rows[-1]['id']
+                self.rows.extend(rows)
+                if len(self.rows) > WINDOW_SIZE:
+                    # Older rows drop out of the window and are read from the database on demand.
+                    self.rows = self.rows[-WINDOW_SIZE:]
+                    self.floor = self.rows[0]['id'] - 1
+                if len(rows) < WINDOW_SIZE:
+                    break
+            if found:
+                changed, self.changed = self.changed, asyncio.Event()
+                changed.set()
+
+    async def wait(self, since_id, timeout, limit=None):
+        """
+        Messages newer than ``since_id``, waiting up to ``timeout`` seconds for some to arrive.
+        """
+        limit = limit or settings.MESSAGE_MAX_PAGE_SIZE
+        changed = self.changed
+        rows = self.rows_after(since_id, limit)
+        if rows is None:
+            rows = await afetch_messages(self.category_id, since_id, limit)
+        if rows:
+            return rows
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        rows = self.rows_after(since_id, limit)
+        if rows is None:
+            rows = await afetch_messages(self.category_id, since_id, limit)
+        return rows
+
+
+class MessageFeed:
+    """
+    Per-process fan-in of "messages stored" events for SSE and long-poll clients.
+
+    Each category with waiting clients is joined once on the channel layer.
+    An event makes the feed read the new rows once and wake every client of
+    that category, so a thousand idle clients cost one query per new batch
+    rather than a thousand polls.
+    """
+
+    def __init__(self):
+        self.categories = {}
+        self.layer = get_channel_layer()
+        self.channel = None
+        self.listener = None
+
+    @asynccontextmanager
+    async def subscribe(self, category_id):
+        category = self.categories.get(category_id)
+        first = category is None
+        if first:
+            category = self.categories[category_id] = CategoryFeed(category_id)
+        category.clients += 1
+        try:
+            if first:
+                try:
+                    # Join before reading the cursor so a message stored in between still wakes the feed.
+                    await self.join(category_id)
+                    category.start(await database_sync_to_async(latest_message_id)(category_id))
+                finally:
+                    category.ready.set()
+            else:
+                await category.ready.wait()
+                if category.cursor is None:
+                    raise RuntimeError(f'Could not subscribe to messages of category {category_id}')
+            yield category
+        finally:
+            category.clients -= 1
+            if category.clients == 0 and self.categories.get(category_id) is category:
+                del self.categories[category_id]
+                await self.leave(category_id)
+
+    async def join(self, category_id):
+        if self.layer is not None:
+            if self.channel is None:
+                self.channel = await self.layer.new_channel()
+            await self.layer.group_add(stored_group(category_id), self.channel)
+        if self.listener is None or self.listener.done():
+            # A fresh context keeps the listener's database calls off the short-lived executors that
+            # async_to_sync installs for publishers; asgiref shares that state between copied contexts.
+            self.listener = asyncio.get_running_loop().create_task(self.listen(), context=contextvars.Context())
+
+    async def leave(self, category_id):
+        if not self.categories and self.listener is not None:
+            self.listener.cancel()
+        if self.layer is not None:
+            await self.layer.group_discard(stored_group(category_id), self.channel)
+
+    async def listen(self):
+        heartbeat = settings.MESSAGE_STREAM_HEARTBEAT
+        while self.categories:
+            event = None
+            if self.layer is None:
+                await asyncio.sleep(heartbeat)
+            else:
+                try:
+                    event = await asyncio.wait_for(self.layer.receive(self.channel), heartbeat)
+                except asyncio.TimeoutError:
+                    pass
+            if event is None:
+                # Safety net for lost events: one query per category per heartbeat.
+                categories = list(self.categories.values())
+            else:
+                category = self.categories.get(event.get('category'))
+                categories = [category] if event.get('type') == MESSAGES_STORED and category else []
+            for category in categories:
+                await category.refresh()
+
+
+_feeds = {}
+
+
+def get_message_feed():
+    loop = asyncio.get_running_loop()
+    feed = _feeds.get(loop)
+    if feed is None:
+        for closed in [other for other in _feeds if other.is_closed()]:
+            del _feeds[closed]
+        feed = _feeds[loop] = MessageFeed()
+    return feed
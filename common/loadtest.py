@@ -0,0 +1,331 @@
+import asyncio
+import json
+import random
+import resource
+import time
+from contextvars import ContextVar
+from datetime import timedelta
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+from auth_service.authenticate import ClaimsRefreshToken
+from common import activity
+from common.benchmarks import asgi_request, percentile, synthetic_words
+from common.constants import UserRole
+from common.models import Category, Message
+from user_accounts.models import Account
+
+DEFAULT_TRACE = Path(__file__).with_name('loadtest_trace.jsonl')
+PAGE_SIZE = resource.getpagesize()
+
+# Queries made while handling the current replayed request, a one-item list so threads can add to it.
+request_queries = ContextVar('loadtest_request_queries', default=None)
+
+
+def seed_dataset(accounts, category_depth, category_fan_out, messages, seed=0, batch_size=10_000, log=print):
+    """
+    Fill the database with a synthetic helpdesk.
+
+    ``accounts`` maps each role to how many accounts to create. Categories
+    form a complete tree ``category_depth`` levels deep with
+    ``category_fan_out`` children per category. Half the messages go to one
+    busy leaf category, the rest are spread over all categories, with
+    timestamps counting up to now.
+    """
+    rng = random.Random(seed)
+    words = synthetic_words(2_000, seed)
+    for role, count in accounts.items():
+        log(f'Seeding {count} {role} accounts...')
+        Account.objects.bulk_create([
+            Account(username=f'{role}{index}@example.com', email=f'{role}{index}@example.com',
+                    first_name=rng.choice(words).title(), last_name=rng.choice(words).title(), role=role,
+                    is_staff=role == UserRole.ADMIN.value, password='!')
+            for index in range(count)
+        ], batch_size=batch_size)
+
+    log(f'Seeding a category tree {category_depth} levels deep...')
+    level, categories = [None], []
+    for _ in range(category_depth):
+        children = Category.objects.bulk_create([
+            Category(category_name=f'{rng.choice(words)} {rng.choice(words)}', answer=' '.join(rng.sample(words, 12)),
+                     parent_category=parent)
+            for parent in level for _ in range(category_fan_out)
+        ], batch_size=batch_size)
+        categories.extend(children)
+        level = children
+    # bulk_create skips save(), which maintains the materialized paths.
+    Category.rebuild_paths()
+
+    log(f'Seeding {messages} messages...')
+    senders = list(Account.objects.values_list('id', flat=True))
+    category_ids = [category.pk for category in categories]
+    busy_category_id = level[0].pk
+    start = timezone.now() - timedelta(seconds=messages)
+    for offset in range(0, messages, batch_size):
+        Message.objects.bulk_create([
+            Message(sender_id=rng.choice(senders),
+                    category_id=busy_category_id if index % 2 else rng.choice(category_ids),
+                    content=' '.join(rng.sample(words, 8)), timestamp=start + timedelta(seconds=index))
+            for index in range(offset, min(offset + batch_size, messages))
+        ])
+        if offset and offset % (batch_size * 50) == 0:
+            log(f'  {offset} messages')
+    activity.reconcile()
+
+
+class Dataset:
+    """
+    Ids and words of a seeded database, from which trace placeholders are drawn.
+    """
+
+    def __init__(self, users, category_ids, root_category_ids, leaf_category_ids, busy_category_id, words):
+        self.users = users
+        self.category_ids = category_ids
+        self.root_category_ids = root_category_ids
+        self.leaf_category_ids = leaf_category_ids
+        self.busy_category_id = busy_category_id
+        self.words = words
+
+    @classmethod
+    def load(cls):
+        users = {role.value: list(Account.objects.filter(role=role.value).order_by('id').values_list('id', flat=True))
+                 for role in UserRole}
+        categories = list(Category.objects.values_list('id', 'depth', 'category_name', 'message_count'))
+        if not categories:
+            raise ValueError('The database has no categories; seed it first.')
+        deepest = max(depth for _, depth, _, _ in categories)
+        return cls(
+            users=users,
+            category_ids=[pk for pk, _, _, _ in categories],
+            root_category_ids=[pk for pk, depth, _, _ in categories if depth == 0],
+            leaf_category_ids=[pk for pk, depth, _, _ in categories if depth == deepest],
+            busy_category_id=max(categories, key=lambda category: category[3])[0],
+            words=sorted({word for _, _, name, _ in categories for word in name.split()}),
+        )
+
+    def tokens(self):
+        """
+        An access token header for the first account of each role that has one.
+        """
+        accounts = Account.objects.in_bulk([ids[0] for ids in self.users.values() if ids])
+        return {account.role: f'Token {ClaimsRefreshToken.for_user(account).access_token}'
+                for account in accounts.values()}
+
+    def draw(self, rng, role=None):
+        word = rng.choice(self.words)
+        values = {
+            'category_id': rng.choice(self.category_ids),
+            'root_category_id': rng.choice(self.root_category_ids),
+            'leaf_category_id': rng.choice(self.leaf_category_ids),
+            'busy_category_id': self.busy_category_id,
+            'search_word': word,
+            'search_prefix': word[:3],
+            'user_id': self.users[role][0] if role else '',
+        }
+        for role_name, ids in self.users.items():
+            if ids:
+                values[f'{role_name}_id'] = rng.choice(ids)
+        return values
+
+
+def load_trace(path):
+    """
+    Read a JSONL trace: one request per line.
+
+    Each line has a ``path`` and optionally a ``name`` to report it under,
+    a ``method`` (GET), a ``query`` string, a ``body`` to send as JSON, the
+    ``user`` role to authenticate as and a ``weight`` (1) giving how often it
+    occurs in the mix. ``{placeholders}`` in the path, query and body are
+    filled from the seeded data, see ``Dataset.draw``.
+    """
+    entries = []
+    with open(path) as trace:
+        for number, line in enumerate(trace, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'path' not in entry:
+                raise ValueError(f'{path}:{number}: a path is required')
+            entry.setdefault('method', 'GET')
+            entry.setdefault('name', f'{entry["method"]} {entry["path"]}')
+            entries.append(entry)
+    if not entries:
+        raise ValueError(f'{path} has no requests')
+    return entries
+
+
+def fill_placeholders(value, values):
+    if isinstance(value, str):
+        return value.format(**values)
+    if isinstance(value, dict):
+        return {key: fill_placeholders(item, values) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill_placeholders(item, values) for item in value]
+    return value
+
+
+def build_requests(entries, dataset, total, seed=0):
+    """
+    ``total`` requests drawn from the trace by weight, as ``(name, method, path, query, headers, body)``.
+    """
+    rng = random.Random(seed)
+    tokens = dataset.tokens()
+    requests = []
+    for entry in rng.choices(entries, weights=[entry.get('weight', 1) for entry in entries], k=total):
+        values = dataset.draw(rng, entry.get('user'))
+        headers = [(b'content-type', b'application/json')]
+        if entry.get('user'):
+            headers.append((b'authorization', tokens[entry['user']].encode()))
+        body = json.dumps(fill_placeholders(entry['body'], values)).encode() if 'body' in entry else b''
+        requests.append((entry['name'], entry['method'], entry['path'].format(**values),
+                         entry.get('query', '').format(**values), headers, body))
+    return requests
+
+
+def count_query(execute, sql, params, many, context):
+    queries = request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def start_counting_queries():
+    """
+    Count queries on this thread's connections and on every connection opened from now on.
+    """
+    connection_created.connect(install_query_counter)
+    for connection in connections.all(initialized_only=True):
+        install_query_counter(None, connection)
+
+
+def stop_counting_queries():
+    connection_created.disconnect(install_query_counter)
+    for connection in connections.all(initialized_only=True):
+        if count_query in connection.execute_wrappers:
+            connection.execute_wrappers.remove(count_query)
+
+
+def current_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux; only the peak so far, which is what is reported anyway.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def replay(application, requests, clients, sample_interval=0.01):
+    """
+    Send ``requests`` through ``application`` from ``clients`` concurrent loops.
+
+    Returns the samples per endpoint name, each a dict of ``latencies``,
+    ``queries``, ``bytes``, the ``statuses`` seen and the ``peak_rss`` while
+    one of its requests was in flight, and the elapsed seconds.
+    """
+    results, in_flight, pending = {}, {}, iter(requests)
+    for name, *_ in requests:
+        results.setdefault(name, {'latencies': [], 'queries': [], 'bytes': [], 'statuses': {}, 'peak_rss': 0})
+
+    async def client():
+        for name, method, path, query_string, headers, body in pending:
+            queries = [0]
+            request_queries.set(queries)
+            in_flight[name] = in_flight.get(name, 0) + 1
+            start = time.perf_counter()
+            status, content = await asgi_request(application, method, path, query_string, headers, body)
+            elapsed = time.perf_counter() - start
+            in_flight[name] -= 1
+            result = results[name]
+            result['latencies'].append(elapsed)
+            result['queries'].append(queries[0])
+            result['bytes'].append(len(content))
+            result['statuses'][status] = result['statuses'].get(status, 0) + 1
+
+    async def sample_rss():
+        while True:
+            rss = current_rss()
+            for name, count in in_flight.items():
+                if count:
+                    results[name]['peak_rss'] = max(results[name]['peak_rss'], rss)
+            await asyncio.sleep(sample_interval)
+
+    # Connections belong to threads; this one is where the views' database work runs when there is no other.
+    await sync_to_async(start_counting_queries)()
+    sampler = asyncio.ensure_future(sample_rss())
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[client() for _ in range(clients)])
+        seconds = time.perf_counter() - start
+    finally:
+        sampler.cancel()
+        await sync_to_async(stop_counting_queries)()
+    return results, seconds
+
+
+def summarize_results(results, seconds):
+    """
+    The report for ``replay``'s samples: per endpoint and in total, in milliseconds, requests/s and megabytes.
+    """
+    endpoints = {}
+    for name, result in sorted(results.items()):
+        latencies = result['latencies']
+        if not latencies:
+            continue
+        endpoints[name] = {
+            'requests': len(latencies),
+            'errors': sum(count for status, count in result['statuses'].items() if status >= 400),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            # This endpoint's share of the run's throughput.
+            'requests_per_second': round(len(latencies) / seconds, 1),
+            'queries_mean': round(sum(result['queries']) / len(latencies), 2),
+            'queries_max': max(result['queries']),
+            'bytes_mean': round(sum(result['bytes']) / len(latencies)),
+            'peak_rss_mb': round(result['peak_rss'] / 2 ** 20, 1),
+        }
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {
+        'endpoints': endpoints,
+        'total': {
+            'requests': total,
+            'seconds': round(seconds, 2),
+            'requests_per_second': round(total / seconds, 1),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """
+    Regressions of ``report`` against ``baseline``, one line each.
+
+    Latency and throughput may be ``tolerance`` (a fraction) worse before
+    they count; query counts are deterministic enough that one more query
+    per request on average does.
+    """
+    regressions = []
+    for name, endpoint in report['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if before is None:
+            continue
+        for metric in ['p50_ms', 'p95_ms', 'p99_ms']:
+            if endpoint[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {before[metric]} -> {endpoint[metric]}')
+        if endpoint['requests_per_second'] < before['requests_per_second'] * (1 - tolerance):
+            regressions.append(f'{name}: requests_per_second {before["requests_per_second"]} -> '
+                               f'{endpoint["requests_per_second"]}')
+        if endpoint['queries_mean'] >= before['queries_mean'] + 1:
+            regressions.append(f'{name}: queries_mean {before["queries_mean"]} -> {endpoint["queries_mean"]}')
+        if endpoint['errors'] > before['errors']:
+            regressions.append(f'{name}: errors {before["errors"]} -> {endpoint["errors"]}')
+    return regressions
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from common.benchmarks import benchmark_database, summarize, timed
+from common.constants import UserRole
+from user_accounts.models import Account
+from user_accounts.serializer import AccountReadSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark listing accounts by role: serialized model instances against the values() projection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--parents', type=int, default=50_000)
+        parser.add_argument('--staff', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.stdout.write(f"Seeding {options['parents']} parents and {options['staff']} staff...")
+            for role, count in [(UserRole.PARENT.value, options['parents']), (UserRole.STAFF.value, options['staff'])]:
+                Account.objects.bulk_create([
+                    Account(username=f'{role}{index}@example.com', email=f'{role}{index}@example.com',
+                            first_name='First', last_name='Last', role=role, password='!')
+                    for index in range(count)
+                ], batch_size=5_000)
+            parents = Account.objects.filter(role=UserRole.PARENT.value)
+
+            def instances():
+                return AccountReadSerializer(parents, many=True).data
+
+            def projection():
+                return list(parents.values(*AccountReadSerializer.Meta.fields))
+
+            for label, func in [('model instances + AccountReadSerializer', instances), ('values() projection', projection)]:
+                samples = timed(func, options['repeat'])
+                self.stdout.write(f'{label}: {options["parents"] * len(samples) / sum(samples):.0f} rows/s')
+
+            staff = Account.objects.create_user(username='bench@example.com', email='bench@example.com',
+                                                password='!', role=UserRole.STAFF.value)
+            client = APIClient()
+            client.force_authenticate(staff)
+            samples, rows = [], 0
+            start = time.perf_counter()
+            url = f'/user_accounts/accounts/?role={UserRole.PARENT.value}&page_size={options["page_size"]}'
+            while url:
+                page_start = time.perf_counter()
+                page = client.get(url).json()
+                samples.append(time.perf_counter() - page_start)
+                rows += len(page['results'])
+                url = page['next']
+            seconds = time.perf_counter() - start
+            self.stdout.write(summarize(f'API page of {options["page_size"]} parents', samples))
+            self.stdout.write(f'API, walking every page: {rows / seconds:.0f} rows/s')
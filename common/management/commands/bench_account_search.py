@@ -0,0 +1,61 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from common.benchmarks import benchmark_database, summarize, synthetic_words, timed
+from common.constants import UserRole
+from user_accounts.models import Account
+from user_accounts.search import search_account_ids
+
+
+class Command(BaseCommand):
+    help = 'Benchmark account type-ahead search against an icontains scan on synthetic accounts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        first_names, last_names = synthetic_words(2_000, seed=options['seed']), synthetic_words(20_000, seed=1)
+
+        with benchmark_database():
+            self.stdout.write(f"Seeding {options['accounts']} accounts...")
+            batch = []
+            for index in range(options['accounts']):
+                first, last = rng.choice(first_names), rng.choice(last_names)
+                email = f'{first}.{last}{index}@example.com'
+                batch.append(Account(username=email, email=email, first_name=first.title(), last_name=last.title(),
+                                     role=UserRole.STAFF.value if index % 50 == 0 else UserRole.PARENT.value,
+                                     password='!'))
+                if len(batch) == 10_000:
+                    Account.objects.bulk_create(batch)
+                    batch = []
+            Account.objects.bulk_create(batch)
+
+            # What staff type while looking someone up: a few letters, a full name, or a name that is not there.
+            query_sets = {
+                'prefix': [rng.choice(last_names)[:rng.randint(2, 4)] for _ in range(options['queries'])],
+                'full name': [f'{rng.choice(first_names)} {rng.choice(last_names)[:3]}'
+                              for _ in range(options['queries'])],
+                'miss': [f'zz{word}' for word in rng.sample(last_names, options['queries'])],
+            }
+            for name, queries in query_sets.items():
+                for role in [None, UserRole.STAFF.value]:
+                    label = f'{name}{", staff only" if role else ""}'
+                    indexed_queries, scan_queries = iter(queries), iter(queries)
+
+                    def indexed():
+                        search_account_ids(next(indexed_queries), 10, role)
+
+                    def scan():
+                        queryset = Account.objects.filter(role=role) if role else Account.objects.all()
+                        for term in next(scan_queries).split():
+                            queryset = queryset.filter(Q(first_name__icontains=term) | Q(last_name__icontains=term) |
+                                                       Q(email__icontains=term))
+                        list(queryset.order_by('id').values_list('id', flat=True)[:10])
+
+                    self.stdout.write(summarize(f'{label}: indexed search', timed(indexed, len(queries))))
+                    self.stdout.write(summarize(f'{label}: icontains scan', timed(scan, len(queries))))
@@ -0,0 +1,75 @@
+import asyncio
+import importlib
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.urls import clear_url_caches
+
+import common.urls
+import helpdesk.urls
+import user_accounts.urls
+from auth_service.authenticate import ClaimsRefreshToken
+from common.benchmarks import asgi_request, benchmark_database, run_clients, summarize
+from common.constants import UserRole
+from common.models import Category, Message
+from user_accounts.models import Account
+
+
+def reload_urls():
+    for module in [user_accounts.urls, common.urls, helpdesk.urls]:
+        importlib.reload(module)
+    clear_url_caches()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the hot read endpoints under many concurrent clients, as DRF views and as async views.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--requests', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            staff = Account.objects.create_user(username='staff@example.com', email='staff@example.com',
+                                                password='!', role=UserRole.STAFF.value)
+            Account.objects.bulk_create([
+                Account(username=f'parent{index}@example.com', email=f'parent{index}@example.com',
+                        first_name='First', last_name='Last', role=UserRole.PARENT.value, password='!')
+                for index in range(2_000)
+            ])
+            categories = [Category.objects.create(category_name='Root')]
+            for index in range(150):
+                categories.append(Category.objects.create(category_name=f'Category {index}',
+                                                          parent_category=categories[index // 5]))
+            Message.objects.bulk_create([
+                Message(sender=staff, category=categories[0], content=f'message number {index} about school fees')
+                for index in range(5_000)
+            ])
+            auth = [(b'authorization', f'Token {ClaimsRefreshToken.for_user(staff).access_token}'.encode())]
+            endpoints = {
+                'account detail': (f'/user_accounts/accounts/{staff.id}/', '', auth),
+                'account list': ('/user_accounts/accounts/', f'role={UserRole.PARENT.value}&page_size=50', auth),
+                'category list': ('/common/categories/', '', ()),
+                'messages by category': ('/common/messages/by_category/', f'category_id={categories[0].id}', ()),
+            }
+
+            application = get_asgi_application()
+            try:
+                for async_reads in [False, True]:
+                    with override_settings(ASYNC_READ_VIEWS=async_reads):
+                        reload_urls()
+                    label = 'async views' if async_reads else 'DRF views'
+                    for name, (path, query_string, headers) in endpoints.items():
+                        async def request():
+                            status, _ = await asgi_request(application, 'GET', path, query_string, headers)
+                            assert status == 200, f'{name}: {status}'
+
+                        # Warm up first, so cached responses are measured as served rather than built 500 times.
+                        asyncio.run(run_clients(request, 1, 10))
+                        samples, seconds = asyncio.run(run_clients(request, options['clients'], options['requests']))
+                        self.stdout.write(summarize(f'{name}, {label}', samples))
+                        self.stdout.write(f'{name}, {label}: {len(samples) / seconds:.0f} requests/s '
+                                          f'at {options["clients"]} concurrent clients')
+            finally:
+                reload_urls()
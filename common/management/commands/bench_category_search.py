@@ -0,0 +1,55 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from common.benchmarks import benchmark_database, summarize, synthetic_words, timed
+from common.models import Category
+from common.search import search_category_ids
+
+
+class Command(BaseCommand):
+    help = 'Benchmark category full-text search against an icontains scan on a synthetic corpus.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = synthetic_words(5_000, seed=options['seed'])
+
+        with benchmark_database():
+            self.stdout.write(f"Seeding {options['categories']} categories...")
+            batch = []
+            for index in range(options['categories']):
+                batch.append(Category(
+                    category_name=' '.join(rng.sample(vocabulary, 3)),
+                    answer=' '.join(rng.choices(vocabulary, k=40)),
+                ))
+                if len(batch) == 5_000:
+                    Category.objects.bulk_create(batch)
+                    batch = []
+            Category.objects.bulk_create(batch)
+            Category.rebuild_paths()
+
+            # Prefixes match many rows, whole words fewer, and misses force the scan through the whole table.
+            query_sets = {
+                'prefix': [rng.choice(vocabulary)[:rng.randint(3, 5)] for _ in range(options['queries'])],
+                'word': [rng.choice(vocabulary) for _ in range(options['queries'])],
+                'miss': [f'zz{word}' for word in rng.sample(vocabulary, options['queries'])],
+            }
+            for name, queries in query_sets.items():
+                full_text_queries, scan_queries = iter(queries), iter(queries)
+
+                def full_text():
+                    search_category_ids(next(full_text_queries), 20)
+
+                def scan():
+                    term = next(scan_queries)
+                    list(Category.objects.filter(Q(category_name__icontains=term) | Q(answer__icontains=term),
+                                                 is_active=True).values_list('id', flat=True)[:20])
+
+                self.stdout.write(summarize(f'{name}: full-text search', timed(full_text, len(queries))))
+                self.stdout.write(summarize(f'{name}: icontains scan', timed(scan, len(queries))))
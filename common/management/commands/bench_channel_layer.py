@@ -0,0 +1,57 @@
+import asyncio
+import tempfile
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from common.benchmarks import benchmark_database, summarize
+from common.channel_layers import DatabaseChannelLayer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the database channel layer against the in-memory layer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2_000)
+        parser.add_argument('--members', type=int, default=20, help='Channels in the group used for group_send.')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            socket_dir = tempfile.mkdtemp()
+            memory = InMemoryChannelLayer(capacity=options['messages'])
+            # The database layer is measured both within one process and across two layer instances,
+            # which is the path a message takes between daphne workers.
+            local = DatabaseChannelLayer(capacity=options['messages'], socket_dir=socket_dir)
+            remote = DatabaseChannelLayer(capacity=options['messages'], socket_dir=socket_dir)
+            for label, sender, receiver in [('in-memory', memory, memory),
+                                            ('database, same process', local, local),
+                                            ('database, across processes', local, remote)]:
+                async_to_sync(self.run)(label, sender, receiver, options)
+
+    async def run(self, label, sender, receiver, options):
+        channel = await receiver.new_channel()
+        count = options['messages']
+
+        start = time.perf_counter()
+        for index in range(count):
+            await sender.send(channel, {'type': 'test', 'index': index})
+        for _ in range(count):
+            await receiver.receive(channel)
+        seconds = time.perf_counter() - start
+        self.stdout.write(f'{label}: {count / seconds:.0f} messages/s send+receive')
+
+        channels = [await receiver.new_channel() for _ in range(options['members'])]
+        for member in channels:
+            await receiver.group_add('bench', member)
+        samples = []
+        for _ in range(min(count, 200)):
+            start = time.perf_counter()
+            await sender.group_send('bench', {'type': 'test'})
+            await asyncio.gather(*[receiver.receive(member) for member in channels])
+            samples.append(time.perf_counter() - start)
+        self.stdout.write(summarize(f'{label}: group_send to {len(channels)} members until all received', samples))
+        await receiver.flush()
+        if sender is not receiver:
+            await sender.flush()
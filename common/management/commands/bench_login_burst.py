@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+from collections import Counter
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from common.benchmarks import benchmark_database, summarize
+from common.constants import UserRole
+from common.models import Category
+from user_accounts import hashing
+from user_accounts.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Measure category list latency while a burst of logins runs, with pooled and inline password hashing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=32, help='Threads sending logins at once.')
+        parser.add_argument('--probes', type=int, default=100, help='Category list requests timed before the burst.')
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--max-pending', type=int, default=16)
+
+    def handle(self, *args, **options):
+        # Logins turned away by the cap are expected here; don't log each 503.
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        with benchmark_database():
+            account = Account.objects.create_user(
+                username='parent@example.com', email='parent@example.com', password='secret',
+                role=UserRole.PARENT.value)
+            Category.objects.bulk_create([Category(category_name=f'Category {index}') for index in range(20)])
+            Category.rebuild_paths()
+            token = str(AccessToken.for_user(account))
+
+            for label, workers in [('inline hashing', 0), (f'{options["workers"]} hashing workers', options['workers'])]:
+                # The cap stays in force for the inline run too, so only where the hashing happens differs.
+                pool = hashing.PasswordHasherPool(workers=workers, max_pending=options['max_pending'])
+                with mock.patch.object(hashing, 'password_hasher', pool):
+                    self.run(label, token, options)
+                pool.shutdown()
+
+    def run(self, label, token, options):
+        probe = APIClient()
+        probe.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+
+        def timed_probe():
+            start = time.perf_counter()
+            response = probe.get('/common/categories/')
+            assert response.status_code == 200, response.status_code
+            return time.perf_counter() - start
+
+        timed_probe()
+        idle = [timed_probe() for _ in range(options['probes'])]
+
+        remaining = iter(range(options['logins']))
+        lock = threading.Lock()
+        outcomes = Counter()
+
+        def login():
+            client = APIClient()
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        break
+                try:
+                    response = client.post('/user_accounts/login/',
+                                           {'email': 'parent@example.com', 'password': 'secret'})
+                    outcome = response.status_code
+                except OperationalError:
+                    # SQLite test databases lock whole tables when logins record their refresh tokens at once.
+                    outcome = 'database locked'
+                with lock:
+                    outcomes[outcome] += 1
+            connection.close()
+
+        threads = [threading.Thread(target=login) for _ in range(options['concurrency'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        busy = []
+        while any(thread.is_alive() for thread in threads):
+            busy.append(timed_probe())
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+        self.stdout.write(summarize(f'{label}: category list, idle', idle))
+        self.stdout.write(summarize(f'{label}: category list, during login burst', busy))
+        self.stdout.write(f'{label}: {options["logins"]} logins in {seconds:.2f}s, responses '
+                          + ', '.join(f'{code}: {count}' for code, count in sorted(outcomes.items(), key=str)))
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from common.benchmarks import benchmark_database, summarize, timed
+from common.compiled import compile_read_serializer
+from common.constants import UserRole
+from common.models import Category, Message
+from common.renderers import FastJSONRenderer
+from common.serializer import CategoryReadSerializer, MessageSerializer, category_tree_data
+from common.tree import CategoryTree
+from user_accounts.models import Account
+from user_accounts.serializer import AccountReadSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ModelSerializer + JSONRenderer against compiled rows + FastJSONRenderer on large lists.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        with benchmark_database():
+            self.stdout.write(f'Seeding {count} accounts, messages and categories...')
+            Account.objects.bulk_create([
+                Account(username=f'user{index}@example.com', email=f'user{index}@example.com', first_name='First',
+                        last_name='Last', role=UserRole.PARENT.value, password='!')
+                for index in range(count)
+            ], batch_size=5_000)
+            sender = Account.objects.first()
+            root = Category.objects.create(category_name='Root')
+            Message.objects.bulk_create([
+                Message(sender=sender, category=root, content=f'message number {index} about school fees')
+                for index in range(count)
+            ], batch_size=5_000)
+            # Ten top-level categories, each with its share of the rest directly below it.
+            tops = [Category.objects.create(category_name=f'Top {index}', parent_category=root) for index in range(10)]
+            Category.objects.bulk_create([
+                Category(category_name=f'Category {index}', answer='An answer', parent_category=tops[index % 10])
+                for index in range(count - 11)
+            ], batch_size=5_000)
+            Category.rebuild_paths()
+
+            accounts, messages = Account.objects.order_by('-id'), Message.objects.order_by('-id')
+            account_rows, message_rows = compile_read_serializer(AccountReadSerializer), \
+                compile_read_serializer(MessageSerializer)
+            cases = {
+                'accounts': (
+                    lambda: AccountReadSerializer(accounts, many=True).data,
+                    lambda: account_rows.serialize(account_rows.values(accounts)),
+                ),
+                'messages': (
+                    lambda: MessageSerializer(messages, many=True).data,
+                    lambda: message_rows.serialize(message_rows.values(messages)),
+                ),
+                'categories': (self.category_serializer_data, self.category_compiled_data),
+            }
+            for name, (serializer, compiled) in cases.items():
+                for label, build, renderer in [('ModelSerializer + JSONRenderer', serializer, JSONRenderer()),
+                                               ('compiled rows + FastJSONRenderer', compiled, FastJSONRenderer())]:
+                    data = build()
+                    self.stdout.write(summarize(f'{count} {name}, {label}: query + serialize',
+                                                timed(build, options['repeat'])))
+                    self.stdout.write(summarize(f'{count} {name}, {label}: render',
+                                                timed(lambda: renderer.render(data), options['repeat'])))
+
+    def category_serializer_data(self):
+        tree = CategoryTree.load()
+        return CategoryReadSerializer(tree.categories, many=True, context={'category_tree': tree}).data
+
+    def category_compiled_data(self):
+        tree = CategoryTree.load()
+        return category_tree_data(tree, tree.categories)
@@ -0,0 +1,120 @@
+import multiprocessing
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test import override_settings
+
+from common import sqlite
+from common.benchmarks import benchmark_database, summarize
+from common.buffer import MessageBuffer
+from common.constants import UserRole
+from common.models import Category, Message
+from user_accounts.models import Account
+
+
+class Command(BaseCommand):
+    help = ('Benchmark mixed read/write throughput on an SQLite file: as Django sets SQLite up, with the tuned '
+            'pragmas, and with the tuned pragmas and the single writer queue.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--processes', type=int, default=2, help='Worker processes, like daphne workers.')
+        parser.add_argument('--readers', type=int, default=2, help='Reading threads per process.')
+        parser.add_argument('--writers', type=int, default=2, help='Writing threads per process.')
+        parser.add_argument('--messages', type=int, default=50_000, help='Messages seeded before measuring.')
+
+    def handle(self, *args, **options):
+        variants = [('default', 'default', False), ('tuned pragmas', 'tuned', False),
+                    ('tuned pragmas and writer queue', 'tuned', True)]
+        test_settings = connections['default'].settings_dict['TEST']
+        old_name = test_settings['NAME']
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                for label, mode, queued in variants:
+                    # WAL mode sticks to the file, so every variant gets a new one.
+                    test_settings['NAME'] = str(Path(directory) / f'{mode}-{queued}.sqlite3')
+                    with override_settings(SQLITE_MODE=mode), benchmark_database():
+                        self.run(label, queued, options)
+            finally:
+                test_settings['NAME'] = old_name
+
+    def run(self, label, queued, options):
+        sender = Account.objects.create_user(username='staff@example.com', email='staff@example.com',
+                                             password='!', role=UserRole.STAFF.value)
+        categories = [Category.objects.create(category_name=f'Category {index}') for index in range(10)]
+        Message.objects.bulk_create([
+            Message(sender=sender, category=categories[index % 10], content=f'message number {index}')
+            for index in range(options['messages'])
+        ])
+        # Forked workers must not share the parent's connection.
+        connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        deadline = time.monotonic() + 0.5 + options['seconds']
+        workers = [context.Process(target=self.work, args=(queued, sender, categories, options, deadline, results))
+                   for _ in range(options['processes'])]
+        for worker in workers:
+            worker.start()
+        reads, writes, errors = [], [], []
+        for _ in workers:
+            worker_reads, worker_writes, worker_errors = results.get()
+            reads += worker_reads
+            writes += worker_writes
+            errors += worker_errors
+        for worker in workers:
+            worker.join()
+
+        self.stdout.write(f'{label}: {len(reads) / options["seconds"]:.0f} reads/s, '
+                          f'{len(writes) / options["seconds"]:.0f} writes/s, '
+                          f'{errors.count("read")} failed reads, {errors.count("write")} failed writes')
+        for name, samples in [('reads', reads), ('writes', writes)]:
+            if samples:
+                self.stdout.write(summarize(f'{label}: {name}', samples))
+
+    def work(self, queued, sender, categories, options, deadline, results):
+        """
+        One worker process: reading and writing threads until ``deadline``, then their samples to ``results``.
+        """
+        buffer = MessageBuffer()
+        reads, writes, errors = [], [], []
+
+        def read(index):
+            category_id = categories[index % len(categories)].id
+            return list(Message.objects.filter(category_id=category_id).order_by('-id')
+                        .values('id', 'sender_id', 'content', 'timestamp')[:50])
+
+        def write(index):
+            # One chat message, written the way the chat buffer writes a batch.
+            message = Message(sender=sender, category=categories[index % len(categories)], content=f'new {index}')
+            if queued:
+                return sqlite.write(buffer.write, [message])
+            return buffer.write([message])
+
+        def client(action, samples, index):
+            while time.monotonic() < deadline - options['seconds']:
+                time.sleep(0.01)
+            try:
+                while time.monotonic() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        action(index)
+                    except OperationalError:
+                        errors.append(action.__name__)
+                    else:
+                        samples.append(time.perf_counter() - start)
+                    index += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client, args=(read, reads, index)) for index in range(options['readers'])]
+        threads += [threading.Thread(target=client, args=(write, writes, index)) for index in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results.put((reads, writes, errors))
@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from common.benchmarks import benchmark_database, summarize
+from common.constants import UserRole
+from common.models import Category
+from user_accounts.models import Account
+
+
+class Command(BaseCommand):
+    help = 'Benchmark WebSocket connects per second through the JWT middleware during a reconnect storm.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=5_000)
+        parser.add_argument('--storms', type=int, default=3,
+                            help='The first storm starts with a cold cache, later ones reconnect the same clients.')
+        parser.add_argument('--cache-size', type=int, default=None,
+                            help='Override WEBSOCKET_AUTH_CACHE_SIZE; 0 disables the cache.')
+
+    def handle(self, *args, **options):
+        overrides = {'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}}
+        if options['cache_size'] is not None:
+            overrides['WEBSOCKET_AUTH_CACHE_SIZE'] = options['cache_size']
+
+        with benchmark_database(), override_settings(**overrides):
+            from helpdesk.asgi import application
+
+            self.stdout.write(f"Seeding {options['clients']} accounts...")
+            Account.objects.bulk_create([
+                Account(username=f'user{index}@example.com', email=f'user{index}@example.com',
+                        role=UserRole.PARENT.value, password='!')
+                for index in range(options['clients'])
+            ], batch_size=1_000)
+            category = Category.objects.create(category_name='Storm')
+            tokens = [str(AccessToken.for_user(account)) for account in Account.objects.order_by('id')]
+
+            for storm in range(options['storms']):
+                seconds, samples, rejected = async_to_sync(self.storm)(application, category.id, tokens)
+                self.stdout.write(summarize(f'storm {storm + 1}: connect', samples))
+                self.stdout.write(f'storm {storm + 1}: {len(tokens) / seconds:.0f} connects/s, '
+                                  f'{rejected} rejected, {seconds:.2f}s total')
+
+    async def storm(self, application, category_id, tokens):
+        samples = []
+
+        async def connect(token):
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{category_id}/?token={token}')
+            start = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=60)
+            samples.append(time.perf_counter() - start)
+            return communicator, connected
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[connect(token) for token in tokens])
+        seconds = time.perf_counter() - start
+        await asyncio.gather(*[communicator.disconnect() for communicator, connected in results if connected])
+        return seconds, samples, sum(1 for _, connected in results if not connected)
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from common.export import EXPORT_FORMATS, export_queryset, export_stream, parse_bound
+
+
+class Command(BaseCommand):
+    help = "Write a category's message history to a file as NDJSON or CSV for offline archiving."
+
+    def add_arguments(self, parser):
+        parser.add_argument('category_id', type=int)
+        parser.add_argument('--since', help='ISO date or datetime, inclusive')
+        parser.add_argument('--until', help='ISO date or datetime, exclusive')
+        parser.add_argument('--format', dest='export_format', choices=list(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--output', '-o', default='-', help="File to write, '-' for stdout")
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_bound(options['since'])
+            until = parse_bound(options['until'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        queryset = export_queryset(options['category_id'], since, until)
+        blocks = export_stream(queryset, options['export_format'], options['gzip'], options['chunk_size'])
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for block in blocks:
+                output.write(block)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
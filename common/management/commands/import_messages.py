@@ -0,0 +1,29 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from common.ingest import MessageImporter
+
+
+class Command(BaseCommand):
+    help = 'Bulk import messages from an NDJSON file, e.g. a dump from the old ticketing tool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file to read, '-' for stdin")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        source = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            lines = ((number, line) for number, line in enumerate(source, start=1) if line.strip())
+            report = MessageImporter(batch_size=options['batch_size']).run(lines)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {json.dumps(error['errors'])}")
+        self.stdout.write(
+            f"Imported {report['created']} of {report['received']} messages "
+            f"({report['failed']} failed) in {report['seconds']}s, {report['rows_per_second']} rows/s")
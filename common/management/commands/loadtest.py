@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from common.benchmarks import benchmark_database
+from common.constants import UserRole
+from common.loadtest import (DEFAULT_TRACE, Dataset, build_requests, compare_to_baseline, load_trace, replay,
+                             seed_dataset, summarize_results)
+from common.models import Category
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic helpdesk into a test database, replay a JSONL request trace against the ASGI '
+            'application and report latency, throughput, query counts and memory per endpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trace', default=str(DEFAULT_TRACE), help='JSONL trace, see common.loadtest.load_trace')
+        parser.add_argument('--requests', type=int, default=5_000)
+        parser.add_argument('--clients', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--parents', type=int, default=20_000)
+        parser.add_argument('--staff', type=int, default=200)
+        parser.add_argument('--managers', type=int, default=20)
+        parser.add_argument('--admins', type=int, default=5)
+        parser.add_argument('--category-depth', type=int, default=6)
+        parser.add_argument('--category-fan-out', type=int, default=3)
+        parser.add_argument('--messages', type=int, default=1_000_000)
+        parser.add_argument('--database-file', help='SQLite file for the test database instead of memory')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the test database, and reuse it without seeding if it has data')
+        parser.add_argument('--baseline', help='Report a failure when results are worse than this saved report')
+        parser.add_argument('--save-baseline', help='Save the report here as JSON')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='How much worse than the baseline latency and throughput may be, as a fraction')
+
+    def handle(self, *args, **options):
+        entries = load_trace(options['trace'])
+        if options['database_file']:
+            connections['default'].settings_dict['TEST']['NAME'] = options['database_file']
+
+        with benchmark_database(keepdb=options['keepdb']):
+            if Category.objects.exists():
+                self.stdout.write('Reusing the seeded test database.')
+            else:
+                seed_dataset(
+                    accounts={UserRole.PARENT.value: options['parents'], UserRole.STAFF.value: options['staff'],
+                              UserRole.MANAGER.value: options['managers'], UserRole.ADMIN.value: options['admins']},
+                    category_depth=options['category_depth'], category_fan_out=options['category_fan_out'],
+                    messages=options['messages'], seed=options['seed'], log=self.stdout.write,
+                )
+            requests = build_requests(entries, Dataset.load(), options['requests'], options['seed'])
+
+            application = get_asgi_application()
+            self.stdout.write(f'Replaying {len(requests)} requests from {options["clients"]} clients...')
+            # One pass over a slice first, so caches and connections are warm when measuring starts.
+            asyncio.run(replay(application, requests[:len(entries) * 5], 1))
+            report = summarize_results(*asyncio.run(replay(application, requests, options['clients'])))
+
+        for name, endpoint in report['endpoints'].items():
+            self.stdout.write(
+                f'{name}: n={endpoint["requests"]} errors={endpoint["errors"]} p50={endpoint["p50_ms"]}ms '
+                f'p95={endpoint["p95_ms"]}ms p99={endpoint["p99_ms"]}ms {endpoint["requests_per_second"]} requests/s '
+                f'queries={endpoint["queries_mean"]} (max {endpoint["queries_max"]}) '
+                f'bytes={endpoint["bytes_mean"]} peak RSS={endpoint["peak_rss_mb"]}MB')
+        total = report['total']
+        self.stdout.write(f'total: {total["requests"]} requests in {total["seconds"]}s, '
+                          f'{total["requests_per_second"]} requests/s, peak RSS {total["peak_rss_mb"]}MB')
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f'Saved the report to {options["save_baseline"]}.')
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = compare_to_baseline(report, json.load(baseline), options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write('No regressions against the baseline.')
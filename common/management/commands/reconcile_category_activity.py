@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from common import activity
+from common.cache import bump_tree_version
+
+
+class Command(BaseCommand):
+    help = 'Recompute message_count, last_message_id and last_message_at for every category.'
+
+    def handle(self, *args, **options):
+        updated = activity.reconcile()
+        bump_tree_version()
+        self.stdout.write(f'Reconciled activity for {updated} categories')
@@ -0,0 +1,325 @@
+import heapq
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async as asgiref_sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+# Statements kept per sampled request; past this only the counts go on.
+MAX_SAMPLED_STATEMENTS = 200
+
+# The measurement of the request or websocket event being handled, shared with the threads it hands work to.
+current_measurement = ContextVar('metrics_measurement', default=None)
+
+
+class Measurement:
+    __slots__ = ['started', 'queries', 'query_seconds', 'sync_wait_seconds', 'bytes', 'statements']
+
+    def __init__(self, sample_sql=False):
+        self.statements = [] if sample_sql else None
+        self.restart()
+
+    def restart(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.sync_wait_seconds = 0.0
+        self.bytes = 0
+        if self.statements is not None:
+            self.statements = []
+
+
+class Histogram:
+    """
+    Fixed buckets, so memory does not grow with the number of observations.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines, cumulative = [], 0
+        for bound, count in zip([*self.buckets, '+Inf'], self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.duration = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.query_duration = Histogram(LATENCY_BUCKETS)
+        self.sync_wait = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.statuses = {}
+
+
+class Metrics:
+    """
+    In-process aggregation of request measurements, rendered in the Prometheus text format.
+
+    Series are kept per route pattern rather than per path, and methods
+    outside the standard ones share one label, so memory stays bounded
+    however many distinct URLs are requested. With
+    ``settings.METRICS_SLOW_REQUESTS`` above zero the slowest requests are
+    kept too, with their SQL, for ``slow_requests()``.
+    """
+    histograms = [
+        ('duration', 'helpdesk_request_duration_seconds', 'Time to handle a request or websocket event.'),
+        ('queries', 'helpdesk_request_queries', 'Database queries per request or websocket event.'),
+        ('query_duration', 'helpdesk_request_query_duration_seconds', 'Time spent in database queries.'),
+        ('sync_wait', 'helpdesk_request_sync_wait_seconds',
+         'Time sync work waited for a thread after being handed off from async code.'),
+        ('size', 'helpdesk_response_size_bytes', 'Response body, or websocket frames sent, in bytes.'),
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+            self.slowest = []
+            self.sequence = itertools.count()
+
+    def record(self, route, method, status, measurement, description=''):
+        duration = time.perf_counter() - measurement.started
+        if method not in HTTP_METHODS and not method.startswith('websocket.'):
+            method = 'OTHER'
+        status_class = f'{str(status)[0]}xx'
+        with self.lock:
+            metrics = self.routes.get((route, method))
+            if metrics is None:
+                metrics = self.routes[route, method] = RouteMetrics()
+            metrics.duration.observe(duration)
+            metrics.queries.observe(measurement.queries)
+            metrics.query_duration.observe(measurement.query_seconds)
+            metrics.sync_wait.observe(measurement.sync_wait_seconds)
+            metrics.size.observe(measurement.bytes)
+            metrics.statuses[status_class] = metrics.statuses.get(status_class, 0) + 1
+
+            sample_size = settings.METRICS_SLOW_REQUESTS
+            if measurement.statements is not None and sample_size > 0:
+                if len(self.slowest) < sample_size or duration > self.slowest[0][0]:
+                    sample = {
+                        'route': route, 'method': method, 'request': description, 'status': status,
+                        'at': time.time(), 'duration': duration, 'queries': measurement.queries,
+                        'query_seconds': measurement.query_seconds,
+                        'sync_wait_seconds': measurement.sync_wait_seconds, 'bytes': measurement.bytes,
+                        'sql': measurement.statements,
+                    }
+                    heapq.heappush(self.slowest, (duration, next(self.sequence), sample))
+                    while len(self.slowest) > sample_size:
+                        heapq.heappop(self.slowest)
+
+    def render(self):
+        with self.lock:
+            routes = sorted(self.routes.items())
+            lines = [
+                '# HELP helpdesk_requests_total Requests and websocket events handled, by status class.',
+                '# TYPE helpdesk_requests_total counter',
+            ]
+            for (route, method), metrics in routes:
+                for status_class, count in sorted(metrics.statuses.items()):
+                    lines.append(f'helpdesk_requests_total{{{labels(route, method)},status="{status_class}"}} {count}')
+            for attribute, name, description in self.histograms:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for (route, method), metrics in routes:
+                    lines.extend(getattr(metrics, attribute).render(name, labels(route, method)))
+        return '\n'.join(lines) + '\n'
+
+    def slow_requests(self):
+        """
+        The sampled requests, slowest first.
+        """
+        with self.lock:
+            return [sample for _, _, sample in sorted(self.slowest, reverse=True)]
+
+
+def label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(route, method):
+    return f'route="{label_value(route)}",method="{label_value(method)}"'
+
+
+metrics = Metrics()
+
+
+def record_query(execute, sql, params, many, context):
+    measurement = current_measurement.get()
+    if measurement is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        measurement.queries += 1
+        measurement.query_seconds += elapsed
+        if measurement.statements is not None and len(measurement.statements) < MAX_SAMPLED_STATEMENTS:
+            # The SQL without its parameters, so samples carry no user data.
+            measurement.statements.append({'sql': sql, 'many': many, 'seconds': elapsed})
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def sync_to_async(func, thread_sensitive=True, adapter=asgiref_sync_to_async):
+    """
+    ``adapter(func)``, recording how long each call waited for its thread in the current measurement.
+
+    ``adapter`` is asgiref's ``sync_to_async`` or channels'
+    ``database_sync_to_async``.
+    """
+    def run(scheduled, *args, **kwargs):
+        measurement = current_measurement.get()
+        if measurement is not None:
+            measurement.sync_wait_seconds += time.perf_counter() - scheduled
+        return func(*args, **kwargs)
+    run = adapter(run, thread_sensitive=thread_sensitive)
+
+    @wraps(func)
+    async def call(*args, **kwargs):
+        return await run(time.perf_counter(), *args, **kwargs)
+    return call
+
+
+def request_route(request):
+    match = request.resolver_match
+    if match is None:
+        return '<unmatched>'
+    return match.view_name if match.url_name else match.route
+
+
+class MetricsMiddleware:
+    """
+    Record every request's latency, queries, response size and thread waits in ``metrics``.
+
+    Streaming responses are recorded when the view returns them, before the
+    body is sent, and their size as 0. Waits are those of the project's own
+    async-to-sync hand-offs (see ``sync_to_async``); the ones Django makes
+    around sync middleware are not visible from here.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        measurement = Measurement(sample_sql=settings.METRICS_SLOW_REQUESTS > 0)
+        token = current_measurement.set(measurement)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_measurement.reset(token)
+        self.record(request, response, measurement)
+        return response
+
+    async def __acall__(self, request):
+        measurement = Measurement(sample_sql=settings.METRICS_SLOW_REQUESTS > 0)
+        token = current_measurement.set(measurement)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_measurement.reset(token)
+        self.record(request, response, measurement)
+        return response
+
+    def record(self, request, response, measurement):
+        if not response.streaming:
+            measurement.bytes = len(response.content)
+        metrics.record(request_route(request), request.method, response.status_code, measurement,
+                       description=request.path)
+
+
+def websocket_route(path, urlpatterns):
+    path = path.lstrip('/')
+    for pattern in urlpatterns:
+        if pattern.pattern.match(path):
+            return str(pattern.pattern)
+    return '<unmatched>'
+
+
+class WebSocketMetricsMiddleware:
+    """
+    ASGI middleware recording websocket connects and incoming frames in ``metrics``.
+
+    An event lasts from the consumer receiving it to the consumer asking for
+    the next one, and is recorded under the route of ``urlpatterns`` the
+    connection matched. A connect counts as 1xx when it is accepted and 4xx
+    when it is closed instead, like the handshake response.
+    """
+
+    def __init__(self, inner, urlpatterns):
+        self.inner = inner
+        self.urlpatterns = urlpatterns
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket' or not settings.METRICS_ENABLED:
+            return await self.inner(scope, receive, send)
+        route = websocket_route(scope['path'], self.urlpatterns)
+        # Handed to the consumer through the context; restarted in place as events come in.
+        measurement = Measurement(sample_sql=settings.METRICS_SLOW_REQUESTS > 0)
+        current_measurement.set(measurement)
+        event = {'type': None, 'status': 100}
+
+        def finish():
+            if event['type'] is not None:
+                metrics.record(route, event['type'], event['status'], measurement, description=scope['path'])
+                event['type'] = None
+
+        async def measured_receive():
+            finish()
+            message = await receive()
+            if message['type'] in ['websocket.connect', 'websocket.receive']:
+                measurement.restart()
+                event['type'], event['status'] = message['type'], 100
+            return message
+
+        async def measured_send(message):
+            if message['type'] == 'websocket.send':
+                measurement.bytes += len(message.get('bytes') or b'') + len((message.get('text') or '').encode())
+            elif message['type'] == 'websocket.close' and event['type'] == 'websocket.connect':
+                event['status'] = 403
+            await send(message)
+
+        try:
+            return await self.inner(scope, measured_receive, measured_send)
+        finally:
+            finish()
@@ -0,0 +1,138 @@
+import asyncio
+import hmac
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from auth_service.authenticate import REFRESH_JTI_CLAIM
+from auth_service.blacklist import blacklist_index
+from common.metrics import sync_to_async
+from user_accounts.models import Account
+
+
+class TokenUserCache:
+    """
+    Bounded LRU of resolved users keyed by token ``jti``.
+
+    Entries expire after ``ttl`` seconds or when the token itself expires,
+    whichever is sooner. The raw token is stored alongside the user so a
+    lookup only hits when the exact same, already verified, token comes back.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, jti, raw_token):
+        entry = self._entries.get(jti)
+        if entry is None:
+            return False, None
+        token, user, expires_at = entry
+        if expires_at <= time.monotonic() or not hmac.compare_digest(token, raw_token):
+            return False, None
+        self._entries.move_to_end(jti)
+        return True, user
+
+    def set(self, jti, raw_token, user, token_exp):
+        if self.maxsize <= 0:
+            return
+        lifetime = min(self.ttl, token_exp - time.time())
+        if lifetime <= 0:
+            return
+        self._entries[jti] = (raw_token, user, time.monotonic() + lifetime)
+        self._entries.move_to_end(jti)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+def get_raw_token(scope):
+    """
+    Token from ``?token=`` (browsers cannot set headers on a WebSocket) or an ``Authorization: Token`` header.
+    """
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    if token:
+        return token[0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode().split()
+            if len(parts) == 2 and parts[0] in api_settings.AUTH_HEADER_TYPES:
+                return parts[1]
+    return None
+
+
+def load_user(token):
+    # Logout blacklists the refresh token, so an access token is checked by the one it came from.
+    refresh_jti = token.get(REFRESH_JTI_CLAIM)
+    if refresh_jti is not None and refresh_jti in blacklist_index:
+        return None
+    return Account.objects.filter(
+        **{api_settings.USER_ID_FIELD: token[api_settings.USER_ID_CLAIM]}, is_active=True).first()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Populate ``scope['user']`` from a simplejwt access token.
+
+    The signature check is pure CPU and runs inline; the blacklist check and
+    account lookup run in a worker thread and their result is cached per token,
+    so a reconnect storm costs one lookup per token rather than one per socket.
+    Concurrent connects presenting the same uncached token share one lookup.
+
+    Logout blacklists a refresh token, so an access token is rejected once the
+    refresh token named by its ``rjti`` claim is in ``blacklist_index``. Access
+    tokens issued without that claim cannot be tied to a logout and stay usable
+    until they expire. A token whose refresh token is blacklisted after it was
+    cached stays usable for at most ``WEBSOCKET_AUTH_CACHE_TTL`` seconds.
+
+    Without a valid token the scope is left alone, so it must sit inside
+    ``AuthMiddlewareStack`` for session users to keep working.
+    """
+
+    def __init__(self, inner):
+        super().__init__(inner)
+        self.users = TokenUserCache(settings.WEBSOCKET_AUTH_CACHE_SIZE, settings.WEBSOCKET_AUTH_CACHE_TTL)
+        self._pending = {}
+
+    async def __call__(self, scope, receive, send):
+        raw_token = get_raw_token(scope)
+        if raw_token:
+            user = await self.resolve(raw_token)
+            if user is not None:
+                scope = dict(scope, user=user)
+        return await super().__call__(scope, receive, send)
+
+    async def resolve(self, raw_token):
+        try:
+            token = AccessToken(raw_token)
+        except TokenError:
+            return None
+        jti = token[api_settings.JTI_CLAIM]
+        hit, user = self.users.get(jti, raw_token)
+        if hit:
+            return user
+
+        pending = self._pending.get(jti)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        pending = asyncio.ensure_future(sync_to_async(load_user, adapter=database_sync_to_async)(token))
+        self._pending[jti] = pending
+        try:
+            user = await asyncio.shield(pending)
+        finally:
+            self._pending.pop(jti, None)
+        self.users.set(jti, raw_token, user, token['exp'])
+        return user
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:38
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Category = apps.get_model('common', 'Category')
+    children = {}
+    for pk, parent_id in Category.objects.values_list('pk', 'parent_category_id'):
+        children.setdefault(parent_id, []).append(pk)
+
+    updates = []
+    level = [(pk, f'{pk}/') for pk in children.get(None, [])]
+    depth = 0
+    while level:
+        updates.extend(Category(pk=pk, path=path, depth=depth) for pk, path in level)
+        level = [(child, f'{path}{child}/') for pk, path in level for child in children.get(pk, [])]
+        depth += 1
+    Category.objects.bulk_update(updates, ['path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=1024),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='common_category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
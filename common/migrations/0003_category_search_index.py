@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from common.search import create_category_search_index, drop_category_search_index
+
+
+def create_index(apps, schema_editor):
+    create_category_search_index(schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    drop_category_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_category_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
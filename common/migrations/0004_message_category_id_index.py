@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0003_category_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['category', 'id'], name='common_message_category_id_idx'),
+        ),
+    ]
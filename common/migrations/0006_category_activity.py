@@ -0,0 +1,52 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:46
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from common.search import create_category_search_index
+
+
+def reinstall_search_index(apps, schema_editor):
+    # Adding the columns rebuilt common_category on SQLite, which drops its full-text triggers.
+    create_category_search_index(schema_editor)
+
+
+def backfill_activity(apps, schema_editor):
+    Category = apps.get_model('common', 'Category')
+    Message = apps.get_model('common', 'Message')
+    counts = (Message.objects.filter(category=OuterRef('pk')).order_by().values('category')
+              .annotate(total=Count('id')).values('total'))
+    latest = Message.objects.filter(category=OuterRef('pk')).order_by('-timestamp', '-id')
+    Category.objects.update(
+        message_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0),
+        last_message_id=Subquery(latest.values('id')[:1]),
+        last_message_at=Subquery(latest.values('timestamp')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0005_message_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0006_category_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelLayerMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(max_length=100)),
+                ('process', models.CharField(blank=True, default='', max_length=32)),
+                ('payload', models.BinaryField()),
+                ('expires', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['process', 'id'], name='common_chlmsg_process_idx'), models.Index(fields=['channel', 'id'], name='common_chlmsg_channel_idx'), models.Index(fields=['expires'], name='common_chlmsg_expires_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ChannelLayerGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=100)),
+                ('channel', models.CharField(max_length=100)),
+                ('process', models.CharField(blank=True, default='', max_length=32)),
+                ('expires', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires'], name='common_chlgroup_expires_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='channellayergroup',
+            constraint=models.UniqueConstraint(fields=('group', 'channel'), name='common_chlgroup_unique'),
+        ),
+    ]
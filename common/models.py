@@ -1,8 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
 
 from user_accounts.models import Account
 
 
+# Columns of Category maintained by common.activity rather than by save().
+ACTIVITY_FIELDS = {'message_count', 'last_message_id', 'last_message_at'}
+
+
 # Create your models here.
 class Category(models.Model):
     category_name = models.CharField(max_length=100)
@@ -15,10 +22,105 @@ class Category(models.Model):
     is_active = models.BooleanField(default=True)
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    # Materialized path of primary keys from the root, e.g. "1/7/42/", kept in sync by save(). Rows written
+    # without save(), such as by bulk_create, have none until Category.rebuild_paths() is called.
+    path = models.CharField(max_length=1024, blank=True, default='', editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    # Message activity, maintained by common.activity and recomputed by reconcile_category_activity.
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    last_message_id = models.BigIntegerField(blank=True, null=True, editable=False)
+    last_message_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['path'], name='common_category_path_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.category_name
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # The activity counters are only ever written with F() updates; writing back the loaded values
+            # would undo the messages counted since this category was loaded.
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in ACTIVITY_FIELDS]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if update_fields is None or 'parent_category' in update_fields:
+                self.sync_path()
+
+    def sync_path(self):
+        """
+        Recompute this category's path from its parent and move its subtree along with it.
+        """
+        rows = Category.objects.filter(pk__in=[self.pk, self.parent_category_id]).values_list('pk', 'path', 'depth')
+        rows = {pk: (path, depth) for pk, path, depth in rows}
+        old_path, old_depth = rows[self.pk]
+        if self.parent_category_id is not None:
+            parent_path, parent_depth = rows[self.parent_category_id]
+            path, depth = f'{parent_path}{self.pk}/', parent_depth + 1
+        else:
+            path, depth = f'{self.pk}/', 0
+
+        if path != old_path:
+            if old_path:
+                Category.objects.filter(path__startswith=old_path).update(
+                    path=Concat(Value(path), Substr('path', len(old_path) + 1), output_field=models.CharField()),
+                    depth=F('depth') + (depth - old_depth),
+                )
+            else:
+                Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        self.path, self.depth = path, depth
+
+    @classmethod
+    def rebuild_paths(cls):
+        """
+        Recompute every category's path and depth from the parent links; returns how many were wrong.
+
+        For bulk loaders: bulk_create skips save() and leaves the new rows without a path.
+        """
+        rows = {pk: (parent_id, path, depth)
+                for pk, parent_id, path, depth in cls.objects.values_list('pk', 'parent_category_id', 'path', 'depth')}
+        paths = {}
+        for pk in rows:
+            chain, ancestor = [], pk
+            while ancestor is not None and ancestor not in paths:
+                chain.append(ancestor)
+                ancestor = rows[ancestor][0]
+            prefix = paths[ancestor] if ancestor is not None else ''
+            for node in reversed(chain):
+                prefix = paths[node] = f'{prefix}{node}/'
+        wrong = [cls(pk=pk, path=path, depth=path.count('/') - 1) for pk, path in paths.items()
+                 if (path, path.count('/') - 1) != rows[pk][1:]]
+        cls.objects.bulk_update(wrong, ['path', 'depth'], batch_size=1000)
+        return len(wrong)
+
+    def ancestor_ids(self):
+        return [int(pk) for pk in self.path.split('/')[:-2]]
+
+    def ancestors(self, include_self=False):
+        """
+        Categories from the root down to this one's parent, in one primary key lookup.
+        """
+        ids = self.ancestor_ids()
+        if include_self:
+            ids.append(self.pk)
+        return Category.objects.filter(pk__in=ids).order_by('depth')
+
+    def descendants(self, include_self=False):
+        """
+        Every category below this one, as a single prefix scan on the path index.
+        """
+        queryset = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            queryset = queryset.exclude(pk=self.pk)
+        return queryset
+
+    def is_descendant_of(self, category):
+        return self.pk != category.pk and self.path.startswith(category.path)
+
 
 class Chat(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
@@ -28,10 +130,48 @@ class Message(models.Model):
     sender = models.ForeignKey(Account, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='messages')
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
 
     class Meta:
+        # Still the default ordering; KeysetPagination overrides it with its own order_by on the primary key.
         ordering = ['-timestamp']
+        indexes = [
+            # Keyset pages of a category's messages are range scans on this index.
+            models.Index(fields=['category', 'id'], name='common_message_category_id_idx'),
+        ]
 
     def __str__(self):
-        return f"From: {self.sender.first_name}, To: {self.category}, Content: {self.content[:50]}..."
\ No newline at end of file
+        return f"From: {self.sender.first_name}, To: {self.category}, Content: {self.content[:50]}..."
+
+
+class ChannelLayerMessage(models.Model):
+    """
+    A message waiting on a channel of the database channel layer (see common.channel_layers).
+    """
+    channel = models.CharField(max_length=100)
+    # Instance prefix of the process owning a process-specific channel, empty for normal channels.
+    process = models.CharField(max_length=32, blank=True, default='')
+    payload = models.BinaryField()
+    expires = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['process', 'id'], name='common_chlmsg_process_idx'),
+            models.Index(fields=['channel', 'id'], name='common_chlmsg_channel_idx'),
+            models.Index(fields=['expires'], name='common_chlmsg_expires_idx'),
+        ]
+
+
+class ChannelLayerGroup(models.Model):
+    group = models.CharField(max_length=100)
+    channel = models.CharField(max_length=100)
+    process = models.CharField(max_length=32, blank=True, default='')
+    expires = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'channel'], name='common_chlgroup_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['expires'], name='common_chlgroup_expires_idx'),
+        ]
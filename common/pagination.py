@@ -0,0 +1,121 @@
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the primary key, newest first.
+
+    ``before=<id>`` returns the page of rows older than that id and
+    ``after=<id>`` the page of rows newer than it, so every page is a single
+    index range scan instead of an OFFSET over a sorted result.
+    """
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    before_query_param = 'before'
+    after_query_param = 'after'
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        try:
+            page_size = int(value)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: 'A valid integer is required.'})
+        if page_size < 1:
+            raise ValidationError({self.page_size_query_param: 'Must be at least 1.'})
+        return min(page_size, self.max_page_size)
+
+    def get_cursor(self, request, name):
+        value = request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: 'A valid integer is required.'})
+
+    @staticmethod
+    def get_key(row):
+        # Model instances, values() dicts, or values_list() tuples that start with the primary key.
+        if isinstance(row, dict):
+            return row['id']
+        return row[0] if isinstance(row, tuple) else row.pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        ``paginate_queryset`` for async views, fetching the page through the async ORM.
+        """
+        return self.set_page([row async for row in self.get_page_queryset(queryset, request)])
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.limit = self.get_page_size(request)
+        before = self.get_cursor(request, self.before_query_param)
+        self.after = self.get_cursor(request, self.after_query_param)
+        if before is not None and self.after is not None:
+            raise ValidationError({'error': 'Use either before or after, not both.'})
+
+        if self.after is not None:
+            return queryset.filter(pk__gt=self.after).order_by('pk')[:self.limit]
+        if before is not None:
+            queryset = queryset.filter(pk__lt=before)
+        # One row past the page tells whether there are older rows.
+        return queryset.order_by('-pk')[:self.limit + 1]
+
+    def set_page(self, rows):
+        if self.after is not None:
+            rows.reverse()
+            self.has_older = bool(rows)
+        else:
+            self.has_older = len(rows) > self.limit
+            rows = rows[:self.limit]
+        self.rows = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_older:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.after_query_param)
+        return replace_query_param(url, self.before_query_param, self.get_key(self.rows[-1]))
+
+    def get_previous_link(self):
+        # Always offered so clients can poll for rows newer than the ones they hold.
+        newest = self.get_key(self.rows[0]) if self.rows else self.after
+        if newest is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.before_query_param)
+        return replace_query_param(url, self.after_query_param, newest)
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class MessagePagination(KeysetPagination):
+    page_size = settings.MESSAGE_PAGE_SIZE
+    max_page_size = settings.MESSAGE_MAX_PAGE_SIZE
@@ -0,0 +1,50 @@
+import codecs
+import csv
+
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline-delimited JSON.
+
+    Lines are handed over lazily as ``(line_number, text)`` pairs and decoded one
+    at a time. A line that is not valid in the request charset is handed over as
+    its raw bytes, so it can be reported on its own instead of failing the request.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        return (
+            (line_number, decode_line(line, encoding))
+            for line_number, line in enumerate(stream or [], start=1)
+            if line.strip()
+        )
+
+
+class CSVParser(BaseParser):
+    """
+    CSV with a header row.
+
+    Records are handed over lazily as ``(line_number, row)`` pairs, the row a dict keyed by the header.
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        return read_csv_records(codecs.iterdecode(stream or [], encoding))
+
+
+def decode_line(line, encoding):
+    try:
+        return line.decode(encoding)
+    except UnicodeDecodeError:
+        return line
+
+
+def read_csv_records(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        if any(value and value.strip() for value in row.values() if isinstance(value, str)):
+            yield reader.line_num, row
@@ -0,0 +1,171 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+from common.metrics import sync_to_async
+
+# Routing state of the request being handled, shared with the threads it hands work to.
+current_routing = ContextVar('replica_routing', default=None)
+
+
+def account_key(account_id):
+    return f'common:replica_pin:user:{account_id}'
+
+
+def client_key(request):
+    """
+    Cache key standing for whoever made ``request``: their account, or their address when anonymous.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return account_key(user.pk)
+    return f'common:replica_pin:address:{request.META.get("REMOTE_ADDR", "")}'
+
+
+def pin_to_primary(request):
+    caches[settings.DATABASE_REPLICA_CACHE_ALIAS].set(client_key(request), True,
+                                                      timeout=settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+async def apin_account_to_primary(account_id):
+    """
+    ``pin_to_primary`` for writes made outside a request, such as chat messages sent over a WebSocket.
+
+    Such messages are written by the chat buffer shortly after, so the pin
+    counts from when the message was handed over rather than written.
+    """
+    if settings.DATABASE_REPLICAS:
+        await caches[settings.DATABASE_REPLICA_CACHE_ALIAS].aset(account_key(account_id), True,
+                                                                 timeout=settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+def is_pinned_to_primary(request):
+    return caches[settings.DATABASE_REPLICA_CACHE_ALIAS].get(client_key(request), False)
+
+
+def get_replica_actions(view):
+    view = getattr(view, 'stands_in_for', view)
+    viewset, actions = getattr(view, 'cls', None), getattr(view, 'actions', None)
+    if viewset is None or actions is None:
+        return None, ()
+    return actions, getattr(viewset, 'replica_actions', ())
+
+
+class Routing:
+    """
+    Where one request reads from, decided at its first read.
+
+    Only safe requests to the viewset actions listed in ``replica_actions``
+    read from a replica, one picked at random for the whole request, and not
+    within ``settings.DATABASE_REPLICA_STICKY_SECONDS`` of the same client
+    writing. By the first read the view has authenticated the user, so that
+    client is their account rather than their address.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.decided = False
+        self.replica = None
+        self.wrote = False
+
+    def db_for_read(self):
+        if not self.decided:
+            if self.request.resolver_match is None:
+                return None
+            # Decided first, so the reads made while deciding, such as loading a session user, use the primary.
+            self.decided = True
+            self.replica = self.choose_replica()
+        return self.replica
+
+    def choose_replica(self):
+        if self.request.method not in SAFE_METHODS:
+            return None
+        actions, replica_actions = get_replica_actions(self.request.resolver_match.func)
+        if actions is None or actions.get(self.request.method.lower()) not in replica_actions:
+            return None
+        if is_pinned_to_primary(self.request):
+            return None
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self):
+        # Later reads of the same request must see the write.
+        self.decided, self.replica, self.wrote = True, None, True
+
+
+class ReplicaRouter:
+    """
+    Send the reads of requests routed by ``ReplicaMiddleware`` to a replica, and everything else to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+        return routing.db_for_read() if routing is not None else None
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.db_for_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Route the reads of requests to ``settings.DATABASE_REPLICAS`` (see ``Routing``), and note who wrote.
+
+    A client is pinned to the primary after an unsafe request of theirs
+    writes; chat messages pin their sender too (``apin_account_to_primary``).
+    Anonymous clients are told apart by address only, so behind a
+    proxy one anonymous write pins them all: a few more primary reads, never
+    a stale one. Removed when there are no replicas.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        routing = Routing(request)
+        token = current_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        if self.wrote(request, routing):
+            pin_to_primary(request)
+        return response
+
+    async def __acall__(self, request):
+        routing = Routing(request)
+        token = current_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        if self.wrote(request, routing):
+            # In a thread: an anonymous request's user may still be a session lookup.
+            await sync_to_async(pin_to_primary)(request)
+        return response
+
+    def wrote(self, request, routing):
+        return routing.wrote and request.method not in SAFE_METHODS
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from common.consumers import ChatConsumer
+
+websocket_urlpatterns = [
+    path('ws/chat/<int:category_id>/', ChatConsumer.as_asgi()),
+]
@@ -0,0 +1,140 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+TERM_RE = re.compile(r'\w+')
+MAX_TERMS = 8
+
+# The PostgreSQL GIN index is built on this exact expression, so queries must repeat it verbatim.
+PG_CATEGORY_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(category_name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(answer, '')), 'B')"
+)
+
+SQLITE_CREATE_CATEGORY_INDEX = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS common_category_fts USING fts5(
+        category_name, answer,
+        content='common_category', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS common_category_fts_insert AFTER INSERT ON common_category BEGIN
+        INSERT INTO common_category_fts(rowid, category_name, answer) VALUES (new.id, new.category_name, new.answer);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS common_category_fts_delete AFTER DELETE ON common_category BEGIN
+        INSERT INTO common_category_fts(common_category_fts, rowid, category_name, answer)
+        VALUES ('delete', old.id, old.category_name, old.answer);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS common_category_fts_update AFTER UPDATE OF category_name, answer ON common_category BEGIN
+        INSERT INTO common_category_fts(common_category_fts, rowid, category_name, answer)
+        VALUES ('delete', old.id, old.category_name, old.answer);
+        INSERT INTO common_category_fts(rowid, category_name, answer) VALUES (new.id, new.category_name, new.answer);
+    END
+    """,
+    "INSERT INTO common_category_fts(common_category_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_CATEGORY_INDEX = [
+    "DROP TRIGGER IF EXISTS common_category_fts_insert",
+    "DROP TRIGGER IF EXISTS common_category_fts_delete",
+    "DROP TRIGGER IF EXISTS common_category_fts_update",
+    "DROP TABLE IF EXISTS common_category_fts",
+]
+
+PG_CREATE_CATEGORY_INDEX = [
+    f"CREATE INDEX IF NOT EXISTS common_category_search_idx ON common_category USING GIN (({PG_CATEGORY_VECTOR}))",
+]
+
+PG_DROP_CATEGORY_INDEX = [
+    "DROP INDEX IF EXISTS common_category_search_idx",
+]
+
+
+def create_category_search_index(schema_editor):
+    """
+    Create the full-text index for Category on backends that have one.
+
+    SQLite drops triggers whenever Django rebuilds a table, so migrations that
+    alter common_category must call this again afterwards; it is idempotent.
+    """
+    statements = {
+        'sqlite': SQLITE_CREATE_CATEGORY_INDEX,
+        'postgresql': PG_CREATE_CATEGORY_INDEX,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_category_search_index(schema_editor):
+    statements = {
+        'sqlite': SQLITE_DROP_CATEGORY_INDEX,
+        'postgresql': PG_DROP_CATEGORY_INDEX,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def search_terms(query):
+    return TERM_RE.findall(query.lower())[:MAX_TERMS]
+
+
+def fts5_prefix_query(terms):
+    """
+    FTS5 MATCH expression requiring every term, the last one as a prefix for type-ahead.
+    """
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def tsquery_prefix_query(terms):
+    return ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+
+
+def search_category_ids(query, limit, offset=0):
+    """
+    Ids of active categories matching ``query``, best match first.
+
+    Returns at most ``limit`` ids; callers wanting to know whether there is a
+    next page should ask for one more than they show.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    if connection.vendor == 'sqlite':
+        sql = """
+            SELECT c.id FROM common_category_fts
+            JOIN common_category c ON c.id = common_category_fts.rowid
+            WHERE common_category_fts MATCH %s AND c.is_active
+            ORDER BY bm25(common_category_fts, 2.0, 1.0), c.id
+            LIMIT %s OFFSET %s
+        """
+        params = [fts5_prefix_query(terms), limit, offset]
+    elif connection.vendor == 'postgresql':
+        sql = f"""
+            SELECT id FROM common_category
+            WHERE is_active AND ({PG_CATEGORY_VECTOR}) @@ to_tsquery('english', %s)
+            ORDER BY ts_rank({PG_CATEGORY_VECTOR}, to_tsquery('english', %s)) DESC, id
+            LIMIT %s OFFSET %s
+        """
+        tsquery = tsquery_prefix_query(terms)
+        params = [tsquery, tsquery, limit, offset]
+    else:
+        from common.models import Category
+
+        queryset = Category.objects.filter(is_active=True)
+        for term in terms:
+            queryset = queryset.filter(Q(category_name__icontains=term) | Q(answer__icontains=term))
+        return list(queryset.order_by('id').values_list('id', flat=True)[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
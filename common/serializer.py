@@ -1,5 +1,6 @@
 from rest_framework import serializers
 
+from common.compiled import compile_read_serializer
 from common.models import Category, Message
 
 
@@ -9,22 +10,72 @@ class CategoryReadSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Category
-        fields = ['id', 'category_name', 'answer', 'contact_person', 'is_active', 'created_on', 'updated_on', 'subcategories', 'has_subcategories']
-        read_only_fields = ['id', 'created_on', 'updated_on']
+        fields = ['id', 'category_name', 'answer', 'contact_person', 'is_active', 'created_on', 'updated_on', 'subcategories', 'has_subcategories',
+                  'message_count', 'last_message_id', 'last_message_at']
+        read_only_fields = ['id', 'created_on', 'updated_on', 'message_count', 'last_message_id', 'last_message_at']
 
     def get_subcategories(self, obj):
-        subcategories = obj.subcategories.all()
-        return CategoryReadSerializer(subcategories, many=True).data
+        tree = self.context.get('category_tree')
+        if tree is not None:
+            subcategories = tree.subcategories(obj)
+        else:
+            subcategories = obj.subcategories.all()
+        return CategoryReadSerializer(subcategories, many=True, context=self.context).data
 
     def get_has_subcategories(self, obj):
+        tree = self.context.get('category_tree')
+        if tree is not None:
+            return tree.has_subcategories(obj)
         return obj.subcategories.exists()
 
+
+def category_tree_data(tree, categories):
+    """
+    CategoryReadSerializer's output for ``categories``, all of which must be in ``tree``.
+
+    Each category of the tree is converted once by the compiled serializer and
+    its subcategories are linked by reference, where the serializer would
+    serialize a category again at every level above it.
+    """
+    rows = compile_read_serializer(CategoryReadSerializer, deferred=('subcategories', 'has_subcategories'))
+    to_dict = rows.converter()
+    data = {category.id: to_dict(rows.from_instance(category)) for category in tree.categories}
+    for category in tree.categories:
+        item = data[category.id]
+        item['subcategories'] = [data[subcategory.id] for subcategory in tree.subcategories(category)]
+        item['has_subcategories'] = tree.has_subcategories(category)
+    return [data[category.id] for category in categories]
+
+
 class CategoryWriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'category_name', 'answer', 'contact_person', 'parent_category']
         read_only_fields = ['id', ]
 
+    def validate_parent_category(self, value):
+        """
+        Reject moves that would put a category under itself or one of its subcategories.
+        """
+        if value is not None and self.instance is not None:
+            if value.pk == self.instance.pk or value.is_descendant_of(self.instance):
+                raise serializers.ValidationError("A category cannot be moved under itself or its subcategories")
+        return value
+
+
+class CategorySearchSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'category_name', 'answer', 'contact_person', 'parent_category']
+        read_only_fields = fields
+
+
+class CategoryBreadcrumbSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'category_name', 'depth']
+        read_only_fields = fields
+
 
 # serializers.py
 class MessageSerializer(serializers.ModelSerializer):
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from common import activity
+from common.live import publish_messages_stored
+from common.cache import bump_tree_version
+from common.models import Category, Message
+from user_accounts.models import Account
+
+
+def invalidate_category_tree():
+    # Bump after commit so a concurrent reader cannot cache the pre-commit tree under the new version.
+    transaction.on_commit(bump_tree_version)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    invalidate_category_tree()
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        activity.message_created(instance)
+        transaction.on_commit(lambda: publish_messages_stored([instance.category_id]))
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, origin=None, **kwargs):
+    # Deleting a category takes its messages with it; there is no counter left to update.
+    # An account's messages are recounted per category once the account is gone, see account_deleted.
+    if not isinstance(origin, (Category, Account)):
+        activity.message_deleted(instance)
+
+
+@receiver(pre_delete, sender=Account)
+def account_deleting(sender, instance, **kwargs):
+    instance.message_category_ids = list(
+        Message.objects.filter(sender=instance).order_by().values_list('category_id', flat=True).distinct())
+
+
+@receiver(post_delete, sender=Account)
+def account_deleted(sender, instance, **kwargs):
+    if getattr(instance, 'message_category_ids', None):
+        activity.reconcile(instance.message_category_ids)
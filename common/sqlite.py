@@ -0,0 +1,105 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.backends.signals import connection_created
+
+SQLITE_MODES = ['default', 'tuned']
+
+
+def is_tuned(connection):
+    if settings.SQLITE_MODE not in SQLITE_MODES:
+        raise ImproperlyConfigured(f'SQLITE_MODE must be one of {", ".join(SQLITE_MODES)}')
+    return connection.vendor == 'sqlite' and settings.SQLITE_MODE == 'tuned'
+
+
+def tuning_pragmas():
+    return [
+        # Readers keep reading the last commit while a write is in progress, instead of waiting for it.
+        'PRAGMA journal_mode = WAL',
+        # In WAL mode a power loss can lose the last commits but not corrupt the database.
+        'PRAGMA synchronous = NORMAL',
+        f'PRAGMA busy_timeout = {settings.SQLITE_BUSY_TIMEOUT_MS}',
+        f'PRAGMA mmap_size = {settings.SQLITE_MMAP_SIZE}',
+        # Negative, so the size is in KiB rather than pages.
+        f'PRAGMA cache_size = -{settings.SQLITE_CACHE_SIZE_KB}',
+    ]
+
+
+def tune_connection(sender, connection, **kwargs):
+    if is_tuned(connection):
+        # On the driver's connection, so the pragmas are not counted as the current request's queries.
+        for pragma in tuning_pragmas():
+            connection.connection.execute(pragma)
+
+
+connection_created.connect(tune_connection)
+
+
+class WriterQueue:
+    """
+    One thread making the writes handed to it, in order, on its own connection.
+
+    SQLite has one writer at a time. Writes queued here wait for their turn in
+    the queue rather than for the database lock, so they never fail with
+    "database is locked", while readers keep their own connections.
+    """
+
+    def __init__(self):
+        self._jobs = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._jobs.put((future, func, args, kwargs))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+        return future
+
+    def is_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+    def _run(self):
+        while True:
+            future, func, args, kwargs = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            close_old_connections()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+
+writer = WriterQueue()
+
+
+def write(func, *args, **kwargs):
+    """
+    Call ``func``, through ``writer`` when the default database is SQLite in the tuned mode.
+
+    Inside a transaction, or on the writer itself, ``func`` runs in place: a
+    queued write could not join the caller's transaction, and would wait for
+    the lock the caller holds.
+    """
+    connection = connections[DEFAULT_DB_ALIAS]
+    if not is_tuned(connection) or connection.in_atomic_block or writer.is_writer_thread():
+        return func(*args, **kwargs)
+    return writer.submit(func, *args, **kwargs).result()
+
+
+async def awrite(func, *args, **kwargs):
+    """
+    ``write`` for async code; outside the tuned mode ``func`` runs through ``database_sync_to_async``.
+    """
+    if not is_tuned(connections[DEFAULT_DB_ALIAS]):
+        return await database_sync_to_async(func)(*args, **kwargs)
+    return await asyncio.wrap_future(writer.submit(func, *args, **kwargs))
@@ -1,3 +1,1490 @@
-from django.test import TestCase
+import asyncio
+import copy
+import csv
+import gzip
+import io
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.asgi import get_asgi_application
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.conf import settings
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models.signals import pre_delete
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from auth_service.authenticate import ClaimsRefreshToken
+from auth_service.blacklist import BlacklistIndex
+from common import renderers, sqlite
+from common.budgets import QueryBudgetExceeded, check_query_budget, fingerprint, repeated_statements, routed_actions
+from common.buffer import MessageBuffer, message_buffer
+from common.cache import get_tree_version
+from common.channel_layers import DatabaseChannelLayer
+from common.compiled import RowSerializer, compile_read_serializer
+from common.constants import UserRole
+from common.ingest import MessageImporter
+from common.loadtest import (DEFAULT_TRACE, Dataset, build_requests, compare_to_baseline, load_trace, replay,
+                             seed_dataset, summarize_results)
+from common.metrics import WebSocketMetricsMiddleware, metrics
+from common.middleware import JWTAuthMiddleware, TokenUserCache
+from common.models import Category, ChannelLayerMessage, Message
+from common.replicas import ReplicaRouter, Routing
+from common.renderers import FastJSONRenderer
+from common.routing import websocket_urlpatterns
+from common.serializer import CategoryReadSerializer, MessageSerializer, category_tree_data
+from common.tree import CategoryTree
+from common.urls import viewset_views
+from common.views import CategoryViewSet, MessageListViewSet
+from user_accounts.models import Account, AccountImport
+from user_accounts.views import AccountViewSet
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        caches[settings.CATEGORY_CACHE_ALIAS].clear()
+
+    def build_tree(self, depth, fan_out, parent=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._build_tree(depth, fan_out, parent)
+
+    def _build_tree(self, depth, fan_out, parent=None):
+        if depth == 0:
+            return
+        for index in range(fan_out):
+            category = Category.objects.create(category_name=f'{depth}-{index}', parent_category=parent)
+            self._build_tree(depth - 1, fan_out, category)
+
+    def test_list_keeps_nested_shape(self):
+        root = Category.objects.create(category_name='Fees')
+        child = Category.objects.create(category_name='Refunds', parent_category=root)
+        Category.objects.create(category_name='Late refunds', parent_category=child)
+
+        response = self.client.get('/common/categories/')
+
+        self.assertEqual(response.status_code, 200)
+        by_id = {item['id']: item for item in response.json()}
+        self.assertEqual(len(by_id), 3)
+        self.assertTrue(by_id[root.id]['has_subcategories'])
+        self.assertEqual(by_id[root.id]['subcategories'][0]['id'], child.id)
+        self.assertEqual(by_id[root.id]['subcategories'][0]['subcategories'][0]['category_name'], 'Late refunds')
+        self.assertFalse(by_id[root.id]['subcategories'][0]['subcategories'][0]['has_subcategories'])
+
+    def test_list_query_count_is_constant(self):
+        self.build_tree(depth=2, fan_out=2)
+        with self.assertNumQueries(1):
+            self.client.get('/common/categories/')
+
+        self.build_tree(depth=4, fan_out=4)
+        with self.assertNumQueries(1):
+            self.client.get('/common/categories/')
+
+    def test_parents_and_sub_categories(self):
+        root = Category.objects.create(category_name='Transport')
+        leaf = Category.objects.create(category_name='Bus routes', parent_category=root)
+
+        with self.assertNumQueries(1):
+            parents = self.client.get('/common/categories/parents/')
+        with self.assertNumQueries(1):
+            leaves = self.client.get('/common/categories/sub_categories/')
+
+        self.assertEqual([item['id'] for item in parents.json()], [root.id])
+        self.assertEqual([item['id'] for item in leaves.json()], [leaf.id])
+
+
+class CategoryCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        caches[settings.CATEGORY_CACHE_ALIAS].clear()
+        self.staff = Account.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='secret', role=UserRole.STAFF.value)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(category_name='Admissions', contact_person=self.staff)
+
+    def test_cached_response_and_not_modified(self):
+        first = self.client.get('/common/categories/')
+        etag = first['ETag']
+
+        with self.assertNumQueries(0):
+            second = self.client.get('/common/categories/')
+            not_modified = self.client.get('/common/categories/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+
+    def test_category_change_invalidates(self):
+        etag = self.client.get('/common/categories/parents/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(category_name='Forms', parent_category=self.category)
+
+        response = self.client.get('/common/categories/parents/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([item['id'] for item in response.json()], [self.category.id])
+
+    def test_account_saves_leave_the_tree_alone(self):
+        # The tree only holds contact_person's id, which an account save cannot change.
+        version = get_tree_version()
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            self.staff.first_name = 'Asha'
+            self.staff.save()
+
+        self.assertEqual(get_tree_version(), version)
+
+
+class CategoryPathTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        caches[settings.CATEGORY_CACHE_ALIAS].clear()
+        self.root = Category.objects.create(category_name='School')
+        self.child = Category.objects.create(category_name='Fees', parent_category=self.root)
+        self.grandchild = Category.objects.create(category_name='Refunds', parent_category=self.child)
+        self.other = Category.objects.create(category_name='Transport')
+
+    def test_paths_and_depth(self):
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.path, f'{self.root.pk}/{self.child.pk}/{self.grandchild.pk}/')
+        self.assertEqual(self.grandchild.depth, 2)
+
+    def test_descendants_and_ancestors_are_single_queries(self):
+        with self.assertNumQueries(1):
+            descendants = list(self.root.descendants())
+        with self.assertNumQueries(1):
+            ancestors = list(self.grandchild.ancestors())
+
+        self.assertEqual({category.pk for category in descendants}, {self.child.pk, self.grandchild.pk})
+        self.assertEqual([category.pk for category in ancestors], [self.root.pk, self.child.pk])
+
+    def test_rebuild_paths_after_bulk_create(self):
+        loaded = Category.objects.bulk_create([Category(category_name='Bus passes', parent_category=self.grandchild)])
+
+        self.assertEqual(Category.rebuild_paths(), 1)
+        self.assertIn(loaded[0].pk, {category.pk for category in self.root.descendants()})
+        loaded[0].refresh_from_db()
+        self.assertEqual(loaded[0].path, f'{self.grandchild.path}{loaded[0].pk}/')
+        self.assertEqual(loaded[0].depth, 3)
+        self.assertEqual(Category.rebuild_paths(), 0)
+
+    def test_move_subtree(self):
+        self.child.parent_category = self.other
+        self.child.save()
+
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.path, f'{self.other.pk}/{self.child.pk}/{self.grandchild.pk}/')
+        self.assertEqual(self.grandchild.depth, 2)
+        self.assertEqual(list(self.root.descendants()), [])
+
+        self.child.parent_category = None
+        self.child.save()
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.depth, 1)
+
+    def test_move_under_own_subcategory_is_rejected(self):
+        response = self.client.patch(
+            f'/common/categories/{self.root.pk}/', {'parent_category': self.grandchild.pk}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent_category', response.data)
+
+    def test_subtree_and_breadcrumb_endpoints(self):
+        subtree = self.client.get(f'/common/categories/{self.child.pk}/subtree/').json()
+        breadcrumb = self.client.get(f'/common/categories/{self.grandchild.pk}/breadcrumb/').json()
+
+        self.assertEqual(subtree['id'], self.child.pk)
+        self.assertEqual([item['id'] for item in subtree['subcategories']], [self.grandchild.pk])
+        self.assertEqual([item['id'] for item in breadcrumb], [self.root.pk, self.child.pk, self.grandchild.pk])
+        self.assertEqual(self.client.get('/common/categories/0/subtree/').status_code, 404)
+
+
+class CategorySearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.fees = Category.objects.create(category_name='Fee refunds', answer='Refunds are processed within a week.')
+        self.bus = Category.objects.create(category_name='Bus routes', answer='Route maps and refund policy for passes.')
+        Category.objects.create(category_name='Refund archive', answer='Old refunds.', is_active=False)
+
+    def search(self, **params):
+        return self.client.get('/common/categories/search/', params)
+
+    def test_ranked_prefix_search(self):
+        response = self.search(q='refu')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data['results']], [self.fees.id, self.bus.id])
+
+    def test_all_terms_must_match(self):
+        response = self.search(q='bus pass')
+
+        self.assertEqual([item['id'] for item in response.data['results']], [self.bus.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.bus.answer = 'Route maps.'
+        self.bus.save()
+        self.fees.delete()
+
+        self.assertEqual(self.search(q='refund').data['results'], [])
+        self.assertEqual(len(self.search(q='maps').data['results']), 1)
+
+    def test_pagination(self):
+        first = self.search(q='refund', limit=1)
+        second = self.client.get(first.data['next'])
+
+        self.assertEqual([item['id'] for item in first.data['results']], [self.fees.id])
+        self.assertEqual([item['id'] for item in second.data['results']], [self.bus.id])
+        self.assertIsNone(second.data['next'])
+
+    def test_query_is_required(self):
+        self.assertEqual(self.search(q='  ').status_code, 400)
+        self.assertEqual(self.search(q='refund', limit='x').status_code, 400)
+
+
+class MessagePaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        self.category = Category.objects.create(category_name='Fees')
+        other = Category.objects.create(category_name='Transport')
+        self.messages = [
+            Message.objects.create(sender=self.parent, category=self.category, content=f'message {index}')
+            for index in range(5)
+        ]
+        Message.objects.create(sender=self.parent, category=other, content='elsewhere')
+
+    def ids(self, response):
+        return [item['id'] for item in response.json()['results']]
+
+    def test_by_category_pages_backwards_and_forwards(self):
+        ids = [message.id for message in reversed(self.messages)]
+
+        first = self.client.get('/common/messages/by_category/', {'category_id': self.category.id, 'page_size': 2})
+        second = self.client.get(first.json()['next'])
+        last = self.client.get(self.client.get(second.json()['next']).json()['previous'])
+
+        self.assertEqual(self.ids(first), ids[:2])
+        self.assertEqual(self.ids(second), ids[2:4])
+        self.assertEqual(self.ids(last), ids[2:4])
+
+        newer = self.client.get(first.json()['previous'])
+        self.assertEqual(self.ids(newer), [])
+        self.assertIn(f'after={ids[0]}', newer.json()['previous'])
+
+    def test_after_returns_only_newer_messages(self):
+        response = self.client.get('/common/messages/by_category/', {
+            'category_id': self.category.id, 'after': self.messages[2].id})
+
+        self.assertEqual(self.ids(response), [self.messages[4].id, self.messages[3].id])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/common/messages/by_category/', {'category_id': self.category.id, 'before': 'x'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_pages_do_not_sort(self):
+        pages = [('/common/messages/by_category/', {'category_id': self.category.id, 'before': 100}),
+                 ('/common/messages/', {'before': 100})]
+
+        for path, params in pages:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(path, params).status_code, 200)
+            page_queries = [query['sql'] for query in queries if 'FROM "common_message"' in query['sql']]
+            self.assertEqual(len(page_queries), 1)
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {page_queries[0]}')
+                plan = ' '.join(row[-1] for row in cursor.fetchall())
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_list_is_paginated(self):
+        response = self.client.get('/common/messages/', {'page_size': 4})
+
+        self.assertEqual(len(response.json()['results']), 4)
+        self.assertIsNotNone(response.json()['next'])
+
+
+class ReadSerializerTests(TestCase):
+    def setUp(self):
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        self.root = Category.objects.create(category_name='Fees', answer='Paid termly', contact_person=self.parent)
+        child = Category.objects.create(category_name='Refunds', parent_category=self.root)
+        Category.objects.create(category_name='Late refunds', parent_category=child)
+        Message.objects.create(sender=self.parent, category=self.root, content='when are fees due?',
+                               timestamp=datetime(2024, 3, 1, 9, 30, 15, 123456, tzinfo=dt_timezone.utc))
+
+    def test_compiled_rows_match_the_serializer(self):
+        rows = compile_read_serializer(MessageSerializer)
+
+        self.assertEqual(rows.serialize(rows.values(Message.objects.all())),
+                         MessageSerializer(Message.objects.all(), many=True).data)
+        self.assertEqual(rows.serialize(rows.values(Message.objects.all()))[0]['timestamp'],
+                         '2024-03-01T09:30:15.123456Z')
+        with timezone.override('Asia/Kolkata'):
+            self.assertEqual(rows.serialize(rows.values(Message.objects.all())),
+                             MessageSerializer(Message.objects.all(), many=True).data)
+
+    def test_category_tree_data_matches_the_serializer(self):
+        tree = CategoryTree.load()
+        expected = CategoryReadSerializer(tree.categories, many=True, context={'category_tree': tree}).data
+
+        data = category_tree_data(tree, tree.categories)
+
+        self.assertEqual(data, expected)
+        self.assertEqual([list(item) for item in data], [list(item) for item in expected])
+
+    def test_method_fields_must_be_deferred(self):
+        with self.assertRaises(ImproperlyConfigured):
+            RowSerializer(CategoryReadSerializer)
+
+    def test_fast_renderer_output_matches_json_renderer(self):
+        data = {'text': 'caf\u00e9 \u2028', 'at': datetime(2024, 3, 1, 9, 30, 15, 123456, tzinfo=dt_timezone.utc),
+                'amount': Decimal('1.50'), 'ids': (1, 2), 3: None}
+
+        self.assertIsNotNone(renderers.orjson)
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.factory = APIRequestFactory()
+        caches[settings.CATEGORY_CACHE_ALIAS].clear()
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        self.root = Category.objects.create(category_name='Fees')
+        Category.objects.create(category_name='Refunds', parent_category=self.root)
+        for index in range(3):
+            Message.objects.create(sender=self.parent, category=self.root, content=f'message {index}')
+
+    def assertSameAsViewset(self, route, path, params=None, **extra):
+        expected = viewset_views[route](self.factory.get(path, params, **extra))
+        expected = expected.render() if hasattr(expected, 'render') else expected
+        # So the async view builds its category responses rather than serving the viewset's.
+        caches[settings.CATEGORY_CACHE_ALIAS].clear()
+        response = self.client.get(path, params, **extra)
+
+        self.assertEqual((response.status_code, response.content), (expected.status_code, expected.content))
+        return response
+
+    def test_category_list_matches_the_viewset(self):
+        response = self.assertSameAsViewset('category-list', '/common/categories/')
+
+        self.assertEqual(self.client.get('/common/categories/', HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         304)
+
+    def test_messages_by_category_match_the_viewset(self):
+        path = '/common/messages/by_category/'
+        self.assertSameAsViewset('message-by-category', path, {'category_id': self.root.id, 'page_size': 2})
+        self.assertSameAsViewset('message-by-category', path, {'category_id': 'x'})
+        self.assertSameAsViewset('message-by-category', path, {'category_id': self.root.id, 'before': 1, 'after': 1})
+        self.assertSameAsViewset('message-by-category', path, {'category_id': self.root.id},
+                                 HTTP_AUTHORIZATION='Token not-a-jwt')
+
+
+class LoadTestTests(TestCase):
+    def setUp(self):
+        caches[settings.CATEGORY_CACHE_ALIAS].clear()
+        seed_dataset({role.value: 3 for role in UserRole}, category_depth=3, category_fan_out=2, messages=200,
+                     log=lambda message: None)
+
+    def test_seeded_tree_has_paths(self):
+        leaf = Category.objects.get(pk=Dataset.load().leaf_category_ids[0])
+
+        self.assertEqual(leaf.depth, 2)
+        self.assertEqual([category.pk for category in leaf.ancestors(include_self=True)],
+                         [int(pk) for pk in leaf.path.split('/')[:-1]])
+        self.assertEqual(Category.objects.get(pk=Dataset.load().busy_category_id).message_count,
+                         Message.objects.filter(category_id=Dataset.load().busy_category_id).count())
+
+    def test_replay_reports_every_endpoint(self):
+        entries = load_trace(DEFAULT_TRACE)
+        requests = build_requests(entries, Dataset.load(), 100)
+        report = summarize_results(*async_to_sync(replay)(get_asgi_application(), requests, 4))
+
+        self.assertEqual(report['total']['requests'], 100)
+        for name, endpoint in report['endpoints'].items():
+            self.assertEqual(endpoint['errors'], 0, name)
+            self.assertLessEqual(endpoint['p50_ms'], endpoint['p99_ms'])
+        self.assertGreaterEqual(report['endpoints']['messages by category']['queries_mean'], 1)
+
+    def test_baseline_comparison(self):
+        endpoint = {'requests': 10, 'errors': 0, 'p50_ms': 10, 'p95_ms': 20, 'p99_ms': 30, 'requests_per_second': 100,
+                    'queries_mean': 2, 'queries_max': 2, 'bytes_mean': 100, 'peak_rss_mb': 50}
+        baseline = {'endpoints': {'tree': endpoint}}
+
+        self.assertEqual(compare_to_baseline({'endpoints': {'tree': dict(endpoint, p95_ms=23)}}, baseline, 0.2), [])
+        self.assertEqual(compare_to_baseline({'endpoints': {'tree': dict(endpoint, p95_ms=25, queries_mean=3)}},
+                                             baseline, 0.2),
+                         ['tree: p95_ms 20 -> 25', 'tree: queries_mean 2 -> 3'])
+
+
+@override_settings(QUERY_BUDGETS='raise', PASSWORD_HASHING_WORKERS=0)
+class QueryBudgetTests(TestCase):
+    # Actions whose query count grows with the rows they touch by design.
+    unbudgeted = {(MessageListViewSet, 'export'), (MessageListViewSet, 'bulk_import'),
+                  (AccountViewSet, 'bulk_import')}
+
+    def seed(self, size):
+        Message.objects.all().delete()
+        Category.objects.all().delete()
+        Account.objects.all().delete()
+        caches[settings.CATEGORY_CACHE_ALIAS].clear()
+        seed_dataset({role.value: size for role in UserRole}, category_depth=3, category_fan_out=size,
+                     messages=size * 20, log=lambda message: None)
+        dataset = Dataset.load()
+        self.users = {role: Account.objects.get(pk=ids[0]) for role, ids in dataset.users.items()}
+        self.root, self.leaf, self.word = dataset.root_category_ids[0], dataset.leaf_category_ids[0], dataset.words[0]
+        self.message = Message.objects.filter(category_id=dataset.busy_category_id).first()
+        # Deleted by the destroy actions, with the same few messages at every size.
+        self.doomed_account = Account.objects.create(
+            username='doomed@example.com', email='doomed@example.com', role=UserRole.PARENT.value)
+        self.doomed_category = Category.objects.create(category_name='Doomed', parent_category_id=self.leaf)
+        self.account_import = AccountImport.objects.create(role=UserRole.PARENT.value, batch_size=10)
+        for index in range(3):
+            Message.objects.create(sender=self.doomed_account, category_id=self.leaf, content=str(index))
+            Message.objects.create(sender=self.users['staff'], category=self.doomed_category, content=str(index))
+
+    def route_requests(self):
+        """
+        ``(method, path, data, user role)`` of one successful request per budgeted action.
+        """
+        account = {'email': 'new@example.com', 'password': 'Secret-pass-123', 'first_name': 'New', 'last_name': 'User',
+                   'role': UserRole.PARENT.value}
+        parent_id = self.users['parent'].id
+        return {
+            (CategoryViewSet, 'list'): ('get', '/common/categories/', None, None),
+            (CategoryViewSet, 'retrieve'): ('get', f'/common/categories/{self.root}/', None, None),
+            (CategoryViewSet, 'parents'): ('get', '/common/categories/parents/', None, None),
+            (CategoryViewSet, 'sub_categories'): ('get', '/common/categories/sub_categories/',
+                                                  {'parent_id': self.root}, None),
+            (CategoryViewSet, 'subtree'): ('get', f'/common/categories/{self.root}/subtree/', None, None),
+            (CategoryViewSet, 'breadcrumb'): ('get', f'/common/categories/{self.leaf}/breadcrumb/', None, None),
+            (CategoryViewSet, 'search'): ('get', '/common/categories/search/', {'q': self.word}, None),
+            (CategoryViewSet, 'create'): ('post', '/common/categories/',
+                                          {'category_name': 'New', 'parent_category': self.root}, 'admin'),
+            (CategoryViewSet, 'update'): ('put', f'/common/categories/{self.leaf}/',
+                                          {'category_name': 'Moved', 'parent_category': self.root}, 'admin'),
+            (CategoryViewSet, 'partial_update'): ('patch', f'/common/categories/{self.leaf}/',
+                                                  {'category_name': 'Renamed'}, 'admin'),
+            (CategoryViewSet, 'destroy'): ('delete', f'/common/categories/{self.doomed_category.id}/', None, 'admin'),
+            (MessageListViewSet, 'list'): ('get', '/common/messages/', None, None),
+            (MessageListViewSet, 'retrieve'): ('get', f'/common/messages/{self.message.id}/', None, None),
+            (MessageListViewSet, 'by_category'): ('get', '/common/messages/by_category/',
+                                                  {'category_id': self.message.category_id}, None),
+            (AccountViewSet, 'list'): ('get', '/user_accounts/accounts/', {'role': UserRole.PARENT.value}, 'staff'),
+            (AccountViewSet, 'retrieve'): ('get', f'/user_accounts/accounts/{parent_id}/', None, 'parent'),
+            (AccountViewSet, 'search'): ('get', '/user_accounts/accounts/search/', {'q': 'a'}, 'staff'),
+            (AccountViewSet, 'create'): ('post', '/user_accounts/accounts/', account, 'admin'),
+            (AccountViewSet, 'update'): ('put', f'/user_accounts/accounts/{parent_id}/',
+                                         dict(account, email='parent@example.com'), 'parent'),
+            (AccountViewSet, 'partial_update'): ('patch', f'/user_accounts/accounts/{parent_id}/',
+                                                 {'first_name': 'Renamed', 'role': UserRole.PARENT.value}, 'parent'),
+            (AccountViewSet, 'destroy'): ('delete', f'/user_accounts/accounts/{self.doomed_account.id}/', None,
+                                          'admin'),
+            (AccountViewSet, 'register_parent'): ('post', '/user_accounts/accounts/register/parent/',
+                                                  dict(account, email='parent.new@example.com'), None),
+            (AccountViewSet, 'register_staff'): ('post', '/user_accounts/accounts/register/staff/',
+                                                 dict(account, email='staff.new@example.com',
+                                                      role=UserRole.STAFF.value), None),
+            (AccountViewSet, 'bulk_import_status'): ('get', f'/user_accounts/accounts/bulk/{self.account_import.id}/',
+                                                     None, 'admin'),
+        }
+
+    def count_queries(self):
+        counts = {}
+        for (viewset, action), (method, path, data, role) in self.route_requests().items():
+            client = APIClient()
+            if role:
+                client.force_authenticate(self.users[role])
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(client, method)(path, data, format=None if method == 'get' else 'json')
+            self.assertLess(response.status_code, 300, f'{viewset.__name__}.{action}: {response.content}')
+            counts[viewset.__name__, action] = len(queries)
+        return counts
+
+    def test_every_route_is_budgeted_and_covered(self):
+        self.seed(2)
+        routed = set(routed_actions())
+
+        self.assertEqual(routed - self.unbudgeted, set(self.route_requests()))
+        for viewset, action in routed - self.unbudgeted:
+            self.assertIn(action, viewset.query_budgets, f'{viewset.__name__}.{action} has no query budget')
+
+    def test_query_counts_do_not_grow_with_the_data(self):
+        # Within budget at both sizes, or the middleware raises, and the same at both.
+        self.seed(2)
+        small = self.count_queries()
+        self.seed(6)
+        large = self.count_queries()
+
+        self.assertEqual(small, large)
+
+    def test_over_budget_requests_fail(self):
+        self.seed(2)
+        client = APIClient()
+        client.force_authenticate(self.users['admin'])
+
+        with mock.patch.dict(AccountViewSet.query_budgets, {'destroy': 1}):
+            with self.assertRaisesRegex(QueryBudgetExceeded,
+                                        r'^AccountViewSet.destroy made 12 queries, over its budget of 1\.$'):
+                client.delete(f'/user_accounts/accounts/{self.doomed_account.id}/')
+
+    def test_over_budget_failures_name_the_repeated_statements(self):
+        statements = ['SELECT * FROM "account" WHERE "id" = 1', 'SELECT * FROM "account" WHERE "id" = 2',
+                      "SELECT * FROM \"category\" WHERE name = 'x' AND id IN (%s, %s)", 'SELECT 1']
+
+        self.assertEqual(fingerprint(statements[2]), 'SELECT * FROM "category" WHERE name = ? AND id IN (...)')
+        self.assertEqual(repeated_statements(statements), [(2, 'SELECT * FROM "account" WHERE "id" = ?')])
+        with self.assertRaisesRegex(QueryBudgetExceeded, 'over its budget of 3. Repeated: 2x SELECT'):
+            check_query_budget('AccountViewSet.list', 3, statements)
+        with self.settings(QUERY_BUDGETS='log'), self.assertLogs('common.budgets', 'WARNING'):
+            check_query_budget('AccountViewSet.list', 3, statements)
+
+    def count_admin_message_list_queries(self):
+        admin_user = Account.objects.create_superuser(
+            username='root@example.com', email='root@example.com', password='secret', role=UserRole.ADMIN.value)
+        # EmailAuthBackend only authenticates, so sessions are resolved by the model backend.
+        self.client.force_login(admin_user, backend='django.contrib.auth.backends.ModelBackend')
+        self.client.get('/admin/common/message/')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/admin/common/message/').status_code, 200)
+        return len(queries)
+
+    def test_admin_message_list_joins_senders(self):
+        self.seed(2)
+        small = self.count_admin_message_list_queries()
+        self.seed(6)
+
+        self.assertEqual(small, self.count_admin_message_list_queries())
+
+
+class MessageExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = Account.objects.create_user(
+            username='admin@example.com', email='admin@example.com', password='secret', role=UserRole.ADMIN.value)
+        self.category = Category.objects.create(category_name='Fees')
+        self.messages = [
+            Message.objects.create(sender=self.admin, category=self.category, content=f'line {index}, "quoted"')
+            for index in range(3)
+        ]
+        Message.objects.filter(pk=self.messages[0].pk).update(timestamp=datetime(2024, 1, 1, tzinfo=dt_timezone.utc))
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params):
+        response = self.client.get('/common/messages/export/', {'category_id': self.category.id, **params})
+        return response, b''.join(response.streaming_content)
+
+    def test_ndjson(self):
+        response, content = self.export()
+
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([row['id'] for row in rows], [message.id for message in self.messages])
+        self.assertEqual(rows[0]['content'], 'line 0, "quoted"')
+
+    def test_csv_gzip_and_date_range(self):
+        response, content = self.export(output='csv', gzip='true', since='2024-06-01')
+
+        rows = list(csv.reader(io.StringIO(gzip.decompress(content).decode())))
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(rows[0], ['id', 'sender_id', 'category_id', 'content', 'timestamp'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [message.id for message in self.messages[1:]])
+
+    def test_requires_admin(self):
+        self.client.force_authenticate(None)
+
+        self.assertEqual(self.client.get('/common/messages/export/', {'category_id': self.category.id}).status_code, 401)
+
+    def test_management_command_writes_same_stream(self):
+        _, content = self.export()
+        with tempfile.NamedTemporaryFile() as output:
+            call_command('export_messages', self.category.id, output=output.name)
+            self.assertEqual(output.read(), content)
+
+
+class MessageImportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = Account.objects.create_user(
+            username='admin@example.com', email='admin@example.com', password='secret', role=UserRole.ADMIN.value)
+        self.category = Category.objects.create(category_name='Fees')
+        self.client.force_authenticate(self.admin)
+
+    def post(self, lines, **params):
+        url = '/common/messages/bulk/'
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(url, '\n'.join(lines), content_type='application/x-ndjson')
+
+    def row(self, **overrides):
+        row = {'sender': self.admin.id, 'category': self.category.id, 'content': 'hello'}
+        row.update(overrides)
+        return json.dumps(row)
+
+    def test_import_reports_per_row_errors(self):
+        lines = [
+            self.row(timestamp='2020-05-01T10:00:00Z'),
+            'not json',
+            self.row(sender=999),
+            '',
+            self.row(content=''),
+            self.row(category=999),
+            self.row(),
+        ]
+
+        response = self.post(lines, batch_size=2)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['received'], 6)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 3, 5, 6])
+        self.assertIn('sender', response.data['errors'][1]['errors'])
+        self.assertEqual(Message.objects.earliest('timestamp').timestamp.year, 2020)
+
+    def test_undecodable_line_is_reported(self):
+        body = b'\n'.join([self.row().encode(), b'{"content": "caf\xe9"}', self.row().encode()])
+
+        response = self.client.post('/common/messages/bulk/', body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'],
+                         [{'line': 2, 'errors': {'non_field_errors': ['Invalid text encoding.']}}])
+
+    def test_foreign_keys_checked_per_batch(self):
+        lines = [self.row() for _ in range(50)]
+
+        # Two id lookups, the insert inside its savepoint, and one counter UPDATE per category.
+        with self.assertNumQueries(6):
+            MessageImporter(batch_size=50).run(enumerate(lines, start=1))
+
+        self.assertEqual(Message.objects.count(), 50)
+
+    def test_requires_admin_and_valid_batch_size(self):
+        self.assertEqual(self.post([self.row()], batch_size=0).status_code, 400)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.post([self.row()]).status_code, 401)
+
+
+class CategoryActivityTests(TestCase):
+    def setUp(self):
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        self.category = Category.objects.create(category_name='Fees')
+
+    def send(self, content='hello', **kwargs):
+        return Message.objects.create(sender=self.parent, category=self.category, content=content, **kwargs)
+
+    def assertActivity(self, count, last):
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.message_count, count)
+        self.assertEqual(self.category.last_message_id, last.id if last else None)
+        self.assertEqual(self.category.last_message_at, last.timestamp if last else None)
+
+    def test_create_and_delete(self):
+        first = self.send()
+        second = self.send()
+        self.assertActivity(2, second)
+
+        second.delete()
+        self.assertActivity(1, first)
+        first.delete()
+        self.assertActivity(0, None)
+
+    def test_deleting_an_account_recounts_its_categories_once(self):
+        staff = Account.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='secret', role=UserRole.STAFF.value)
+        kept = self.send()
+        for index in range(5):
+            Message.objects.create(sender=staff, category=self.category, content=str(index))
+
+        # The account and its messages go in a fixed number of statements, with one recount for the category.
+        with CaptureQueriesContext(connection) as queries:
+            staff.delete()
+
+        self.assertActivity(1, kept)
+        self.assertEqual(sum('UPDATE "common_category"' in query['sql'] for query in queries.captured_queries), 1)
+
+    def test_older_message_does_not_move_pointer(self):
+        latest = self.send()
+        self.send(timestamp=datetime(2020, 1, 1, tzinfo=dt_timezone.utc))
+
+        self.assertActivity(2, latest)
+
+    def test_bulk_import_updates_counters(self):
+        lines = [json.dumps({'sender': self.parent.id, 'category': self.category.id, 'content': str(index)})
+                 for index in range(5)]
+        MessageImporter(batch_size=2).run(enumerate(lines, start=1))
+
+        self.assertActivity(5, Message.objects.latest('id'))
+
+    def test_saving_a_category_keeps_messages_counted_since_it_was_loaded(self):
+        category = Category.objects.get(pk=self.category.pk)
+        last = self.send()
+
+        category.category_name = 'School fees'
+        category.save()
+
+        self.assertActivity(1, last)
+        self.assertEqual(self.category.category_name, 'School fees')
+
+    def test_reconcile(self):
+        self.send()
+        last = self.send()
+        Category.objects.update(message_count=42, last_message_id=None, last_message_at=None)
+
+        call_command('reconcile_category_activity', stdout=io.StringIO())
+
+        self.assertActivity(2, last)
+
+    def test_exposed_on_category_list(self):
+        caches[settings.CATEGORY_CACHE_ALIAS].clear()
+        last = self.send()
+
+        item = APIClient().get('/common/categories/').json()[0]
+
+        self.assertEqual(item['message_count'], 1)
+        self.assertEqual(item['last_message_id'], last.id)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.client = APIClient()
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        self.admin = Account.objects.create_user(
+            username='admin@example.com', email='admin@example.com', password='secret', role=UserRole.ADMIN.value,
+            is_staff=True)
+        self.client.force_login(self.admin, backend='django.contrib.auth.backends.ModelBackend')
+        self.category = Category.objects.create(category_name='Fees')
+        for index in range(3):
+            Message.objects.create(sender=self.parent, category=self.category, content=f'message {index}')
+
+    def series(self, text, name, route, method='GET'):
+        """
+        Values of metric ``name`` for a route, keyed by their other labels.
+        """
+        prefix = f'{name}{{route="{route}",method="{method}"'
+        return {line[len(prefix):].rsplit(' ', 1)[0].strip(',}'): float(line.rsplit(' ', 1)[1])
+                for line in text.splitlines() if line.startswith(prefix)}
+
+    def test_routes_are_aggregated_by_pattern(self):
+        for _ in range(3):
+            self.client.get('/common/messages/by_category/', {'category_id': self.category.id})
+        for pk in range(5):
+            self.client.get(f'/common/categories/{self.category.id + pk}/breadcrumb/')
+
+        text = self.client.get('/metrics').content.decode()
+
+        self.assertEqual(self.series(text, 'helpdesk_request_duration_seconds_count', 'message-by-category'), {'': 3})
+        self.assertEqual(self.series(text, 'helpdesk_request_queries_count', 'message-by-category'), {'': 3})
+        self.assertGreaterEqual(self.series(text, 'helpdesk_request_queries_sum', 'message-by-category')[''], 3)
+        self.assertGreater(self.series(text, 'helpdesk_response_size_bytes_sum', 'message-by-category')[''], 0)
+        # Five paths, one series, with a 2xx and a 4xx status class.
+        self.assertEqual(self.series(text, 'helpdesk_requests_total', 'category-breadcrumb'),
+                         {'status="2xx"': 1, 'status="4xx"': 4})
+        buckets = self.series(text, 'helpdesk_request_duration_seconds_bucket', 'category-breadcrumb')
+        self.assertEqual(buckets['le="+Inf"'], 5)
+        self.assertEqual(sorted(buckets.values()), list(buckets.values()))
+
+    @override_settings(METRICS_SLOW_REQUESTS=2)
+    def test_slowest_requests_are_sampled_with_sql(self):
+        for _ in range(4):
+            self.client.get('/common/messages/by_category/', {'category_id': self.category.id})
+
+        samples = self.client.get('/metrics/slow').json()['results']
+
+        self.assertEqual(len(samples), 2)
+        self.assertGreaterEqual(samples[0]['duration'], samples[1]['duration'])
+        self.assertEqual(samples[0]['route'], 'message-by-category')
+        self.assertIn('common_message', samples[0]['sql'][0]['sql'])
+        # The path only: query strings can hold names and emails.
+        self.assertEqual(samples[0]['request'], '/common/messages/by_category/')
+        # Reading the samples keeps them.
+        self.assertIn('message-by-category',
+                      [sample['route'] for sample in self.client.get('/metrics/slow').json()['results']])
+
+    def test_staff_session_is_required_without_a_token(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics/slow').status_code, 403)
+
+        self.client.force_login(self.parent, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret-token')
+    def test_token_is_required_when_set(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret-token').status_code, 200)
+        self.assertEqual(self.client.post('/metrics', HTTP_AUTHORIZATION='Bearer secret-token').status_code, 405)
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    def test_websocket_events_are_recorded(self):
+        application = WebSocketMetricsMiddleware(URLRouter(websocket_urlpatterns), websocket_urlpatterns)
+
+        async def chat():
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{self.category.id}/')
+            communicator.scope['user'] = self.parent
+            await communicator.connect()
+            await communicator.send_json_to({'content': 'When are fees due?'})
+            await communicator.receive_json_from()
+            await communicator.send_json_to({})
+            await communicator.receive_json_from()
+            await communicator.disconnect()
+
+            rejected = WebsocketCommunicator(application, '/ws/chat/0/')
+            rejected.scope['user'] = self.parent
+            await rejected.connect()
+
+        async_to_sync(chat)()
+        message_buffer.flush()
+        text = metrics.render()
+
+        route = 'ws/chat/<int:category_id>/'
+        self.assertEqual(self.series(text, 'helpdesk_requests_total', route, 'websocket.connect'),
+                         {'status="1xx"': 1, 'status="4xx"': 1})
+        self.assertEqual(self.series(text, 'helpdesk_request_queries_sum', route, 'websocket.connect'), {'': 2})
+        self.assertEqual(self.series(text, 'helpdesk_requests_total', route, 'websocket.receive'),
+                         {'status="1xx"': 2})
+        self.assertGreater(self.series(text, 'helpdesk_response_size_bytes_sum', route, 'websocket.receive')[''], 0)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # A second SQLite file standing in for a replica. Not in ``databases``: the test runner would create it.
+        cls.replica_file = tempfile.NamedTemporaryFile(suffix='.sqlite3')
+        connection.ensure_connection()
+        cls.schema = sqlite3.connect(':memory:')
+        connection.connection.backup(cls.schema)
+        super().setUpClass()
+        connections.settings['replica'] = {**connection.settings_dict, 'NAME': cls.replica_file.name}
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.replica_file.close()
+        cls.schema.close()
+        super().tearDownClass()
+
+    def setUp(self):
+        caches[settings.DATABASE_REPLICA_CACHE_ALIAS].clear()
+        self.staff = Account.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='secret', role=UserRole.STAFF.value)
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        self.category = Category.objects.create(category_name='Fees')
+        message = Message.objects.create(sender=self.parent, category=self.category, content='replicated')
+        self.replicate([self.staff, self.parent, self.category, message])
+        # Written since, and not on the replica yet.
+        Message.objects.create(sender=self.parent, category=self.category, content='lagging')
+        Category.objects.create(category_name='Lagging', parent_category=self.category)
+
+    def replicate(self, instances):
+        # Start from the empty schema: the replica is outside the test's transaction.
+        connections['replica'].close()
+        replica = sqlite3.connect(self.replica_file.name)
+        self.schema.backup(replica)
+        replica.close()
+        for instance in instances:
+            type(instance).objects.using('replica').bulk_create([copy.copy(instance)])
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def contents(self, client):
+        response = client.get('/common/messages/by_category/', {'category_id': self.category.id})
+        return [message['content'] for message in response.json()['results']]
+
+    def test_reads_of_replica_actions_go_to_the_replica(self):
+        client = self.client_for(self.staff)
+
+        self.assertEqual(self.contents(client), ['replicated'])
+        self.assertEqual(len(client.get('/common/messages/').json()['results']), 1)
+        self.assertEqual(client.get(f'/common/categories/{self.category.id}/').json()['subcategories'], [])
+        # Cached tree responses are built from the primary.
+        self.assertEqual(len(client.get(f'/common/categories/{self.category.id}/subtree/').json()['subcategories']), 1)
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.contents(self.client_for(self.staff)), ['lagging', 'replicated'])
+
+    def test_writers_read_from_the_primary_for_a_while(self):
+        client = self.client_for(self.staff)
+
+        response = client.patch(f'/user_accounts/accounts/{self.staff.id}/',
+                                {'first_name': 'Renamed', 'role': UserRole.STAFF.value}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.contents(client), ['lagging', 'replicated'])
+        self.assertEqual(self.contents(self.client_for(self.parent)), ['replicated'])
+        later = time.time() + settings.DATABASE_REPLICA_STICKY_SECONDS + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(self.contents(client), ['replicated'])
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    def test_chat_senders_read_from_the_primary_for_a_while(self):
+        async def send():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.category.id}/')
+            communicator.scope['user'] = self.parent
+            await communicator.connect()
+            await communicator.send_json_to({'content': 'hello'})
+            await communicator.receive_json_from()
+            await communicator.disconnect()
+
+        # Not written: the buffer's thread would not see this test's rows.
+        with mock.patch.object(message_buffer, 'add'):
+            async_to_sync(send)()
+
+        self.assertEqual(self.contents(self.client_for(self.parent)), ['lagging', 'replicated'])
+        self.assertEqual(self.contents(self.client_for(self.staff)), ['replicated'])
+
+    def test_failed_writes_do_not_pin_to_the_primary(self):
+        client = self.client_for(self.staff)
+
+        response = client.patch(f'/user_accounts/accounts/{self.staff.id}/', {'role': 'nobody'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.contents(client), ['replicated'])
+
+    def test_reads_after_a_write_in_the_same_request_use_the_primary(self):
+        request = APIRequestFactory().get('/common/messages/')
+        request.resolver_match = resolve('/common/messages/')
+        routing = Routing(request)
+
+        self.assertEqual(routing.db_for_read(), 'replica')
+        routing.db_for_write()
+        self.assertIsNone(routing.db_for_read())
+        self.assertEqual(ReplicaRouter().db_for_write(Message), 'default')
+        self.assertIsNone(ReplicaRouter().db_for_read(Message))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        self.category = Category.objects.create(category_name='Fees')
+
+    def tearDown(self):
+        message_buffer.flush()
+
+    def communicator(self, category_id=None, user=None):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns),
+                                             f'/ws/chat/{category_id or self.category.id}/')
+        communicator.scope['user'] = user or self.parent
+        return communicator
+
+    async def test_message_is_broadcast_then_persisted(self):
+        alice, bob = self.communicator(), self.communicator()
+        self.assertTrue((await alice.connect())[0])
+        self.assertTrue((await bob.connect())[0])
+
+        await alice.send_json_to({'content': 'When are fees due?'})
+
+        for communicator in [alice, bob]:
+            received = await communicator.receive_json_from()
+            self.assertEqual(received['content'], 'When are fees due?')
+            self.assertEqual(received['sender'], self.parent.id)
+        await alice.disconnect()
+        await bob.disconnect()
+
+        await database_sync_to_async(message_buffer.flush)()
+        self.assertEqual(await database_sync_to_async(Message.objects.filter(category=self.category).count)(), 1)
+
+    async def test_rejects_anonymous_and_unknown_category(self):
+        connected, code = await self.communicator(user=AnonymousUser()).connect()
+        self.assertEqual((connected, code), (False, 4401))
+        connected, code = await self.communicator(category_id=self.category.id + 1).connect()
+        self.assertEqual((connected, code), (False, 4404))
+
+    async def test_blank_content_is_rejected(self):
+        communicator = self.communicator()
+        await communicator.connect()
+
+        await communicator.send_json_to({'content': ' '})
+
+        self.assertEqual(await communicator.receive_json_from(), {'error': 'content is required'})
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'common.channel_layers.DatabaseChannelLayer'}})
+class DatabaseLayerChatConsumerTests(ChatConsumerTests):
+    pass
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class MessageBufferTests(TransactionTestCase):
+    def setUp(self):
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        self.category = Category.objects.create(category_name='Fees')
+
+    def message(self, content='hello'):
+        return Message(sender=self.parent, category=self.category, content=content)
+
+    def wait_for_messages(self, count):
+        for _ in range(100):
+            if Message.objects.count() >= count:
+                return
+            time.sleep(0.02)
+
+    def test_flushes_when_full(self):
+        buffer = MessageBuffer(max_size=3, max_delay=60)
+        for index in range(3):
+            buffer.add(self.message(str(index)))
+
+        self.wait_for_messages(3)
+        self.assertEqual(Message.objects.count(), 3)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.message_count, 3)
+
+    def test_flushes_after_delay(self):
+        buffer = MessageBuffer(max_size=100, max_delay=0.05)
+        buffer.add(self.message())
+
+        self.wait_for_messages(1)
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(len(buffer), 0)
+
+    def test_explicit_flush_writes_pending(self):
+        buffer = MessageBuffer(max_size=100, max_delay=60)
+        buffer.add(self.message())
+        buffer.add(self.message())
+
+        self.assertEqual(len(buffer.flush()), 2)
+        self.assertEqual(buffer.flush(), [])
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_messages_of_deleted_rows_are_dropped_alone(self):
+        other = Category.objects.create(category_name='Transport')
+        buffer = MessageBuffer(max_size=100, max_delay=60)
+        buffer.add(self.message('kept'))
+        buffer.add(Message(sender=self.parent, category=other, content='orphan'))
+        other_id = other.id
+        other.delete()
+
+        with self.assertLogs('common.buffer', 'WARNING') as logs:
+            saved = buffer.flush()
+
+        self.assertEqual([message.content for message in saved], ['kept'])
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['kept'])
+        self.assertIn(f'Dropped 1 buffered chat messages whose sender or category was deleted: '
+                      f'sender {self.parent.id} in category {other_id}', logs.output[0])
+
+    def test_failed_writes_are_retried_then_dropped(self):
+        buffer = MessageBuffer(max_size=100, max_delay=60, max_retries=2, retry_delay=0)
+        buffer.add(self.message())
+
+        with mock.patch.object(buffer, 'write', side_effect=OperationalError('disk I/O error')) as write, \
+                self.assertLogs('common.buffer', 'ERROR') as logs:
+            for _ in range(3):
+                self.assertEqual(buffer.flush(), [])
+                self.assertEqual(len(buffer), 1 if write.call_count < 3 else 0)
+
+        self.assertEqual(write.call_count, 3)
+        self.assertIn('Dropped 1 buffered chat messages after 3 failed writes', logs.output[-1])
+        self.assertEqual(buffer.flush(), [])
+
+    def test_failed_writes_back_off(self):
+        buffer = MessageBuffer(max_size=1, max_delay=0, retry_delay=60)
+        # Nothing left for the flush thread to write once the delay is over.
+        self.addCleanup(buffer._pending.clear)
+
+        with mock.patch.object(buffer, 'write', side_effect=OperationalError('disk I/O error')) as write, \
+                self.assertLogs('common.buffer', 'ERROR'):
+            buffer.add(self.message())
+            for _ in range(50):
+                if write.call_count:
+                    break
+                time.sleep(0.02)
+            time.sleep(0.2)
+
+        # The flush thread waits out the delay rather than retrying straight away.
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(len(buffer), 1)
+        self.assertGreater(buffer._retry_at - time.monotonic(), 50)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class SQLiteModeTests(TransactionTestCase):
+    def tearDown(self):
+        # The writer thread outlives the test; its connection must not.
+        sqlite.writer.submit(connections.close_all).result()
+
+    def open_file_database(self):
+        database = tempfile.NamedTemporaryFile(suffix='.sqlite3')
+        self.addCleanup(database.close)
+        wrapper = type(connections['default'])({**connection.settings_dict, 'NAME': database.name}, alias='sqlite_mode')
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        return wrapper.connection
+
+    def pragma(self, database, name):
+        return database.execute(f'PRAGMA {name}').fetchone()[0]
+
+    def test_tuned_connections_use_wal(self):
+        with self.settings(SQLITE_MODE='tuned', SQLITE_BUSY_TIMEOUT_MS=1234, SQLITE_CACHE_SIZE_KB=2048):
+            tuned = self.open_file_database()
+        with self.settings(SQLITE_MODE='default'):
+            default = self.open_file_database()
+
+        self.assertEqual(self.pragma(tuned, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(tuned, 'synchronous'), 1)
+        self.assertEqual(self.pragma(tuned, 'busy_timeout'), 1234)
+        self.assertEqual(self.pragma(tuned, 'cache_size'), -2048)
+        self.assertEqual(self.pragma(default, 'journal_mode'), 'delete')
+        with self.settings(SQLITE_MODE='fast'), self.assertRaises(ImproperlyConfigured):
+            self.open_file_database()
+
+    @override_settings(SQLITE_MODE='tuned')
+    def test_writes_are_made_by_the_writer_thread(self):
+        def create(name):
+            return threading.current_thread().name, Category.objects.create(category_name=name).pk
+
+        self.assertEqual(sqlite.write(create, 'Fees')[0], 'sqlite-writer')
+        self.assertEqual(async_to_sync(sqlite.awrite)(create, 'Transport')[0], 'sqlite-writer')
+        # Inside a transaction the write has to be part of it.
+        with transaction.atomic():
+            self.assertEqual(sqlite.write(create, 'Uniforms')[0], threading.current_thread().name)
+        with self.settings(SQLITE_MODE='default'):
+            self.assertEqual(sqlite.write(create, 'Meals')[0], threading.current_thread().name)
+        self.assertEqual(Category.objects.count(), 4)
+
+    @override_settings(SQLITE_MODE='tuned')
+    def test_chat_messages_are_written_by_the_writer_thread(self):
+        parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        category = Category.objects.create(category_name='Fees')
+        buffer = MessageBuffer(max_size=100, max_delay=60)
+        buffer.add(Message(sender=parent, category=category, content='hello'))
+
+        threads = []
+        write = buffer.write
+
+        def record_thread(messages):
+            threads.append(threading.current_thread().name)
+            return write(messages)
+
+        with mock.patch.object(buffer, 'write', record_thread):
+            self.assertEqual(len(buffer.flush()), 1)
+        self.assertEqual(threads, ['sqlite-writer'])
+        self.assertEqual(Message.objects.count(), 1)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class JWTAuthMiddlewareTests(TestCase):
+    def setUp(self):
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        self.category = Category.objects.create(category_name='Fees')
+        self.refresh = ClaimsRefreshToken.for_user(self.parent)
+        self.token = self.refresh.access_token
+        self.middleware = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        # A fresh index per test: rolled-back rows give their ids out again.
+        index = BlacklistIndex()
+        for target in ['auth_service.authenticate.blacklist_index', 'common.middleware.blacklist_index']:
+            patcher = mock.patch(target, index)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        index.sync()
+
+    def test_connect_with_query_string_token(self):
+        async def connect():
+            communicator = WebsocketCommunicator(self.middleware, f'/ws/chat/{self.category.id}/?token={self.token}')
+            connected, _ = await communicator.connect()
+            await communicator.disconnect()
+            return connected
+
+        self.assertTrue(async_to_sync(connect)())
+
+    def test_resolved_user_is_cached(self):
+        with self.assertNumQueries(1):
+            user = async_to_sync(self.middleware.resolve)(str(self.token))
+        with self.assertNumQueries(0):
+            again = async_to_sync(self.middleware.resolve)(str(self.token))
+
+        self.assertEqual(user, self.parent)
+        self.assertIs(again, user)
+
+    def test_concurrent_connects_share_one_lookup(self):
+        async def storm():
+            return await asyncio.gather(*[self.middleware.resolve(str(self.token)) for _ in range(20)])
+
+        with self.assertNumQueries(1):
+            users = async_to_sync(storm)()
+
+        self.assertEqual({user.pk for user in users}, {self.parent.pk})
+
+    def test_invalid_and_blacklisted_tokens(self):
+        self.assertIsNone(async_to_sync(self.middleware.resolve)(str(self.token) + 'x'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post('/user_accounts/logout/', {'refresh': str(self.refresh)})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(async_to_sync(self.middleware.resolve)(str(self.token)))
+
+    def test_cache_is_bounded_and_expires(self):
+        cache = TokenUserCache(maxsize=2, ttl=60)
+        expires = time.time() + 60
+        for jti in ['a', 'b', 'c']:
+            cache.set(jti, f'token-{jti}', jti, expires)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a', 'token-a'), (False, None))
+        self.assertEqual(cache.get('c', 'token-c'), (True, 'c'))
+        self.assertEqual(cache.get('c', 'forged'), (False, None))
+
+        cache.set('d', 'token-d', 'd', time.time() - 1)
+        self.assertEqual(cache.get('d', 'token-d'), (False, None))
+
+
+class DatabaseChannelLayerTests(TestCase):
+    def setUp(self):
+        self.socket_dir = tempfile.mkdtemp()
+
+    def layers(self, **config):
+        return [DatabaseChannelLayer(socket_dir=self.socket_dir, **config) for _ in range(2)]
+
+    async def test_group_send_reaches_other_processes(self):
+        for wakeup in ['socket', 'poll']:
+            with self.subTest(wakeup=wakeup):
+                local, remote = self.layers(wakeup=wakeup)
+                local_channel, remote_channel = await local.new_channel(), await remote.new_channel()
+                await local.group_add('category_1', local_channel)
+                await remote.group_add('category_1', remote_channel)
+                receiving = asyncio.ensure_future(remote.receive(remote_channel))
+
+                await local.group_send('category_1', {'type': 'chat.message', 'content': 'hi'})
+
+                self.assertEqual((await asyncio.wait_for(receiving, 5))['content'], 'hi')
+                self.assertEqual((await asyncio.wait_for(local.receive(local_channel), 5))['content'], 'hi')
+
+                await remote.group_discard('category_1', remote_channel)
+                await local.group_send('category_1', {'type': 'chat.message', 'content': 'again'})
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(remote.receive(remote_channel), 0.3)
+                await local.flush()
+                await remote.close()
+
+    async def test_capacity(self):
+        local, remote = self.layers(capacity=2)
+        for layer in [local, remote]:
+            channel = await layer.new_channel()
+            await local.send(channel, {'type': 'one'})
+            await local.send(channel, {'type': 'two'})
+            with self.assertRaises(ChannelFull):
+                await local.send(channel, {'type': 'three'})
+        await local.flush()
+
+    async def test_expired_messages_are_dropped(self):
+        local, remote = self.layers(expiry=0)
+        for layer in [local, remote]:
+            channel = await layer.new_channel()
+            await local.send(channel, {'type': 'stale'})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(channel), 0.3)
+        await local.flush()
+
+    async def test_normal_channels_are_shared(self):
+        sender, worker = self.layers(poll_interval=0.01)
+        await sender.send('thumbnails', {'type': 'resize', 'id': 7})
+
+        self.assertEqual(await asyncio.wait_for(worker.receive('thumbnails'), 5), {'type': 'resize', 'id': 7})
+        await sender.flush()
+
+    def test_sending_from_sync_code_keeps_no_loop_state(self):
+        sender, worker = self.layers(poll_interval=0.01)
+        async_to_sync(worker.group_add)('category_1', 'thumbnails')
+
+        # Each async_to_sync call runs in a loop of its own.
+        for index in range(3):
+            async_to_sync(sender.group_send)('category_1', {'type': 'resize', 'id': index})
+
+        self.assertEqual(sender._states, {})
+        for index in range(3):
+            self.assertEqual(async_to_sync(worker.receive)('thumbnails'), {'type': 'resize', 'id': index})
+        async_to_sync(sender.flush)()
+
+
+class DatabaseChannelLayerClaimTests(TransactionTestCase):
+    def claim_concurrently(self, layer):
+        ChannelLayerMessage.objects.bulk_create([
+            ChannelLayerMessage(channel=f'specific.abc!{index}', process='abc', payload=b'x', expires=time.time() + 60)
+            for index in range(3000)
+        ])
+        start = threading.Barrier(2)
+        claimed = [[], []]
+
+        def claimer(rows):
+            start.wait()
+            try:
+                while True:
+                    try:
+                        batch = layer._claim(process='abc')
+                    except OperationalError:
+                        # The in-memory test database locks whole tables; a real claimer would poll again.
+                        time.sleep(0.001)
+                        continue
+                    if not batch:
+                        return
+                    rows += batch
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claimer, args=(rows,)) for rows in claimed]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [channel for rows in claimed for channel, _, _ in rows]
+
+    def test_concurrent_claimers_deliver_every_message_once(self):
+        for returning in [True, False]:
+            with self.subTest(returning=returning):
+                layer = DatabaseChannelLayer()
+                with mock.patch.object(layer, '_can_delete_returning', return_value=returning):
+                    channels = self.claim_concurrently(layer)
+
+                self.assertEqual(sorted(channels), sorted(f'specific.abc!{index}' for index in range(3000)))
+                self.assertFalse(ChannelLayerMessage.objects.exists())
+
+    def test_rows_claimed_meanwhile_by_another_worker_are_skipped(self):
+        rows = ChannelLayerMessage.objects.bulk_create([
+            ChannelLayerMessage(channel=f'specific.abc!{index}', process='abc', payload=b'x', expires=time.time() + 60)
+            for index in range(3)
+        ])
+
+        def other_worker(sender, instance, **kwargs):
+            # Another worker deletes the second row after this one has read it.
+            if instance.id == rows[0].id:
+                with connection.cursor() as cursor:
+                    cursor.execute('DELETE FROM common_channellayermessage WHERE id = %s', [rows[1].id])
+
+        pre_delete.connect(other_worker, sender=ChannelLayerMessage)
+        self.addCleanup(pre_delete.disconnect, other_worker, sender=ChannelLayerMessage)
+        layer = DatabaseChannelLayer()
+        with mock.patch.object(layer, '_can_delete_returning', return_value=False):
+            claimed = layer._claim(process='abc')
+
+        self.assertEqual([channel for channel, _, _ in claimed], ['specific.abc!0', 'specific.abc!2'])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+                   MESSAGE_STREAM_TIMEOUT=2)
+class LiveMessageTests(TestCase):
+    def setUp(self):
+        self.parent = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+        self.category = Category.objects.create(category_name='Fees')
+        self.messages = [self.store(f'message {index}') for index in range(3)]
+
+    def store(self, content='hello'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(sender=self.parent, category=self.category, content=content)
+
+    def poll(self, **params):
+        return self.async_client.get('/common/messages/poll/', {'category_id': self.category.id, **params})
+
+    async def drain(self, events):
+        # Let the stream run out so it leaves the feed rather than being dropped mid-wait.
+        async for _ in events:
+            pass
+
+    async def test_poll_returns_newer_messages_at_once(self):
+        response = await self.poll(since_id=self.messages[0].id)
+
+        self.assertEqual([item['id'] for item in response.json()['results']],
+                         [message.id for message in self.messages[1:]])
+        self.assertEqual(response.json()['last_id'], self.messages[-1].id)
+
+    async def test_poll_is_woken_by_new_message(self):
+        waiting = asyncio.ensure_future(self.poll(since_id=self.messages[-1].id, timeout=10))
+        await asyncio.sleep(0.1)
+        self.assertFalse(waiting.done())
+
+        message = await database_sync_to_async(self.store)('new')
+
+        response = await asyncio.wait_for(waiting, 5)
+        self.assertEqual([item['id'] for item in response.json()['results']], [message.id])
+
+    async def test_poll_times_out_empty(self):
+        response = await self.poll(timeout=0)
+
+        self.assertEqual(response.json(), {'results': [], 'last_id': self.messages[-1].id})
+
+    async def test_invalid_parameters(self):
+        for params in [{'category_id': 'x'}, {'since_id': 'x'}, {'timeout': '-1'}]:
+            with self.subTest(params=params):
+                self.assertEqual((await self.poll(**params)).status_code, 400)
+        response = await self.async_client.get('/common/messages/stream/')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_sse_resumes_from_last_event_id(self):
+        response = await self.async_client.get('/common/messages/stream/', {'category_id': self.category.id},
+                                               headers={'Last-Event-ID': str(self.messages[1].id)})
+        events = response.streaming_content.__aiter__()
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(await events.__anext__(), b'retry: 3000\n\n')
+        self.assertTrue((await events.__anext__()).startswith(f'id: {self.messages[2].id}\n'.encode()))
+        await self.drain(events)
+
+    @override_settings(MESSAGE_STREAM_TIMEOUT=5)
+    async def test_many_idle_sse_clients(self):
+        clients = 2000
+        responses = await asyncio.gather(*[
+            self.async_client.get('/common/messages/stream/', {'category_id': self.category.id})
+            for _ in range(clients)
+        ])
+        streams = [response.streaming_content.__aiter__() for response in responses]
+        self.assertEqual(set(await asyncio.gather(*[stream.__anext__() for stream in streams])),
+                         {b'retry: 3000\n\n'})
+
+        # Idle clients only wait on an event: no threads, no polling.
+        cpu = time.process_time()
+        await asyncio.sleep(1)
+        self.assertLess(time.process_time() - cpu, 0.25)
+
+        pending = [asyncio.ensure_future(stream.__anext__()) for stream in streams]
+        queries = CaptureQueriesContext(connection)
+        await database_sync_to_async(queries.__enter__)()
+        message = await database_sync_to_async(self.store)('for everyone')
+        events = await asyncio.wait_for(asyncio.gather(*pending), 10)
+        await database_sync_to_async(queries.__exit__)(None, None, None)
+
+        self.assertEqual({event.split(b'\n')[0] for event in events}, {f'id: {message.id}'.encode()})
+        # The insert and its counter update, then one read shared by every client.
+        self.assertLess(len(queries), 10)
+        await asyncio.gather(*[self.drain(stream) for stream in streams])
@@ -0,0 +1,48 @@
+from collections import defaultdict
+
+from common.models import Category
+
+
+class CategoryTree:
+    """
+    Parent/child index over a set of categories, built from a single query.
+
+    Passed to CategoryReadSerializer through the ``category_tree`` context key so
+    nested subcategories are read from memory instead of one query per node.
+    """
+
+    def __init__(self, categories):
+        self.categories = list(categories)
+        self.children = defaultdict(list)
+        for category in self.categories:
+            self.children[category.parent_category_id].append(category)
+
+    @classmethod
+    def load(cls, queryset=None):
+        if queryset is None:
+            queryset = Category.objects.all()
+        return cls(queryset.order_by('id'))
+
+    @classmethod
+    async def aload(cls, queryset=None):
+        if queryset is None:
+            queryset = Category.objects.all()
+        return cls([category async for category in queryset.order_by('id')])
+
+    def subcategories(self, category):
+        return self.children.get(category.id, [])
+
+    def has_subcategories(self, category):
+        return category.id in self.children
+
+    def parents(self):
+        """
+        Categories that have at least one subcategory.
+        """
+        return [category for category in self.categories if self.has_subcategories(category)]
+
+    def leaves(self):
+        """
+        Categories without subcategories.
+        """
+        return [category for category in self.categories if not self.has_subcategories(category)]
@@ -1,12 +1,33 @@
+import asyncio
+import hmac
+import json
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.response import Response
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.utils.urls import replace_query_param
 
+from common.async_api import async_read_view, json_response
+from common.cache import acached_tree_response, cached_tree_response
+from common.compiled import compile_read_serializer
+from common.export import EXPORT_FORMATS, aiter_blocks, export_queryset, export_stream, parse_bound
+from common.ingest import MessageImporter
+from common.live import get_message_feed
+from common.metrics import metrics, sync_to_async
 from common.models import Category, Message
-from common.serializer import CategoryReadSerializer, CategoryWriteSerializer, MessageSerializer
+from common.pagination import MessagePagination
+from common.parsers import NDJSONParser
+from common.search import search_category_ids
+from common.serializer import CategoryReadSerializer, CategoryWriteSerializer, MessageSerializer, \
+    CategoryBreadcrumbSerializer, CategorySearchSerializer, category_tree_data
+from common.tree import CategoryTree
+from user_accounts.permissions import IsAdminUser
 
 
 # Create your views here.
@@ -15,39 +36,321 @@ from common.serializer import CategoryReadSerializer, CategoryWriteSerializer, M
 class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategoryReadSerializer
+    search_page_size = 20
+    search_max_page_size = 100
+    # Most queries one request to each action may make, however many rows there are (see common.budgets).
+    # Cascades delete 100 messages per statement, so destroying a busy category goes over and is logged.
+    query_budgets = {
+        'list': 1, 'retrieve': 2, 'parents': 1, 'sub_categories': 1, 'subtree': 2, 'breadcrumb': 2, 'search': 2,
+        'create': 6, 'update': 7, 'partial_update': 5, 'destroy': 6,
+    }
+    # Read from a replica when there are any (see common.replicas). The other tree reads are served from the shared
+    # cache, which is filled from the primary so that it never holds a tree older than its version.
+    replica_actions = ['retrieve']
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return CategoryWriteSerializer
         return CategoryReadSerializer
 
+    def get_category_tree(self):
+        # Load the whole tree once so nested subcategories are linked in memory.
+        if not hasattr(self, '_category_tree'):
+            self._category_tree = CategoryTree.load(self.get_queryset())
+        return self._category_tree
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'retrieve':
+            context['category_tree'] = self.get_category_tree()
+        return context
+
+    def get_tree_data(self, select):
+        tree = self.get_category_tree()
+        return category_tree_data(tree, select(tree))
+
+    def list(self, request, *args, **kwargs):
+        return cached_tree_response(request, 'list', lambda: self.get_tree_data(lambda tree: tree.categories))
+
     @action(detail=False, methods=['get'])
     def parents(self, request, *args, **kwargs):
-        parents = self.get_queryset().filter(subcategories__isnull=False).distinct()
-        serializer = self.get_serializer(parents, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return cached_tree_response(request, 'parents', lambda: self.get_tree_data(CategoryTree.parents))
 
     @action(detail=False, methods=['get'])
     def sub_categories(self, request, *args, **kwargs):
-        parents = self.get_queryset().filter(subcategories__isnull=True).distinct()
-        serializer = self.get_serializer(parents, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return cached_tree_response(request, 'sub_categories', lambda: self.get_tree_data(CategoryTree.leaves))
+
+    @swagger_auto_schema(method='get', operation_summary="Category with all of its nested subcategories")
+    @action(detail=True, methods=['get'])
+    def subtree(self, request, *args, **kwargs):
+        def build():
+            category = self.get_object()
+            return category_tree_data(CategoryTree.load(category.descendants(include_self=True)), [category])[0]
+
+        return cached_tree_response(request, f'subtree:{kwargs["pk"]}', build)
+
+    @swagger_auto_schema(method='get', operation_summary="Categories from the root down to this category")
+    @action(detail=True, methods=['get'])
+    def breadcrumb(self, request, *args, **kwargs):
+        def build():
+            category = self.get_object()
+            return CategoryBreadcrumbSerializer(category.ancestors(include_self=True), many=True).data
+
+        return cached_tree_response(request, f'breadcrumb:{kwargs["pk"]}', build)
+
+    @swagger_auto_schema(method='get', operation_summary="Full-text search over category names and answers",
+                         manual_parameters=[
+                             openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                                               description='Search text; the last word matches as a prefix'),
+                             openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+                             openapi.Parameter('offset', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+                         ])
+    @action(detail=False, methods=['get'])
+    def search(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Search text is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', self.search_page_size)), self.search_max_page_size)
+            offset = int(request.query_params.get('offset', 0))
+        except ValueError:
+            return Response({'error': 'Invalid limit or offset'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1 or offset < 0:
+            return Response({'error': 'Invalid limit or offset'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = search_category_ids(query, limit + 1, offset)
+        categories = Category.objects.in_bulk(ids[:limit])
+        serializer = CategorySearchSerializer([categories[pk] for pk in ids[:limit] if pk in categories], many=True)
+        url = request.build_absolute_uri()
+        return Response({
+            'results': serializer.data,
+            'next': replace_query_param(url, 'offset', offset + limit) if len(ids) > limit else None,
+            'previous': replace_query_param(url, 'offset', max(offset - limit, 0)) if offset else None,
+        }, status=status.HTTP_200_OK)
 
 
 class MessageListViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
-
+    pagination_class = MessagePagination
+    max_import_batch_size = 10000
+    # export queries while streaming, after the view returns, and bulk_import once per batch: neither is budgeted.
+    query_budgets = {'list': 1, 'retrieve': 1, 'by_category': 1}
+    replica_actions = ['list', 'retrieve', 'by_category']
 
     @swagger_auto_schema(method='get', operation_summary="List messages by category", manual_parameters=[
         openapi.Parameter('category_id', openapi.IN_QUERY, description="Category ID", type=openapi.TYPE_INTEGER),
+        openapi.Parameter('before', openapi.IN_QUERY, description="Only messages older than this message ID",
+                          type=openapi.TYPE_INTEGER),
+        openapi.Parameter('after', openapi.IN_QUERY, description="Only messages newer than this message ID",
+                          type=openapi.TYPE_INTEGER),
+        openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
     ])
     @action(detail=False, methods=['get'])
     def by_category(self, request):
         category_id = request.query_params.get('category_id')
         if category_id is None:
             return Response({"error": "Category ID is required"}, status=400)
+        if not category_id.isdigit():
+            return Response({"error": "Invalid category ID"}, status=400)
+
+        return self.list_rows(Message.objects.filter(category_id=category_id))
+
+    @swagger_auto_schema(method='get', operation_summary="Stream a category's message history as NDJSON or CSV",
+                         manual_parameters=[
+                             openapi.Parameter('category_id', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                                               required=True),
+                             openapi.Parameter('since', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                                               description='ISO date or datetime, inclusive'),
+                             openapi.Parameter('until', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                                               description='ISO date or datetime, exclusive'),
+                             openapi.Parameter('output', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                                               enum=list(EXPORT_FORMATS)),
+                             openapi.Parameter('gzip', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+                         ])
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        category_id = request.query_params.get('category_id', '')
+        export_format = request.query_params.get('output', 'ndjson')
+        gzip = request.query_params.get('gzip') in ['1', 'true']
+        if not category_id.isdigit():
+            return Response({"error": "Category ID is required"}, status=400)
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": "Unsupported output format"}, status=400)
+        try:
+            since = parse_bound(request.query_params.get('since'))
+            until = parse_bound(request.query_params.get('until'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        blocks = export_stream(export_queryset(category_id, since, until), export_format, gzip)
+        if isinstance(request._request, ASGIRequest):
+            blocks = aiter_blocks(blocks)
+        filename = f'category-{category_id}-messages.{export_format}' + ('.gz' if gzip else '')
+        response = StreamingHttpResponse(
+            blocks, content_type='application/gzip' if gzip else EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @swagger_auto_schema(method='post', operation_summary="Bulk import messages from NDJSON",
+                         operation_description='One JSON object per line with sender, category, content and an '
+                                               'optional timestamp. Invalid rows are reported and skipped.',
+                         manual_parameters=[
+                             openapi.Parameter('batch_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+                         ])
+    @action(detail=False, methods=['post'], url_path='bulk', permission_classes=[IsAdminUser],
+            parser_classes=[NDJSONParser])
+    def bulk_import(self, request):
+        batch_size = request.query_params.get('batch_size', '1000')
+        if not batch_size.isdigit() or not 0 < int(batch_size) <= self.max_import_batch_size:
+            return Response({"error": "Invalid batch size"}, status=400)
+
+        report = MessageImporter(batch_size=int(batch_size)).run(request.data)
+        return Response(report, status=status.HTTP_200_OK)
+
+    def list_rows(self, queryset):
+        """
+        A page of ``queryset`` through the compiled MessageSerializer, without model instances.
+        """
+        rows = compile_read_serializer(MessageSerializer)
+        return self.get_paginated_response(rows.serialize(self.paginate_queryset(rows.values(queryset))))
+
+    # Defined last: in the class body a ``list`` method would shadow the builtin for the decorators above.
+    def list(self, request, *args, **kwargs):
+        return self.list_rows(self.filter_queryset(self.get_queryset()))
+
+
+def parse_live_params(request):
+    """
+    ``category_id`` and ``since_id`` of a live message request, or a 400 response.
+    """
+    if request.method != 'GET':
+        return None, None, HttpResponseNotAllowed(['GET'])
+    category_id = request.GET.get('category_id')
+    since_id = request.headers.get('Last-Event-ID') or request.GET.get('since_id')
+    if category_id is None:
+        return None, None, JsonResponse({"error": "Category ID is required"}, status=400)
+    if not category_id.isdigit():
+        return None, None, JsonResponse({"error": "Invalid category ID"}, status=400)
+    if since_id is not None and not since_id.isdigit():
+        return None, None, JsonResponse({"error": "Invalid since ID"}, status=400)
+    return int(category_id), int(since_id) if since_id is not None else None, None
+
+
+async def message_events(category_id, since_id):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.MESSAGE_STREAM_TIMEOUT
+    async with get_message_feed().subscribe(category_id) as feed:
+        if since_id is None:
+            since_id = feed.cursor
+        yield 'retry: 3000\n\n'
+        while loop.time() < deadline:
+            timeout = min(settings.MESSAGE_STREAM_HEARTBEAT, deadline - loop.time())
+            messages = await feed.wait(since_id, timeout)
+            if not messages:
+                yield ': keep-alive\n\n'
+                continue
+            for message in messages:
+                yield f'id: {message["id"]}\ndata: {json.dumps(message)}\n\n'
+            since_id = messages[-1]['id']
+
+
+async def message_stream(request):
+    """
+    Server-Sent Events stream of a category's new messages, for clients that cannot keep a WebSocket open.
+
+    Each event's id is the message id, so a reconnecting browser resumes from
+    ``Last-Event-ID``. The stream ends after ``MESSAGE_STREAM_TIMEOUT`` seconds
+    and the client reconnects.
+    """
+    category_id, since_id, error = parse_live_params(request)
+    if error:
+        return error
+    response = StreamingHttpResponse(message_events(category_id, since_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def message_poll(request):
+    """
+    Long-poll for a category's messages newer than ``since_id``; answers as soon as there are any.
+    """
+    category_id, since_id, error = parse_live_params(request)
+    if error:
+        return error
+    timeout = request.GET.get('timeout', str(settings.MESSAGE_POLL_TIMEOUT))
+    if not timeout.isdigit():
+        return JsonResponse({"error": "Invalid timeout"}, status=400)
+    timeout = min(int(timeout), settings.MESSAGE_POLL_TIMEOUT)
+
+    async with get_message_feed().subscribe(category_id) as feed:
+        if since_id is None:
+            since_id = feed.cursor
+        messages = await feed.wait(since_id, timeout)
+    return JsonResponse({'results': messages, 'last_id': messages[-1]['id'] if messages else since_id})
+
+
+@async_read_view(CategoryViewSet)
+async def category_list(request):
+    """
+    Async ``CategoryViewSet.list``.
+    """
+    async def build():
+        tree = await CategoryTree.aload()
+        return category_tree_data(tree, tree.categories)
+
+    return await acached_tree_response(request, 'list', build)
+
+
+@async_read_view(MessageListViewSet)
+async def message_by_category(request):
+    """
+    Async ``MessageListViewSet.by_category``.
+    """
+    category_id = request.query_params.get('category_id')
+    if category_id is None:
+        return json_response({"error": "Category ID is required"}, status=400)
+    if not category_id.isdigit():
+        return json_response({"error": "Invalid category ID"}, status=400)
+
+    rows = compile_read_serializer(MessageSerializer)
+    paginator = MessageListViewSet.pagination_class()
+    messages = await paginator.apaginate_queryset(rows.values(Message.objects.filter(category_id=category_id)), request)
+    return json_response(paginator.get_paginated_data(rows.serialize(messages)))
+
+
+async def check_metrics_request(request):
+    """
+    A response refusing the request, or None: metrics are GET only and need ``METRICS_TOKEN`` when one is set,
+    or else a staff session, such as the admin site's.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    token = settings.METRICS_TOKEN
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+            return JsonResponse({"error": "Invalid metrics token"}, status=401)
+    elif not await sync_to_async(lambda: request.user.is_staff)():
+        return JsonResponse({"error": "Metrics are for staff, or set METRICS_TOKEN"}, status=403)
+    return None
+
+
+async def metrics_view(request):
+    """
+    This process's request metrics in the Prometheus text format.
+    """
+    error = await check_metrics_request(request)
+    if error:
+        return error
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
-        messages = Message.objects.filter(category_id=category_id).order_by('-id')
-        serializer = self.get_serializer(messages, many=True)
-        return Response(serializer.data)
+async def slow_requests_view(request):
+    """
+    The slowest requests sampled by this process with their SQL, slowest first; empty unless sampling is on.
+    """
+    error = await check_metrics_request(request)
+    if error:
+        return error
+    return JsonResponse({'results': metrics.slow_requests()})
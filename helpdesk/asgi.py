@@ -9,17 +9,21 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
-from channels.auth import AuthMiddlewareStack
-from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 
-from common.middleware import JWTAuthMiddleware
-from common.routing import websocket_urlpatterns
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'helpdesk.settings')
+# Set up Django before importing anything that touches models.
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
 
+from common.metrics import WebSocketMetricsMiddleware  # noqa: E402
+from common.middleware import JWTAuthMiddleware  # noqa: E402
+from common.routing import websocket_urlpatterns  # noqa: E402
 
 application = ProtocolTypeRouter({
-    'http': get_asgi_application(),
-    'websocket': JWTAuthMiddleware(AuthMiddlewareStack(URLRouter(websocket_urlpatterns))),
-})
\ No newline at end of file
+    'http': django_asgi_app,
+    'websocket': WebSocketMetricsMiddleware(
+        AuthMiddlewareStack(JWTAuthMiddleware(URLRouter(websocket_urlpatterns))), websocket_urlpatterns),
+})
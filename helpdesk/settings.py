@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
@@ -51,10 +52,15 @@ INSTALLED_APPS = [
     'drf_yasg',
 'corsheaders',
     'common',
+    'auth_service',
 
 ]
 
 MIDDLEWARE = [
+    # First, so the time of every other middleware counts towards the request.
+    'common.metrics.MetricsMiddleware',
+    'common.budgets.QueryBudgetMiddleware',
+    'common.replicas.ReplicaMiddleware',
 'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -89,17 +95,40 @@ ASGI_APPLICATION = 'helpdesk.asgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Seconds a database connection stays open for later requests (0 closes it after each request). Kept
+# connections are health-checked before a request reuses them.
+DATABASE_CONN_MAX_AGE = int(os.getenv('DATABASE_CONN_MAX_AGE', 60))
+
 if deployment_type == 'prod':
     DATABASES = {
-        "default": dj_database_url.parse(os.environ.get("DATABASE_URL"))
+        "default": dj_database_url.parse(os.environ.get("DATABASE_URL"), conn_max_age=DATABASE_CONN_MAX_AGE,
+                                         conn_health_checks=True)
     }
 else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
         }
     }
+# Comma-separated URLs of read replicas of the default database; locally a copy of db.sqlite3 will do, as
+# sqlite:////absolute/path/replica.sqlite3. common.replicas routes some reads to them.
+DATABASE_REPLICAS = []
+for url in filter(None, os.getenv('DATABASE_REPLICA_URLS', '').split(',')):
+    DATABASE_REPLICAS.append(f'replica_{len(DATABASE_REPLICAS)}')
+    DATABASES[DATABASE_REPLICAS[-1]] = dj_database_url.parse(
+        url.strip(), conn_max_age=DATABASE_CONN_MAX_AGE, conn_health_checks=True, test_options={'MIRROR': 'default'})
+DATABASE_ROUTERS = ['common.replicas.ReplicaRouter']
+# After writing, a user reads from the default database for this many seconds, so replica lag never hides their write.
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv('DATABASE_REPLICA_STICKY_SECONDS', 5))
+# "tuned" opens SQLite connections in WAL mode with the settings below and queues chat and channel layer writes for
+# one writer thread (see common.sqlite); "default" leaves SQLite as Django sets it up.
+SQLITE_MODE = os.getenv('SQLITE_MODE', 'default')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', 64 * 1024))
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -142,16 +171,27 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'auth_service.authenticate.ClaimsJWTAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'common.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
 
+# Access tokens carry the account's role and names (auth_service.authenticate.ACCOUNT_CLAIMS), which requests trust
+# until the token expires: a role change or rename reaches requests within this many minutes, at the next refresh.
+# Lower it only once clients refresh their access tokens.
+ACCESS_TOKEN_LIFETIME_MINUTES = int(os.getenv('ACCESS_TOKEN_LIFETIME_MINUTES', 60 * 24))
+
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Token',),
     'USER_ID_FIELD': 'email',
-    'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=ACCESS_TOKEN_LIFETIME_MINUTES),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
 }
+# Seconds a process may go without re-reading the token blacklist when no shared cache carries logouts to it.
+TOKEN_BLACKLIST_REFRESH_INTERVAL = int(os.getenv('TOKEN_BLACKLIST_REFRESH_INTERVAL', 5))
 
 
 AUTHENTICATION_BACKENDS = [
@@ -200,7 +240,19 @@ CORS_ORIGIN_WHITELIST = [
 #     'http://127.0.0.1:8000',
 # ]
 
-if deployment_type == 'prod':
+# "database" works across daphne workers without Redis (see common.channel_layers); "memory" is single-process only.
+CHANNEL_LAYER_BACKEND = os.getenv('CHANNEL_LAYER_BACKEND', 'database' if deployment_type == 'prod' else 'redis')
+if CHANNEL_LAYER_BACKEND == 'database':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'common.channel_layers.DatabaseChannelLayer',
+            'CONFIG': {
+                'capacity': int(os.getenv('CHANNEL_LAYER_CAPACITY', 100)),
+                'expiry': int(os.getenv('CHANNEL_LAYER_EXPIRY', 60)),
+            },
+        },
+    }
+elif CHANNEL_LAYER_BACKEND == 'memory':
     CHANNEL_LAYERS = {
 
         'default': {
@@ -219,6 +271,67 @@ else:
 
     }
 
+# Category tree responses are cached per tree version. Local memory works for a
+# single worker; point SHARED_CACHE_URL at Redis when several workers run so a
+# version bump in one process is seen by all of them.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if os.getenv('SHARED_CACHE_URL'):
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('SHARED_CACHE_URL'),
+    }
+CATEGORY_CACHE_ALIAS = 'shared' if 'shared' in CACHES else 'default'
+# Who recently wrote, for DATABASE_REPLICA_STICKY_SECONDS; shared so every process sees it.
+DATABASE_REPLICA_CACHE_ALIAS = 'shared' if 'shared' in CACHES else 'default'
+CATEGORY_CACHE_TIMEOUT = int(os.getenv('CATEGORY_CACHE_TIMEOUT', 24 * 60 * 60))
+# How stale the message counters in cached category responses may get; 0 disables the roll-over.
+CATEGORY_ACTIVITY_MAX_AGE = int(os.getenv('CATEGORY_ACTIVITY_MAX_AGE', 30))
+
+# WebSocket connects cache the user resolved from each access token for this many seconds.
+WEBSOCKET_AUTH_CACHE_SIZE = int(os.getenv('WEBSOCKET_AUTH_CACHE_SIZE', 10000))
+WEBSOCKET_AUTH_CACHE_TTL = int(os.getenv('WEBSOCKET_AUTH_CACHE_TTL', 60))
+
+# Login and registration hash passwords in this many worker processes (0 hashes inline). Past
+# PASSWORD_HASHING_MAX_PENDING concurrent hashes they answer 503 with this Retry-After, in seconds.
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', 2))
+PASSWORD_HASHING_MAX_PENDING = int(os.getenv('PASSWORD_HASHING_MAX_PENDING', 16))
+PASSWORD_HASHING_RETRY_AFTER = int(os.getenv('PASSWORD_HASHING_RETRY_AFTER', 1))
+# Bulk account imports hash in a pool of their own, so logins are not queued behind them.
+ACCOUNT_IMPORT_HASHING_WORKERS = int(os.getenv('ACCOUNT_IMPORT_HASHING_WORKERS', os.cpu_count() or 1))
+# Uploaded account CSV files wait here until their background import is over.
+ACCOUNT_IMPORT_DIR = os.getenv('ACCOUNT_IMPORT_DIR', os.path.join(tempfile.gettempdir(), 'helpdesk-account-imports'))
+
+# Chat messages are written in batches: after this many are waiting or this long after the first one.
+CHAT_BUFFER_MAX_SIZE = int(os.getenv('CHAT_BUFFER_MAX_SIZE', 500))
+CHAT_BUFFER_MAX_DELAY_MS = int(os.getenv('CHAT_BUFFER_MAX_DELAY_MS', 200))
+# A batch that fails to write is retried this many times, after a delay doubling from this one, then dropped.
+CHAT_BUFFER_MAX_RETRIES = int(os.getenv('CHAT_BUFFER_MAX_RETRIES', 5))
+CHAT_BUFFER_RETRY_DELAY_MS = int(os.getenv('CHAT_BUFFER_RETRY_DELAY_MS', 500))
+
+# Serve the hot read endpoints (account list and detail, category list, messages by category) from async views.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'true').lower() == 'true'
+
+# Per-route request metrics, served in the Prometheus text format at /metrics.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+# When set, /metrics and /metrics/slow want an "Authorization: Bearer <token>" header; otherwise a staff session.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Keep this many of the slowest requests with their SQL for /metrics/slow; 0 turns sampling off.
+METRICS_SLOW_REQUESTS = int(os.getenv('METRICS_SLOW_REQUESTS', 0))
+# Viewset actions' query_budgets: "log" warns about requests over budget, "raise" fails them (for tests), "off".
+QUERY_BUDGETS = os.getenv('QUERY_BUDGETS', 'off')
+
+ACCOUNT_PAGE_SIZE = int(os.getenv('ACCOUNT_PAGE_SIZE', 100))
+ACCOUNT_MAX_PAGE_SIZE = int(os.getenv('ACCOUNT_MAX_PAGE_SIZE', 1000))
+MESSAGE_PAGE_SIZE = int(os.getenv('MESSAGE_PAGE_SIZE', 50))
+MESSAGE_MAX_PAGE_SIZE = int(os.getenv('MESSAGE_MAX_PAGE_SIZE', 500))
+# Live message endpoints: SSE keep-alive interval and lifetime, and the longest long-poll wait, in seconds.
+MESSAGE_STREAM_HEARTBEAT = int(os.getenv('MESSAGE_STREAM_HEARTBEAT', 15))
+MESSAGE_STREAM_TIMEOUT = int(os.getenv('MESSAGE_STREAM_TIMEOUT', 300))
+MESSAGE_POLL_TIMEOUT = int(os.getenv('MESSAGE_POLL_TIMEOUT', 25))
 
 EMAIL_USE_TLS = True
 EMAIL_HOST = 'smtp.gmail.com'
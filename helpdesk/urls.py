@@ -21,6 +21,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from common.views import metrics_view, slow_requests_view
+
 class BothHttpAndHttpsSchemaGenerator(OpenAPISchemaGenerator):
     def get_schema(self, request=None, public=False):
         schema = super().get_schema(request, public)
@@ -46,7 +48,10 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('user_accounts/', include('user_accounts.urls')),
     path('common/', include('common.urls')),
+    path('auth_service/', include('auth_service.urls')),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('metrics', metrics_view, name='metrics'),
+    path('metrics/slow', slow_requests_view, name='metrics-slow'),
 
 ]
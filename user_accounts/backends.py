@@ -1,6 +1,8 @@
 from django.contrib.auth.backends import BaseBackend
 from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied
 
+from user_accounts import hashing
 from user_accounts.models import Account
 
 
@@ -9,7 +11,12 @@ class EmailAuthBackend(BaseBackend):
         user_model = get_user_model()
         try:
             user = user_model.objects.get(email=username)
-            if user.check_password(raw_password=password):
+            if hashing.check_password(user, password):
                 return user
+            # Stop here: ModelBackend would look the same account up by username and hash the password again, inline.
+            raise PermissionDenied
         except user_model.DoesNotExist:
-            return None
+            # Hash anyway so unknown emails take as long as wrong passwords, and through the pool, under its cap,
+            # rather than leaving it to ModelBackend to do inline.
+            hashing.make_password(password)
+            raise PermissionDenied
@@ -0,0 +1,119 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-ins in progress, please retry shortly.'
+    default_code = 'hashing_busy'
+
+    def __init__(self, wait):
+        super().__init__()
+        # DRF's exception handler turns this into a Retry-After header.
+        self.wait = wait
+
+
+def _check_password(password, encoded):
+    """
+    Runs in a worker: whether the password matches, and its re-hash when the stored one is outdated.
+    """
+    upgraded = []
+    valid = hashers.check_password(password, encoded, setter=lambda raw: upgraded.append(hashers.make_password(raw)))
+    return valid, upgraded[0] if upgraded else None
+
+
+class PasswordHasherPool:
+    """
+    Runs password hashing in a few worker processes instead of the request threads.
+
+    PBKDF2 is deliberately slow, so a burst of logins would otherwise hold
+    every thread daphne runs sync views on. At most ``max_pending`` hashes
+    may be queued or running at once; callers past that get ``HashingBusy``
+    straight away rather than waiting behind the burst. ``workers=0`` hashes
+    inline, still under the same cap.
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers if workers is not None else settings.PASSWORD_HASHING_WORKERS
+        self.max_pending = max_pending or settings.PASSWORD_HASHING_MAX_PENDING
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned rather than forked: forking a server process would copy its threads and database connections.
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=get_context('spawn'),
+                                                     initializer=django.setup)
+            return self._executor
+
+    def run(self, func, *args):
+        """
+        Call ``func(*args)`` in a worker and wait for the result.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy(settings.PASSWORD_HASHING_RETRY_AFTER)
+        if self.workers == 0:
+            try:
+                return func(*args)
+            finally:
+                self._slots.release()
+        try:
+            executor = self._get_executor()
+            future = executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Released when the hash is done, even if the waiting request has gone away.
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+
+    def make_passwords(self, passwords, chunksize=16):
+        """
+        Hash many passwords across the workers, for bulk jobs.
+
+        Not subject to ``max_pending``: bulk jobs should use a pool of their own
+        so logins are not queued behind them.
+        """
+        if self.workers == 0:
+            return [hashers.make_password(password) for password in passwords]
+        return list(self._get_executor().map(hashers.make_password, passwords, chunksize=chunksize))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+password_hasher = PasswordHasherPool()
+
+
+def make_password(password):
+    return password_hasher.run(hashers.make_password, password)
+
+
+def check_password(account, password):
+    """
+    Check ``password`` against the account's hash, saving a re-hash when the hasher settings changed.
+    """
+    valid, upgraded = password_hasher.run(_check_password, password, account.password)
+    if upgraded:
+        account.password = upgraded
+        account.save(update_fields=['password'])
+    return valid
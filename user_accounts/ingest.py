@@ -0,0 +1,258 @@
+import codecs
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, close_old_connections, connections, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from common.constants import UserRole
+from common.parsers import read_csv_records
+from user_accounts.hashing import PasswordHasherPool
+from user_accounts.models import Account, AccountImport
+
+logger = logging.getLogger(__name__)
+
+IMPORTABLE_ROLES = [UserRole.PARENT.value, UserRole.STAFF.value]
+NAME_MAX_LENGTH = Account._meta.get_field('first_name').max_length
+
+
+def validate_account_row(record, default_role):
+    """
+    Check one CSV record and return ``(row, errors)``; emails come back normalized.
+
+    Emails differing only in case belong to the same person, so ``row['key']``,
+    the lowercased email, is what duplicates are found by.
+    """
+    errors = {}
+    email = (record.get('email') or '').strip()
+    try:
+        validate_email(email)
+    except ValidationError:
+        errors['email'] = ['Enter a valid email address.']
+    role = (record.get('role') or '').strip() or default_role
+    if role not in IMPORTABLE_ROLES:
+        errors['role'] = [f'Must be one of {", ".join(IMPORTABLE_ROLES)}.']
+    names = {}
+    for name in ['first_name', 'last_name']:
+        names[name] = (record.get(name) or '').strip()
+        if len(names[name]) > NAME_MAX_LENGTH:
+            errors[name] = [f'Ensure this field has no more than {NAME_MAX_LENGTH} characters.']
+
+    if errors:
+        return None, errors
+    email = Account.objects.normalize_email(email)
+    return {'email': email, 'key': email.lower(), 'role': role, 'password': record.get('password') or None,
+            **names}, None
+
+
+class AccountImporter:
+    """
+    Bulk-register parents and staff from CSV records.
+
+    Emails are de-duplicated within the import and checked against existing
+    accounts, ignoring case, with one ``IN`` query per batch, passwords are
+    hashed across ``hashing_workers`` processes and the accounts are written
+    with ``bulk_create``. Rows without a password get an unusable one, to be set
+    through a password reset, which skips hashing altogether. A bad row is
+    reported and skipped without aborting its batch.
+    """
+    max_reported_errors = 1000
+
+    def __init__(self, batch_size=1000, default_role=UserRole.PARENT.value, hashing_workers=None):
+        self.batch_size = batch_size
+        self.default_role = default_role
+        self.hashers = PasswordHasherPool(
+            workers=hashing_workers if hashing_workers is not None else settings.ACCOUNT_IMPORT_HASHING_WORKERS)
+        self.seen_emails = set()
+        self.received = 0
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def report_errors(self, errors):
+        self.failed += len(errors)
+        errors.sort(key=lambda error: error['line'])
+        self.errors.extend(errors[:self.max_reported_errors - len(self.errors)])
+
+    def run(self, records):
+        """
+        Import ``(line_number, record)`` pairs and return a report of the whole run.
+        """
+        started = time.perf_counter()
+        records = iter(records)
+        try:
+            while True:
+                batch = list(islice(records, self.batch_size))
+                if not batch:
+                    break
+                self.import_batch(batch)
+        finally:
+            self.hashers.shutdown()
+        seconds = time.perf_counter() - started
+        return {
+            'received': self.received,
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(self.received / seconds) if seconds else 0,
+        }
+
+    def import_batch(self, batch):
+        self.received += len(batch)
+        rows, errors = [], []
+        for line_number, record in batch:
+            row, row_errors = validate_account_row(record, self.default_role)
+            if row_errors is None and row['key'] in self.seen_emails:
+                row_errors = {'email': ['Duplicate email in this import.']}
+            if row_errors:
+                errors.append({'line': line_number, 'errors': row_errors})
+                continue
+            self.seen_emails.add(row['key'])
+            rows.append((line_number, row))
+
+        rows = self.drop_existing(rows, errors)
+        passwords = iter(self.hashers.make_passwords([row['password'] for _, row in rows if row['password']]))
+        accounts = [
+            Account(username=row['email'], email=row['email'], role=row['role'], first_name=row['first_name'],
+                    last_name=row['last_name'],
+                    password=next(passwords) if row['password'] else make_password(None))
+            for _, row in rows
+        ]
+        try:
+            with transaction.atomic():
+                Account.objects.bulk_create(accounts, batch_size=self.batch_size)
+        except IntegrityError:
+            # Someone registered one of these emails since the check; find out who and insert the rest.
+            kept = {line_number for line_number, _ in self.drop_existing(rows, errors)}
+            pairs = [((line_number, row), account) for (line_number, row), account in zip(rows, accounts)
+                     if line_number in kept]
+            accounts = [account for _, account in pairs]
+            try:
+                with transaction.atomic():
+                    Account.objects.bulk_create(accounts, batch_size=self.batch_size)
+            except IntegrityError:
+                # And again since; the rest go in one at a time, so only the rows still taken fail.
+                accounts = self.create_each(pairs, errors)
+        self.created += len(accounts)
+        self.report_errors(errors)
+        return accounts
+
+    def create_each(self, pairs, errors):
+        created = []
+        for (line_number, _), account in pairs:
+            try:
+                with transaction.atomic():
+                    account.save(force_insert=True)
+            except IntegrityError:
+                errors.append({'line': line_number, 'errors': {'email': ['Email already exists']}})
+            else:
+                created.append(account)
+        return created
+
+    def drop_existing(self, rows, errors):
+        keys = [row['key'] for _, row in rows]
+        taken = set()
+        existing = Account.objects.annotate(email_key=Lower('email'), username_key=Lower('username'))
+        for email, username in existing.filter(Q(email_key__in=keys) | Q(username_key__in=keys)).values_list(
+                'email_key', 'username_key'):
+            taken.update([email, username])
+        for line_number, row in rows:
+            if row['key'] in taken:
+                errors.append({'line': line_number, 'errors': {'email': ['Email already exists']}})
+        return [(line_number, row) for line_number, row in rows if row['key'] not in taken]
+
+
+def save_upload(stream, encoding, chunk_size=64 * 1024):
+    """
+    Copy an uploaded CSV file in ``encoding`` to a UTF-8 file in ``settings.ACCOUNT_IMPORT_DIR`` and return its path.
+
+    Raises ``UnicodeDecodeError``, leaving no file behind, when the upload is not valid ``encoding``.
+    """
+    os.makedirs(settings.ACCOUNT_IMPORT_DIR, exist_ok=True)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', dir=settings.ACCOUNT_IMPORT_DIR,
+                                     suffix='.csv', delete=False) as upload:
+        try:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                upload.write(decoder.decode(chunk))
+            upload.write(decoder.decode(b'', final=True))
+        except UnicodeDecodeError:
+            upload.close()
+            os.remove(upload.name)
+            raise
+    return upload.name
+
+
+def run_import(job_id, path):
+    """
+    Run the queued ``AccountImport`` ``job_id`` over the UTF-8 CSV file at ``path`` and store its report.
+
+    The file is deleted once the import is done. An import that fails keeps it,
+    so ``import_accounts`` can finish the job from the file.
+    """
+    try:
+        job = AccountImport.objects.get(pk=job_id)
+        AccountImport.objects.filter(pk=job_id).update(status=AccountImport.RUNNING)
+        with open(path, encoding='utf-8', newline='') as source:
+            report = AccountImporter(batch_size=job.batch_size, default_role=job.role).run(read_csv_records(source))
+    except Exception:
+        AccountImport.objects.filter(pk=job_id).update(
+            status=AccountImport.FAILED, finished_on=timezone.now(),
+            report={'error': 'The import stopped before the end of the file; accounts created so far are kept. '
+                             'Finish it by running import_accounts over the file.',
+                    'file': path})
+        raise
+    os.remove(path)
+    AccountImport.objects.filter(pk=job_id).update(status=AccountImport.DONE, finished_on=timezone.now(),
+                                                   report=report)
+
+
+class ImportQueue:
+    """
+    One thread running the account imports handed to it in turn.
+
+    A large file takes minutes, far longer than a request may; and one import
+    at a time keeps a process to one hashing pool however many are uploaded.
+    An import whose process exits first stays ``running``, and one that fails
+    is marked ``failed``; either way its file stays in ``settings.ACCOUNT_IMPORT_DIR``.
+    Finish it with the ``import_accounts`` command, which reports the accounts
+    already created and creates the rest.
+    """
+
+    def __init__(self):
+        self._jobs = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, job_id, path):
+        self._jobs.put((job_id, path))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='account-import', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            job_id, path = self._jobs.get()
+            close_old_connections()
+            try:
+                run_import(job_id, path)
+            except Exception:
+                logger.exception('Account import %s failed', job_id)
+            finally:
+                connections.close_all()
+
+
+import_queue = ImportQueue()
@@ -0,0 +1,35 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from common.parsers import read_csv_records
+from user_accounts.ingest import IMPORTABLE_ROLES, AccountImporter
+
+
+class Command(BaseCommand):
+    help = ('Bulk register parents and staff from a CSV file with a header row: email and optionally '
+            'first_name, last_name, role and password.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file to read, '-' for stdin")
+        parser.add_argument('--role', choices=IMPORTABLE_ROLES, default=IMPORTABLE_ROLES[0],
+                            help='Role for rows without one.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processes hashing passwords; defaults to ACCOUNT_IMPORT_HASHING_WORKERS.')
+
+    def handle(self, *args, **options):
+        source = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8', newline='')
+        try:
+            report = AccountImporter(batch_size=options['batch_size'], default_role=options['role'],
+                                     hashing_workers=options['workers']).run(read_csv_records(source))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {json.dumps(error['errors'])}")
+        self.stdout.write(
+            f"Imported {report['created']} of {report['received']} accounts "
+            f"({report['failed']} failed) in {report['seconds']}s, {report['rows_per_second']} rows/s")
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_accounts', '0003_alter_account_role'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['role', 'id'], name='account_role_id_idx'),
+        ),
+    ]
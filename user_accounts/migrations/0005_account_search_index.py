@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from user_accounts.search import create_account_search_index, drop_account_search_index
+
+
+def create_index(apps, schema_editor):
+    create_account_search_index(schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    drop_account_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_accounts', '0004_account_role_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
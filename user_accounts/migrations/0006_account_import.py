@@ -0,0 +1,25 @@
+# Generated by Django 4.2.11 on 2026-10-18 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_accounts', '0005_account_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='queued', max_length=10)),
+                ('role', models.CharField(choices=[('admin', 'ADMIN'), ('manager', 'MANAGER'), ('staff', 'STAFF'), ('parent', 'PARENT')], max_length=20)),
+                ('batch_size', models.PositiveIntegerField()),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('report', models.JSONField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -18,6 +18,8 @@ class Account(AbstractUser):
 
         indexes = [
             models.Index(fields=['email']),
+            # Account lists page through one role in id order.
+            models.Index(fields=['role', 'id'], name='account_role_id_idx'),
         ]
         constraints = [
             models.UniqueConstraint(fields=['email'], name='unique_email'),  # Add unique constraint to the email field
@@ -25,3 +27,17 @@ class Account(AbstractUser):
     # Other fields and methods...
 
 
+class AccountImport(models.Model):
+    """
+    A bulk account import, run in the background by ``user_accounts.ingest.import_queue``.
+    """
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+    status = models.CharField(max_length=10, default=QUEUED,
+                              choices=[(status, status) for status in [QUEUED, RUNNING, DONE, FAILED]])
+    role = models.CharField(max_length=20, choices=[(role.value, role.name) for role in UserRole])
+    batch_size = models.PositiveIntegerField()
+    created_on = models.DateTimeField(auto_now_add=True)
+    finished_on = models.DateTimeField(blank=True, null=True)
+    # The importer's report once done, or the reason it failed.
+    report = models.JSONField(blank=True, null=True)
@@ -0,0 +1,8 @@
+from django.conf import settings
+
+from common.pagination import KeysetPagination
+
+
+class AccountPagination(KeysetPagination):
+    page_size = settings.ACCOUNT_PAGE_SIZE
+    max_page_size = settings.ACCOUNT_MAX_PAGE_SIZE
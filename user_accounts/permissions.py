@@ -11,3 +11,12 @@ class IsAdminUser(BasePermission):
     def has_permission(self, request, view):
         # Check if the user is authenticated and has 'admin' role
         return request.user.is_authenticated and request.user.role == UserRole.ADMIN.value
+
+
+class IsStaffUser(BasePermission):
+    """
+    Allow users with the 'staff' or 'admin' role.
+    """
+
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and request.user.role in [UserRole.STAFF.value, UserRole.ADMIN.value]
@@ -0,0 +1,139 @@
+from django.db import connection
+from django.db.models import Q
+
+from common.search import search_terms
+
+SQLITE_CREATE_ACCOUNT_INDEX = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS user_accounts_account_fts USING fts5(
+        first_name, last_name, email,
+        content='user_accounts_account', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_accounts_account_fts_insert AFTER INSERT ON user_accounts_account BEGIN
+        INSERT INTO user_accounts_account_fts(rowid, first_name, last_name, email)
+        VALUES (new.id, new.first_name, new.last_name, new.email);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_accounts_account_fts_delete AFTER DELETE ON user_accounts_account BEGIN
+        INSERT INTO user_accounts_account_fts(user_accounts_account_fts, rowid, first_name, last_name, email)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS user_accounts_account_fts_update
+    AFTER UPDATE OF first_name, last_name, email ON user_accounts_account BEGIN
+        INSERT INTO user_accounts_account_fts(user_accounts_account_fts, rowid, first_name, last_name, email)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.email);
+        INSERT INTO user_accounts_account_fts(rowid, first_name, last_name, email)
+        VALUES (new.id, new.first_name, new.last_name, new.email);
+    END
+    """,
+    "INSERT INTO user_accounts_account_fts(user_accounts_account_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP_ACCOUNT_INDEX = [
+    "DROP TRIGGER IF EXISTS user_accounts_account_fts_insert",
+    "DROP TRIGGER IF EXISTS user_accounts_account_fts_delete",
+    "DROP TRIGGER IF EXISTS user_accounts_account_fts_update",
+    "DROP TABLE IF EXISTS user_accounts_account_fts",
+]
+
+# Prefix matches on lowercased columns; varchar_pattern_ops lets LIKE 'abc%' use the btree under any collation.
+PG_ACCOUNT_COLUMNS = ['first_name', 'last_name', 'email']
+
+PG_CREATE_ACCOUNT_INDEX = [
+    f"CREATE INDEX IF NOT EXISTS user_accounts_account_{column}_prefix_idx "
+    f"ON user_accounts_account (lower({column}) varchar_pattern_ops)"
+    for column in PG_ACCOUNT_COLUMNS
+]
+
+PG_DROP_ACCOUNT_INDEX = [
+    f"DROP INDEX IF EXISTS user_accounts_account_{column}_prefix_idx" for column in PG_ACCOUNT_COLUMNS
+]
+
+
+def create_account_search_index(schema_editor):
+    """
+    Create the prefix search index for Account on backends that have one.
+
+    SQLite drops triggers whenever Django rebuilds a table, so migrations that
+    alter user_accounts_account must call this again afterwards; it is idempotent.
+    """
+    statements = {
+        'sqlite': SQLITE_CREATE_ACCOUNT_INDEX,
+        'postgresql': PG_CREATE_ACCOUNT_INDEX,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_account_search_index(schema_editor):
+    statements = {
+        'sqlite': SQLITE_DROP_ACCOUNT_INDEX,
+        'postgresql': PG_DROP_ACCOUNT_INDEX,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def like_prefix(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def search_account_ids(query, limit, role=None):
+    """
+    Ids of accounts matching every term of ``query`` as a prefix, oldest first.
+
+    What a term matches depends on the database:
+
+    * SQLite: the start of any word of the first name, last name or email,
+      accents folded, so ``diaz`` finds ``ana.diaz@example.com`` and
+      ``andre`` finds André.
+    * PostgreSQL: the start of the whole lowercased column only, accents
+      kept, so ``diaz`` finds neither that email nor the last name Díaz.
+      That is what the ``lower(column)`` btree indexes can answer; word and
+      accent-insensitive matching would need ``pg_trgm`` and ``unaccent``.
+
+    Ordered by id rather than relevance so the scan stops after ``limit``
+    matches even for a one-letter query on a large table.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    role_filter, role_params = ('AND a.role = %s', [role]) if role else ('', [])
+
+    if connection.vendor == 'sqlite':
+        sql = f"""
+            SELECT a.id FROM user_accounts_account_fts
+            JOIN user_accounts_account a ON a.id = user_accounts_account_fts.rowid
+            WHERE user_accounts_account_fts MATCH %s {role_filter}
+            ORDER BY user_accounts_account_fts.rowid
+            LIMIT %s
+        """
+        params = [' '.join(f'"{term}"*' for term in terms), *role_params, limit]
+    elif connection.vendor == 'postgresql':
+        term_filter = ' AND '.join(
+            '(' + ' OR '.join(f"lower(a.{column}) LIKE %s" for column in PG_ACCOUNT_COLUMNS) + ')' for _ in terms)
+        sql = f"""
+            SELECT a.id FROM user_accounts_account a
+            WHERE {term_filter} {role_filter}
+            ORDER BY a.id
+            LIMIT %s
+        """
+        params = [like_prefix(term) for term in terms for _ in PG_ACCOUNT_COLUMNS] + role_params + [limit]
+    else:
+        from user_accounts.models import Account
+
+        queryset = Account.objects.filter(role=role) if role else Account.objects.all()
+        for term in terms:
+            queryset = queryset.filter(Q(first_name__istartswith=term) | Q(last_name__istartswith=term) |
+                                       Q(email__istartswith=term))
+        return list(queryset.order_by('id').values_list('id', flat=True)[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
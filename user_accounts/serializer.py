@@ -3,7 +3,8 @@ from django.contrib.auth.models import User
 from rest_framework import serializers
 from django.core.exceptions import ValidationError
 
-from user_accounts.models import Account
+from user_accounts import hashing
+from user_accounts.models import Account, AccountImport
 
 from rest_framework import serializers
 
@@ -38,9 +39,12 @@ class AccountWriteSerializer(serializers.ModelSerializer):
         """
         Create a new user.
         """
-        validated_data['username'] = validated_data['email']
-        # user = super().create(validated_data)
-        user = Account.objects.create_user(**validated_data)
+        # Normalized as create_user would; it is not used because it would hash in the request thread.
+        validated_data['username'] = Account.normalize_username(validated_data['email'])
+        validated_data['email'] = Account.objects.normalize_email(validated_data['email'])
+        # Hashed in the worker pool.
+        validated_data['password'] = hashing.make_password(validated_data['password'])
+        user = Account.objects.create(**validated_data)
         return user
 
 
@@ -49,4 +53,12 @@ class AccountReadSerializer(serializers.ModelSerializer):
     class Meta:
         model = Account
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'role']
-        read_only_fields = fields
\ No newline at end of file
+        read_only_fields = fields
+
+
+class AccountImportSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = AccountImport
+        fields = ['id', 'status', 'role', 'batch_size', 'created_on', 'finished_on', 'report']
+        read_only_fields = fields
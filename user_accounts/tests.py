@@ -1,3 +1,380 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import hashers
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient, APIRequestFactory
+
+from auth_service.authenticate import ClaimsRefreshToken
+from common.constants import UserRole
+from common.parsers import read_csv_records
+from user_accounts import hashing
+from user_accounts.hashing import HashingBusy, PasswordHasherPool
+from user_accounts.ingest import AccountImporter
+from user_accounts.models import Account, AccountImport
+from user_accounts.urls import viewset_views
+
+
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.account = Account.objects.create_user(
+            username='parent@example.com', email='parent@example.com', password='secret', role=UserRole.PARENT.value)
+
+    def login(self, password='secret'):
+        return self.client.post('/user_accounts/login/', {'email': 'parent@example.com', 'password': password})
+
+    def test_login_and_registration_hash_in_worker_processes(self):
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login('wrong').status_code, 400)
+
+        response = self.client.post('/user_accounts/accounts/register/parent/', {
+            'email': 'new@example.com', 'password': 'fresh', 'first_name': 'Ana', 'last_name': 'Diaz',
+            'role': UserRole.PARENT.value})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Account.objects.get(email='new@example.com').check_password('fresh'))
+
+    def test_registration_normalizes_like_create_user(self):
+        response = self.client.post('/user_accounts/accounts/register/parent/', {
+            'email': 'New@EXAMPLE.com', 'password': 'fresh', 'role': UserRole.PARENT.value})
+        self.assertEqual(response.status_code, 201)
+
+        account = Account.objects.get(pk=response.json()['id'])
+        self.assertEqual(account.email, 'New@example.com')
+        self.assertEqual(account.username, Account.normalize_username('New@EXAMPLE.com'))
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        self.account.password = hashers.make_password('secret', hasher='pbkdf2_sha1')
+        self.account.save()
+
+        self.assertEqual(self.login().status_code, 200)
+        self.account.refresh_from_db()
+        self.assertTrue(self.account.password.startswith('pbkdf2_sha256$'))
+
+    def test_unknown_email_is_hashed_in_the_pool(self):
+        pool = PasswordHasherPool(workers=0)
+        with mock.patch.object(hashing, 'password_hasher', pool), \
+                mock.patch.object(pool, 'run', wraps=pool.run) as run, \
+                mock.patch('django.contrib.auth.backends.ModelBackend.authenticate') as model_backend:
+            response = self.client.post('/user_accounts/login/', {'email': 'nobody@example.com', 'password': 'secret'})
+
+        self.assertEqual(response.status_code, 400)
+        run.assert_called_once_with(hashers.make_password, 'secret')
+        model_backend.assert_not_called()
+
+    def test_requests_past_the_cap_are_turned_away(self):
+        pool = PasswordHasherPool(workers=0, max_pending=1)
+        started, release = threading.Event(), threading.Event()
+
+        def hold():
+            started.set()
+            release.wait(5)
+
+        holder = threading.Thread(target=pool.run, args=(hold,))
+        holder.start()
+        started.wait(5)
+        try:
+            with self.assertRaises(HashingBusy):
+                pool.run(hashers.make_password, 'secret')
+            with mock.patch.object(hashing, 'password_hasher', pool):
+                response = self.login()
+        finally:
+            release.set()
+            holder.join()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertTrue(pool.run(hashers.check_password, 'secret', self.account.password))
+
+
+class AccountImportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = Account.objects.create_user(
+            username='admin@example.com', email='admin@example.com', password='secret', role=UserRole.ADMIN.value)
+        self.client.force_authenticate(self.admin)
+
+    def post(self, lines, **params):
+        url = '/user_accounts/accounts/bulk/'
+        if params:
+            url += '?' + '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.post(url, '\n'.join(lines), content_type='text/csv')
+
+    def test_import_reports_per_row_errors(self):
+        lines = [
+            'email,first_name,last_name,role,password',
+            'ana@example.com,Ana,Diaz,,fresh',
+            'ANA@example.COM,Ana,Again,,',
+            'Admin@example.com,Ad,Min,,',
+            'not-an-email,,,,',
+            ',,,,',
+            'Raj@Example.com,Raj,,staff,',
+            'lee@example.com,Lee,,admin,',
+            'ana@example.com,Ana,Twice,,',
+        ]
+
+        report = AccountImporter(batch_size=2).run(read_csv_records(lines))
+
+        self.assertEqual((report['received'], report['created']), (7, 2))
+        self.assertEqual([error['line'] for error in report['errors']], [3, 4, 5, 8, 9])
+        self.assertEqual(report['errors'][0]['errors'], {'email': ['Duplicate email in this import.']})
+        self.assertEqual(report['errors'][1]['errors'], {'email': ['Email already exists']})
+        self.assertIn('role', report['errors'][3]['errors'])
+        self.assertEqual(report['errors'][4]['errors'], {'email': ['Duplicate email in this import.']})
+        self.assertTrue(Account.objects.get(email='ana@example.com').check_password('fresh'))
+        self.assertEqual(Account.objects.get(email='Raj@example.com').role, UserRole.STAFF.value)
+        self.assertEqual(Account.objects.count(), 3)
+
+    def test_rows_taken_again_after_the_recheck_are_reported(self):
+        importer = AccountImporter(hashing_workers=0)
+        records = [(2, {'email': 'ana@example.com'}), (3, {'email': 'admin@example.com'})]
+
+        # As if admin@example.com were registered again between each check and insert.
+        with mock.patch.object(importer, 'drop_existing', side_effect=lambda rows, errors: rows):
+            report = importer.run(records)
+
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(report['errors'], [{'line': 3, 'errors': {'email': ['Email already exists']}}])
+        self.assertTrue(Account.objects.filter(email='ana@example.com').exists())
+
+    def test_existing_emails_checked_once_per_batch(self):
+        records = [(line, {'email': f'parent{line}@example.com'}) for line in range(2, 102)]
+
+        # Per batch: one IN query and the insert inside its savepoint.
+        with self.assertNumQueries(2 * 4):
+            report = AccountImporter(batch_size=50, hashing_workers=0).run(records)
+
+        self.assertEqual(report['created'], 100)
+        self.assertEqual(Account.objects.filter(role=UserRole.PARENT.value).count(), 100)
+
+    def test_requires_admin_and_valid_parameters(self):
+        self.assertEqual(self.post(['email'], role='admin').status_code, 400)
+        self.assertEqual(self.post(['email'], batch_size=0).status_code, 400)
+        self.assertEqual(self.client.post('/user_accounts/accounts/bulk/', {'email': 'x@example.com'},
+                                          format='json').status_code, 415)
+        self.assertEqual(self.client.get('/user_accounts/accounts/bulk/1/').status_code, 404)
+
+        self.client.force_authenticate(Account.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='secret', role=UserRole.STAFF.value))
+        self.assertEqual(self.post(['email', 'x@example.com']).status_code, 403)
+        self.assertEqual(self.client.get('/user_accounts/accounts/bulk/1/').status_code, 403)
+        self.assertFalse(AccountImport.objects.exists())
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as source:
+            source.write('email,first_name\nana@example.com,Ana\nraj@example.com,Raj\n')
+            source.flush()
+            out = StringIO()
+            call_command('import_accounts', source.name, role='staff', workers=0, stdout=out, stderr=StringIO())
+
+        self.assertIn('Imported 2 of 2 accounts', out.getvalue())
+        self.assertEqual(set(Account.objects.filter(role=UserRole.STAFF.value).values_list('first_name', flat=True)),
+                         {'Ana', 'Raj'})
+
+
+class AccountImportJobTests(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(Account.objects.create_user(
+            username='admin@example.com', email='admin@example.com', password='secret', role=UserRole.ADMIN.value))
+
+    def wait_for(self, response):
+        for _ in range(250):
+            job = self.client.get(response['Location']).data
+            if job['status'] in [AccountImport.DONE, AccountImport.FAILED]:
+                return job
+            time.sleep(0.02)
+        return job
+
+    def test_upload_is_imported_in_the_background(self):
+        upload_dir = tempfile.mkdtemp()
+        with self.settings(ACCOUNT_IMPORT_DIR=upload_dir):
+            response = self.client.post('/user_accounts/accounts/bulk/?role=staff',
+                                        'email,first_name\nana@example.com,Ana\nnot-an-email,\n',
+                                        content_type='text/csv')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], AccountImport.QUEUED)
+        job = self.wait_for(response)
+
+        self.assertEqual(job['status'], AccountImport.DONE)
+        self.assertEqual((job['report']['created'], job['report']['failed']), (1, 1))
+        self.assertEqual(Account.objects.get(email='ana@example.com').role, UserRole.STAFF.value)
+        self.assertEqual(os.listdir(upload_dir), [])
+
+    def test_upload_is_decoded_with_its_charset(self):
+        body = 'email,first_name\njose@example.com,Jos\u00e9\n'.encode('latin-1')
+        with self.settings(ACCOUNT_IMPORT_DIR=tempfile.mkdtemp()):
+            response = self.client.post('/user_accounts/accounts/bulk/', body, content_type='text/csv; charset=latin-1')
+            self.assertEqual(self.wait_for(response)['status'], AccountImport.DONE)
+
+            invalid = self.client.post('/user_accounts/accounts/bulk/', body, content_type='text/csv')
+
+        self.assertEqual(Account.objects.get(email='jose@example.com').first_name, 'Jos\u00e9')
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual(invalid.data, {'error': 'The file is not valid utf-8'})
+
+    def test_failed_import_keeps_its_file(self):
+        upload_dir = tempfile.mkdtemp()
+        with self.settings(ACCOUNT_IMPORT_DIR=upload_dir), \
+                mock.patch.object(AccountImporter, 'run', side_effect=RuntimeError('worker died')), \
+                self.assertLogs('user_accounts.ingest', 'ERROR'):
+            response = self.client.post('/user_accounts/accounts/bulk/', 'email\nana@example.com\n',
+                                        content_type='text/csv')
+            job = self.wait_for(response)
+
+        self.assertEqual(job['status'], AccountImport.FAILED)
+        path = job['report']['file']
+        self.assertEqual(os.listdir(upload_dir), [os.path.basename(path)])
+        call_command('import_accounts', path, workers=0, stdout=StringIO(), stderr=StringIO())
+        self.assertTrue(Account.objects.filter(email='ana@example.com').exists())
+
+
+class AccountListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = Account.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='secret', role=UserRole.STAFF.value)
+        Account.objects.bulk_create([
+            Account(username=f'parent{index}@example.com', email=f'parent{index}@example.com',
+                    first_name=f'Parent {index}', role=UserRole.PARENT.value, password='!')
+            for index in range(5)
+        ])
+        self.parent_ids = list(Account.objects.filter(role=UserRole.PARENT.value).order_by('-id')
+                               .values_list('id', flat=True))
+        self.client.force_authenticate(self.staff)
+
+    def test_pages_through_one_role_with_a_query_per_page(self):
+        with self.assertNumQueries(1):
+            first = self.client.get('/user_accounts/accounts/', {'role': UserRole.PARENT.value, 'page_size': 3})
+        second = self.client.get(first.json()['next'])
+
+        self.assertEqual([user['id'] for user in first.json()['results']], self.parent_ids[:3])
+        self.assertEqual([user['id'] for user in second.json()['results']], self.parent_ids[3:])
+        self.assertIsNone(second.json()['next'])
+        self.assertEqual(first.json()['results'][0], {
+            'id': self.parent_ids[0], 'username': 'parent4@example.com', 'email': 'parent4@example.com',
+            'first_name': 'Parent 4', 'last_name': '', 'role': UserRole.PARENT.value})
+
+    def test_invalid_role_or_cursor(self):
+        self.assertEqual(self.client.get('/user_accounts/accounts/', {'role': 'guest'}).status_code, 400)
+        self.assertEqual(self.client.get('/user_accounts/accounts/', {'role': UserRole.PARENT.value,
+                                                                      'before': 'x'}).status_code, 400)
+
+
+class AsyncAccountViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.factory = APIRequestFactory()
+        self.staff = Account.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='secret', first_name='Sam',
+            role=UserRole.STAFF.value)
+        Account.objects.create_user(username='parent@example.com', email='parent@example.com', password='secret',
+                                    role=UserRole.PARENT.value)
+        self.auth = f'Token {ClaimsRefreshToken.for_user(self.staff).access_token}'
+
+    def assertSameAsViewset(self, route, path, params=None, auth=None, **kwargs):
+        extra = {'HTTP_AUTHORIZATION': auth} if auth else {}
+        response = self.client.get(path, params, **extra)
+        expected = viewset_views[route](self.factory.get(path, params, **extra), **kwargs).render()
+
+        self.assertEqual((response.status_code, response.content), (expected.status_code, expected.content))
+        self.assertEqual(response.get('WWW-Authenticate'), expected.get('WWW-Authenticate'))
+        return response
+
+    def test_async_views_answer_like_the_viewset(self):
+        self.assertTrue(settings.ASYNC_READ_VIEWS)
+        path = f'/user_accounts/accounts/{self.staff.id}/'
+        self.assertSameAsViewset('account-list', '/user_accounts/accounts/', {'role': UserRole.PARENT.value},
+                                 self.auth)
+        self.assertSameAsViewset('account-list', '/user_accounts/accounts/', {'role': 'guest'}, self.auth)
+        self.assertSameAsViewset('account-list', '/user_accounts/accounts/', {'role': UserRole.PARENT.value,
+                                                                              'before': 'x'}, self.auth)
+        with self.assertNumQueries(0):
+            detail = self.assertSameAsViewset('account-detail', path, auth=self.auth, pk=str(self.staff.id))
+        self.assertEqual(detail.json()['first_name'], 'Sam')
+
+    def test_authentication_failures_match_the_viewset(self):
+        for auth in [None, 'Token not-a-jwt']:
+            response = self.assertSameAsViewset('account-list', '/user_accounts/accounts/',
+                                                {'role': UserRole.PARENT.value}, auth)
+            self.assertEqual(response.status_code, 401)
+
+    def test_other_methods_reach_the_viewset(self):
+        self.client.credentials(HTTP_AUTHORIZATION=self.auth)
+
+        response = self.client.patch(f'/user_accounts/accounts/{self.staff.id}/', {'first_name': 'Samuel', 'role': UserRole.STAFF.value})
+
+        self.assertEqual(response.status_code, 200)
+        self.staff.refresh_from_db()
+        self.assertEqual(self.staff.first_name, 'Samuel')
+
+
+class AccountSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = Account.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='secret', first_name='Sam',
+            role=UserRole.STAFF.value)
+        self.ana = Account.objects.create_user(
+            username='ana.diaz@example.com', email='ana.diaz@example.com', password='secret', first_name='Ana',
+            last_name='Díaz', role=UserRole.PARENT.value)
+        self.andre = Account.objects.create_user(
+            username='andre@example.com', email='andre@example.com', password='secret', first_name='André',
+            last_name='Silva', role=UserRole.PARENT.value)
+        self.client.force_authenticate(self.staff)
+
+    def search(self, **params):
+        return self.client.get('/user_accounts/accounts/search/', params)
+
+    def ids(self, **params):
+        return [user['id'] for user in self.search(**params).data['results']]
+
+    def test_prefix_search_over_names_and_email(self):
+        response = self.search(q='an')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['id'] for user in response.data['results']], [self.ana.id, self.andre.id])
+        self.assertEqual(response.data['results'][0]['email'], 'ana.diaz@example.com')
+        self.assertEqual(self.ids(q='andre sil'), [self.andre.id])
+        self.assertEqual(self.ids(q='ana.d'), [self.ana.id])
+
+    @skipUnless(connection.vendor == 'sqlite', 'Word and accent-insensitive matching is SQLite only')
+    def test_sqlite_matches_any_word_without_accents(self):
+        self.assertEqual(self.ids(q='diaz'), [self.ana.id])
+        self.assertEqual(self.ids(q='example'), [self.staff.id, self.ana.id, self.andre.id])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Whole-column prefixes are the PostgreSQL matching')
+    def test_postgresql_matches_whole_column_prefixes(self):
+        self.assertEqual(self.ids(q='diaz'), [])
+        self.assertEqual(self.ids(q='díaz'), [self.ana.id])
+        self.assertEqual(self.ids(q='example'), [])
+        self.assertEqual(self.ids(q='andré'), [self.andre.id])
+
+    def test_role_filter_and_limit(self):
+        self.assertEqual(self.ids(q='s', role=UserRole.STAFF.value), [self.staff.id])
+        self.assertEqual(self.ids(q='a', limit=1), [self.ana.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.ana.first_name = 'Beatriz'
+        self.ana.save()
+        self.andre.delete()
+
+        self.assertEqual(self.ids(q='an'), [self.ana.id])  # Still by email.
+        self.assertEqual(self.ids(q='andr'), [])
+        self.assertEqual(self.ids(q='bea'), [self.ana.id])
+
+    def test_requires_staff_and_a_query(self):
+        self.assertEqual(self.search(q=' ').status_code, 400)
+        self.assertEqual(self.search(q='an', role='guest').status_code, 400)
+        self.assertEqual(self.search(q='an', limit='x').status_code, 400)
+
+        self.client.force_authenticate(self.ana)
+        self.assertEqual(self.search(q='an').status_code, 403)
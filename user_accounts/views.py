@@ -1,16 +1,29 @@
+import io
+
+from django.conf import settings
 from django.contrib.auth import authenticate
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status, viewsets
+from rest_framework.exceptions import UnsupportedMediaType
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.reverse import reverse
 from rest_framework_simplejwt.exceptions import TokenError
 
+from auth_service.authenticate import ClaimsRefreshToken
+from common.async_api import async_read_view, json_response
+from common.compiled import compile_read_serializer
 from common.constants import UserRole, CommonConstants
-from user_accounts.models import Account
-from user_accounts.serializer import AccountWriteSerializer, LoginSerializer, AccountReadSerializer
+from common.parsers import CSVParser
+from user_accounts.ingest import IMPORTABLE_ROLES, import_queue, save_upload
+from user_accounts.models import Account, AccountImport
+from user_accounts.pagination import AccountPagination
+from user_accounts.permissions import IsAdminUser, IsStaffUser
+from user_accounts.search import search_account_ids
+from user_accounts.serializer import (AccountImportSerializer, AccountReadSerializer, AccountWriteSerializer,
+                                      LoginSerializer)
 from rest_framework.decorators import action
 
 class LoginView(APIView):
@@ -34,7 +47,7 @@ class LoginView(APIView):
             if user:
                 # Generate JWT token
 
-                refresh = RefreshToken.for_user(user)
+                refresh = ClaimsRefreshToken.for_user(user)
                 # Retrieve user role
                 role = user.role if hasattr(user, 'role') else None
                 id = user.id if user else None
@@ -67,7 +80,7 @@ class LogoutView(APIView):
     def post(self, request):
         try:
             refresh_token = request.data['refresh']
-            token = RefreshToken(refresh_token)
+            token = ClaimsRefreshToken(refresh_token)
             token.blacklist()
             return Response({'message': 'Successfully logged out'})
         except TokenError:
@@ -97,6 +110,18 @@ class ProtectedView(APIView):
 class AccountViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     queryset = Account.objects.all()
+    pagination_class = AccountPagination
+    max_import_batch_size = 5000
+    search_page_size = 10
+    search_max_page_size = 50
+    # Most queries one request to each action may make (see common.budgets); bulk_import queries once per batch,
+    # and destroying an account with more than 100 messages cascades over its budget, like a busy category.
+    query_budgets = {
+        'list': 1, 'retrieve': 1, 'search': 2, 'create': 2, 'update': 4, 'partial_update': 3, 'destroy': 12,
+        'register_parent': 2, 'register_staff': 2, 'bulk_import_status': 1,
+    }
+    # Read from a replica when there are any (see common.replicas).
+    replica_actions = ['list', 'retrieve']
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
@@ -140,6 +165,81 @@ class AccountViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @swagger_auto_schema(
+        operation_summary="Bulk register parents and staff from CSV",
+        operation_description='Header row with email and optionally first_name, last_name, role and password. '
+                              'Rows without a password get an unusable one. Invalid and duplicate rows are '
+                              'reported and skipped. The file is imported in the background; the response '
+                              'gives the import id and, in Location, where to follow it.',
+        responses={status.HTTP_202_ACCEPTED: 'Import queued.'},
+        manual_parameters=[
+            openapi.Parameter('role', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=IMPORTABLE_ROLES,
+                              description='Role for rows without one'),
+            openapi.Parameter('batch_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ]
+    )
+    @action(methods=["POST"], detail=False, url_path='bulk', permission_classes=[IsAdminUser],
+            parser_classes=[CSVParser])
+    def bulk_import(self, request, *args, **kwargs):
+        role = request.query_params.get('role', UserRole.PARENT.value)
+        batch_size = request.query_params.get('batch_size', '1000')
+        if role not in IMPORTABLE_ROLES:
+            return Response({'error': 'Invalid role'}, status=status.HTTP_400_BAD_REQUEST)
+        if not batch_size.isdigit() or not 0 < int(batch_size) <= self.max_import_batch_size:
+            return Response({'error': 'Invalid batch size'}, status=status.HTTP_400_BAD_REQUEST)
+        # The body is saved to disk unparsed; CSVParser only decides which content types are accepted.
+        if request.negotiator.select_parser(request, request.parsers) is None:
+            raise UnsupportedMediaType(request.content_type)
+
+        encoding = request.encoding or settings.DEFAULT_CHARSET
+        try:
+            path = save_upload(request.stream or io.BytesIO(), encoding)
+        except UnicodeDecodeError:
+            return Response({'error': f'The file is not valid {encoding}'}, status=status.HTTP_400_BAD_REQUEST)
+        job = AccountImport.objects.create(role=role, batch_size=int(batch_size))
+        import_queue.submit(job.pk, path)
+        location = reverse('account-bulk-import-status', kwargs={'job_id': job.pk}, request=request)
+        return Response(AccountImportSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': location})
+
+    @swagger_auto_schema(operation_summary="Progress and report of a bulk account import")
+    @action(methods=["GET"], detail=False, url_path=r'bulk/(?P<job_id>[0-9]+)', url_name='bulk-import-status',
+            permission_classes=[IsAdminUser])
+    def bulk_import_status(self, request, job_id, *args, **kwargs):
+        job = AccountImport.objects.filter(pk=job_id).first()
+        if job is None:
+            return Response({'error': 'Import not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(AccountImportSerializer(job).data, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_summary="Type-ahead search over account names and emails",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                              description='Every word must start a first name, last name or email'),
+            openapi.Parameter('role', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='User role'),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ]
+    )
+    @action(methods=["GET"], detail=False, permission_classes=[IsStaffUser])
+    def search(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        role = request.query_params.get('role')
+        if not query:
+            return Response({'error': 'Search text is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if role is not None and role not in [role.value for role in UserRole]:
+            return Response({'error': 'Invalid role'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', self.search_page_size)), self.search_max_page_size)
+        except ValueError:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = search_account_ids(query, limit, role)
+        rows = compile_read_serializer(AccountReadSerializer)
+        users = {user['id']: user for user in rows.serialize(rows.values(Account.objects.filter(id__in=ids)))}
+        return Response({'results': [users[pk] for pk in ids if pk in users]}, status=status.HTTP_200_OK)
+
     @swagger_auto_schema(
         operation_summary="Get details of the users by role",
         responses={status.HTTP_201_CREATED: AccountReadSerializer},
@@ -152,6 +252,11 @@ class AccountViewSet(viewsets.ModelViewSet):
                 required=True
             ),
             openapi.Parameter('role', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='User role'),
+            openapi.Parameter('before', openapi.IN_QUERY, description="Only users older than this user ID",
+                              type=openapi.TYPE_INTEGER),
+            openapi.Parameter('after', openapi.IN_QUERY, description="Only users newer than this user ID",
+                              type=openapi.TYPE_INTEGER),
+            openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
         ]
     )
     def list(self, request, *args, **kwargs):
@@ -159,9 +264,10 @@ class AccountViewSet(viewsets.ModelViewSet):
         if role not in [role.value for role in UserRole]:
             return Response({'error': 'Invalid role'}, status=status.HTTP_400_BAD_REQUEST)
 
-        users = self.get_queryset().filter(role=role)
-        serializer = self.get_serializer(users, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Rows go straight from values_list() tuples to AccountReadSerializer's output, without model instances.
+        rows = compile_read_serializer(AccountReadSerializer)
+        users = self.paginate_queryset(rows.values(self.get_queryset().filter(role=role)))
+        return self.get_paginated_response(rows.serialize(users))
 
     @swagger_auto_schema(
         responses={status.HTTP_201_CREATED: AccountReadSerializer},
@@ -205,4 +311,28 @@ class AccountViewSet(viewsets.ModelViewSet):
         serializer.fields.pop('email')
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+@async_read_view(AccountViewSet)
+async def account_list(request):
+    """
+    Async ``AccountViewSet.list``.
+    """
+    role = request.query_params.get('role', None)
+    if role not in [role.value for role in UserRole]:
+        return json_response({'error': 'Invalid role'}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = compile_read_serializer(AccountReadSerializer)
+    paginator = AccountViewSet.pagination_class()
+    users = await paginator.apaginate_queryset(rows.values(Account.objects.filter(role=role)), request)
+    return json_response(paginator.get_paginated_data(rows.serialize(users)))
+
+
+@async_read_view(AccountViewSet)
+async def account_detail(request, pk):
+    """
+    Async ``AccountViewSet.retrieve``, which like it returns the authenticated user whatever ``pk`` is.
+    """
+    rows = compile_read_serializer(AccountReadSerializer)
+    return json_response(rows.converter()(rows.from_instance(request.user)))